@@ -4,8 +4,9 @@ from .uriformatter import URIFormatter
 from .describer import Describer
 from .pdfreader import PDFReader
 from .pdfanalyze import PDFAnalyzer
-from .textreader import TextReader
+from .textreader import TextReader, MmapTextReader
 from .triplestore import TripleStore
+from .selectindex import SelectIndex, AnnotationIndexMixin
 from .fulltextindex import FulltextIndex
 from .documententry import DocumentEntry
 from .fsmparser import FSMParser
@@ -18,6 +19,8 @@ from .resourceloader import ResourceLoader
 from .transformer import Transformer
 from .document import Document
 from .documentstore import DocumentStore
+from .hostlimiter import HostLimiter
+from .pagerenderer import PageRenderer
 from .requesthandler import RequestHandler
 from .documentrepository import DocumentRepository
 from .pdfdocumentrepository import PDFDocumentRepository
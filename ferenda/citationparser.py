@@ -3,10 +3,16 @@ from __future__ import (absolute_import, division,
                         print_function, unicode_literals)
 from builtins import *
 import builtins
+import re
 from copy import copy
 
+import pyparsing
+
 from ferenda.elements import Link, LinkSubject
 
+# renamed in pyparsing 3
+_PositionToken = getattr(pyparsing, '_PositionToken', None) or pyparsing.PositionToken
+
 class CitationParser(object):
 
     """Finds citations to documents and other resources in text
@@ -41,6 +47,8 @@ class CitationParser(object):
 
     def __init__(self, *grammars):
         self._grammars = []
+        self._prefilters = []
+        self._prefilter = None
         for grammar in grammars:
             self.add_grammar(grammar)
         self._formatter = None
@@ -61,6 +69,26 @@ class CitationParser(object):
         :type grammar: ``pyparsing.ParserElement``
         """
         self._grammars.append(grammar)
+        # Find out what text any match of the grammar must start
+        # with, so that parse_string can skip text that can't
+        # possibly contain a citation without running the (slow)
+        # pyparsing scanner over it.
+        pattern = leading_pattern(grammar)
+        if pattern is None:
+            self._prefilters.append(None)
+        else:
+            self._prefilters.append(re.compile(pattern))
+        if None in self._prefilters:
+            self._prefilter = None
+        else:
+            # Prefilters without groups are combined into a single
+            # expression. Those with groups are searched for
+            # separately, since combining them could redefine group
+            # names or renumber backreferences.
+            plain = [p.pattern for p in self._prefilters if not p.groups]
+            self._prefilter = [p for p in self._prefilters if p.groups]
+            if plain:
+                self._prefilter.insert(0, re.compile("|".join(plain)))
 
     def parse_string(self, string, predicate="dcterms:references"):
         """Find any citations in a text string, using the configured grammars.
@@ -76,12 +104,20 @@ class CitationParser(object):
         # (string,pyparsing.ParseResult)
         nodes = [string]
         res = nodes  # if self._grammars is None
-        for grammar in self._grammars:
+        if self._prefilter and not self._could_match(self._prefilter, string):
+            # no grammar can match anywhere in the string. Return
+            # the same thing as if we'd scanned it for every grammar
+            return [string[:]] if string else []
+        for grammar, prefilter in zip(self._grammars, self._prefilters):
             res = []
             for node in nodes:
                 if not isinstance(node, str):
                     res.append(node)
                     continue
+                if prefilter and not self._could_match([prefilter], node, grammar):
+                    if node:
+                        res.append(node[:])
+                    continue
                 matches = grammar.scanString(node)
                 start = 0
                 after = 0
@@ -95,6 +131,16 @@ class CitationParser(object):
             nodes = list(res)
         return res
 
+    def _could_match(self, prefilters, string, grammar=None):
+        # pyparsing expands tabs before scanning unless told not to,
+        # so the prefilters need to look at the same text.
+        if any(p.search(string) for p in prefilters):
+            return True
+        if "\t" in string and (grammar is None or not grammar.keepTabs):
+            string = string.expandtabs()
+            return any(p.search(string) for p in prefilters)
+        return False
+
     def parse_recursive(self, part, predicate="dcterms:references"):
         """Traverse a nested tree of elements, finding citations in
         any strings contained in the tree. Found citations are marked
@@ -163,3 +209,91 @@ class CitationParser(object):
                         res.append(text)
                 # FIXME: concatenate adjacent str nodes
             return res
+
+
+def leading_pattern(grammar):
+    """Returns a regular expression (as a string) that matches the
+    start of anything that *grammar* can match, or None if this can't
+    be determined (or if the grammar can match an empty string). The
+    expression is never stricter than the grammar itself, ie any
+    string where the grammar matches will also be matched by the
+    returned expression.
+
+    :param grammar: The grammar to analyze
+    :type grammar: ``pyparsing.ParserElement``
+    :rtype: str
+    """
+    patterns, nullable = _leading_patterns(grammar, set())
+    if patterns is None or nullable or not patterns:
+        return None
+    # Only one of the combined patterns may contain groups, since
+    # groups in another pattern could have the same name or shift the
+    # numbers that backreferences refer to.
+    if len([p for p in patterns if re.compile(p).groups]) > 1:
+        return None
+    return "|".join(sorted(patterns))
+
+
+def _caseless(string):
+    return "".join("[%s%s]" % (re.escape(c.lower()), re.escape(c.upper()))
+                   if c.lower() != c.upper() else re.escape(c)
+                   for c in string)
+
+
+def _leading_patterns(expr, seen):
+    # Returns a tuple (patterns, nullable) where patterns is a set of
+    # regex strings, one of which must match where expr starts
+    # matching (or None if unknown), and nullable is True if expr
+    # might match without consuming any text, in which case
+    # whatever comes after it might also start the match.
+    if isinstance(expr, str):
+        return set([re.escape(expr)]), expr == ""
+    if isinstance(expr, pyparsing.CaselessLiteral) or getattr(expr, 'caseless', False):
+        return set([_caseless(expr.match)]), expr.match == ""
+    if isinstance(expr, (pyparsing.Literal, pyparsing.Keyword)):
+        return set([re.escape(expr.match)]), expr.match == ""
+    if isinstance(expr, pyparsing.Word):
+        return (set(["[%s]" % "".join(re.escape(c) for c in sorted(expr.initChars))]),
+                False)
+    if isinstance(expr, pyparsing.Regex):
+        # only patterns without flags (including inline ones) can
+        # safely be combined with others
+        if expr.re.flags & ~re.UNICODE:
+            return None, False
+        return set(["(?:%s)" % expr.pattern]), expr.re.match("") is not None
+    if isinstance(expr, (pyparsing.Empty, _PositionToken)):
+        return set(), True
+    if isinstance(expr, pyparsing.And):
+        patterns = set()
+        for subexpr in expr.exprs:
+            subpatterns, nullable = _leading_patterns(subexpr, seen)
+            if subpatterns is None:
+                return None, False
+            patterns |= subpatterns
+            if not nullable:
+                return patterns, False
+        return patterns, True
+    if isinstance(expr, (pyparsing.MatchFirst, pyparsing.Or)):
+        patterns = set()
+        anynullable = False
+        for subexpr in expr.exprs:
+            subpatterns, nullable = _leading_patterns(subexpr, seen)
+            if subpatterns is None:
+                return None, False
+            patterns |= subpatterns
+            anynullable = anynullable or nullable
+        return patterns, anynullable
+    if isinstance(expr, pyparsing.NotAny):
+        return set(), True
+    if isinstance(expr, pyparsing.ParseElementEnhance):
+        if expr.expr is None or id(expr) in seen:
+            # empty or recursive Forward
+            return None, False
+        seen.add(id(expr))
+        patterns, nullable = _leading_patterns(expr.expr, seen)
+        seen.discard(id(expr))
+        if isinstance(expr, (pyparsing.Optional, pyparsing.ZeroOrMore,
+                             pyparsing.FollowedBy)):
+            nullable = True
+        return patterns, nullable
+    return None, False
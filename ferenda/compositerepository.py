@@ -9,7 +9,7 @@ import logging
 from collections import defaultdict, OrderedDict
 
 from ferenda import DocumentRepository, DocumentStore
-from ferenda import util, errors
+from ferenda import util, errors, packfile
 from ferenda.decorators import updateentry
 
 class CompositeStore(DocumentStore):
@@ -313,8 +313,8 @@ class CompositeRepository(DocumentRepository):
             self.log.debug("%s: Attachments are (likely) up-to-date" % basefile)
             return
 
-        util.link_or_copy(instance.store.documententry_path(basefile),
-                          self.store.documententry_path(basefile))
+        packfile.copy(instance.store.documententry_path(basefile),
+                      self.store.documententry_path(basefile))
 
         util.link_or_copy(instance.store.distilled_path(basefile),
                           self.store.distilled_path(basefile))
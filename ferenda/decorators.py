@@ -225,6 +225,8 @@ def render(f):
         self.log.debug(
             '%s triples extracted to %s',
             len(distilled_graph), self.store.distilled_path(doc.basefile, version=doc.version))
+        if 'parsedcache' in self.config and self.config.parsedcache:
+            self.cache_distilled_graph(doc.basefile, distilled_graph, version=doc.version)
 
         # Validate that all required triples are present (we check
         # distilled_graph, but we could just as well check doc.meta)
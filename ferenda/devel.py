@@ -48,7 +48,7 @@ from ferenda import (TextReader, TripleStore, FulltextIndex, WSGIApp,
                      CompositeRepository, DocumentEntry, Transformer,
                      RequestHandler, ResourceLoader)
 from ferenda.elements import serialize
-from ferenda import decorators, util, manager
+from ferenda import decorators, util, manager, packfile
 from ferenda.manager import enable
 from ferenda.requesthandler import login_required
 
@@ -1192,6 +1192,39 @@ class Devel(object):
               (self.config.storetype, self.config.storelocation,
                self.config.storerepository, triplecount, store.triple_count()))
 
+    @decorators.action
+    def deduplicatearchive(self, alias):
+        """Store identical archived downloaded files for a docrepo only once.
+
+        :param alias: Docrepo alias
+        :type  alias: str
+
+        """
+        repo = self._repo_from_alias(alias)
+        saved = repo.store.deduplicate_archive()
+        print("%s: archive deduplicated, %s bytes saved" % (alias, saved))
+
+    @decorators.action
+    def packentries(self, alias, unpack=False):
+        """Move all entry files for a docrepo into a single pack file
+        (or back again), for use with the ``packentries`` option.
+
+        :param alias: Docrepo alias
+        :type  alias: str
+        :param unpack: If set, move files out of the pack instead
+        :type  unpack: str
+
+        """
+        repo = self._repo_from_alias(alias)
+        pack = repo.store.use_pack("entries")
+        if unpack:
+            cnt = pack.export_files()
+            packfile.unregister(pack)
+            print("%s: %s entries moved from %s" % (alias, cnt, pack.filename))
+        else:
+            cnt = pack.import_files()
+            print("%s: %s entries moved to %s" % (alias, cnt, pack.filename))
+
     @decorators.action
     def wsgi(self, path="/"):
         """Runs WSGI calls in-process."""
@@ -1363,10 +1396,10 @@ class Devel(object):
             shutil.copy2(sourcerepo.store.path(basefile, "register", ".html"),
                          dst)
         # also copy the docentry json file
-        if os.path.exists(sourcerepo.store.documententry_path(basefile)):
-            util.ensure_dir(destrepo.store.documententry_path(basefile))
-            shutil.copy(sourcerepo.store.documententry_path(basefile),
-                         destrepo.store.documententry_path(basefile))
+        if packfile.exists(sourcerepo.store.documententry_path(basefile)):
+            packfile.copy(sourcerepo.store.documententry_path(basefile),
+                          destrepo.store.documententry_path(basefile),
+                          link=False)
 
 
     @decorators.action
@@ -1460,11 +1493,11 @@ class Devel(object):
                 # sys.stdout.write(".")
                 # print("%s/%s" % (repo.alias, basefile))
                 entrypath = repo.store.documententry_path(basefile)
-                if not os.path.exists(entrypath):
+                if not packfile.exists(entrypath):
                     log.warning("%s/%s: file %s doesn't exist" % (repo.alias, basefile, entrypath))
                     errcnt += 1
                     continue
-                elif os.path.getsize(entrypath) == 0:
+                elif packfile.getsize(entrypath) == 0:
                     log.warning("%s/%s: file %s is 0 bytes" % (repo.alias, basefile, entrypath))
                     errcnt += 1
                     continue
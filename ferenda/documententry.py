@@ -8,7 +8,6 @@ standard_library.install_aliases()
 from io import StringIO
 from traceback import format_tb
 import datetime
-import hashlib
 import json
 try:
     from json.decoder import JSONDecodeError
@@ -21,7 +20,7 @@ import sys
 from rdflib import Literal
 from rdflib.namespace import RDF
 
-from ferenda import util
+from ferenda import util, packfile
 from ferenda.errors import DocumentRemovedError, DocumentRenamedError
 
 class DocumentEntry(object):
@@ -58,6 +57,10 @@ class DocumentEntry(object):
     orig_url = None
     """The main url from where we fetched this document."""
 
+    orig_checksums = None
+    """A dict with the checksum (on the form ``md5:<hexdigest>``) of
+    each downloaded file for the document, keyed on filename."""
+
     published = None
     """The date our parsed/processed version of the document was published."""
 
@@ -104,34 +107,34 @@ class DocumentEntry(object):
     #           'etag': '234242323424'}]
 
     def __init__(self, path=None):
-        if path and os.path.exists(path) and os.path.getsize(path) > 0:
-            with open(path) as fp:
-                hook = util.make_json_date_object_hook('orig_created',
-                                                       'orig_updated',
-                                                       'orig_checked',
-                                                       'published',
-                                                       'updated',
-                                                       'indexed_ts',
-                                                       'indexed_dep',
-                                                       'indexed_ft',
-                                                       'date')
-                try:
-                    d = json.load(fp, object_hook=hook)
-                except JSONDecodeError as e:
-                    if e.msg == "Extra data":
-                        logging.getLogger("documententry").warning("%s exists but has extra data from pos %s" % (path, e.pos))
-                        fp.seek(0)
-                        jsondata = fp.read(e.pos)
-                        d = json.loads(jsondata, object_hook=hook)
-                    else:
-                        raise e
+        # the entry might be stored in a pack (see ferenda.packfile)
+        # instead of as a separate file
+        data = packfile.read(path) if path else None
+        if data:
+            hook = util.make_json_date_object_hook('orig_created',
+                                                   'orig_updated',
+                                                   'orig_checked',
+                                                   'published',
+                                                   'updated',
+                                                   'indexed_ts',
+                                                   'indexed_dep',
+                                                   'indexed_ft',
+                                                   'date')
+            try:
+                d = json.loads(data, object_hook=hook)
+            except JSONDecodeError as e:
+                if e.msg == "Extra data":
+                    logging.getLogger("documententry").warning("%s exists but has extra data from pos %s" % (path, e.pos))
+                    d = json.loads(data[:e.pos], object_hook=hook)
+                else:
+                    raise e
             if 'summary_type' in d and d['summary_type'] == "html":
                 d['summary'] = Literal(d['summary'], datatype=RDF.XMLLiteral)
                 del d['summary_type']
             self.__dict__.update(d)
             self._path = path
         else:
-            if path and os.path.exists(path):
+            if data is not None:
                 logging.getLogger("documententry").warning("%s exists but is empty" % path)
             self.id = None
             self.basefile = None
@@ -190,11 +193,12 @@ class DocumentEntry(object):
         if isinstance(self.summary, Literal) and self.summary.datatype == RDF.XMLLiteral:
             d["summary_type"] = "html"
 
-        util.ensure_dir(path)
         s = json.dumps(d, default=util.json_default_date, indent=2,
                        separators=(', ', ': '), sort_keys=True)
-        with open(path, "w") as fp:
-            fp.write(s)
+        if not packfile.write(path, s):
+            util.ensure_dir(path)
+            with open(path, "w") as fp:
+                fp.write(s)
 
     # If inline=True, the contents of filename is included in the Atom
     # entry. Otherwise, it just references it.
@@ -247,10 +251,7 @@ class DocumentEntry(object):
 
     def calculate_md5(self, filename):
         """Given a filename, return the md5 value for the file's content."""
-        c = hashlib.md5()
-        with open(filename, 'rb') as fp:
-            c.update(fp.read())
-        return c.hexdigest()
+        return util._file_md5(filename)
 
     def guess_type(self, filename):
         """Given a filename, return a MIME-type based on the file extension."""
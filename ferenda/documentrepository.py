@@ -6,7 +6,8 @@ from builtins import *
 from future.utils import native_str
 
 # stdlib
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from io import BytesIO, StringIO
 from itertools import chain
@@ -18,9 +19,9 @@ import builtins
 import locale
 import calendar
 import codecs
-import difflib
 import filecmp
 import functools
+import hashlib
 import inspect
 import json
 import logging
@@ -39,27 +40,30 @@ from layeredconfig import LayeredConfig, Defaults
 from lxml import etree
 from lxml.etree import Element
 from lxml.builder import ElementMaker
-from rdflib import Graph, Literal, Namespace, URIRef, BNode, RDF, RDFS
+from rdflib import Graph, Literal, Namespace, URIRef, BNode, Variable, RDF, RDFS
+from rdflib.query import Result
 from rdflib.namespace import FOAF, OWL
 from rdflib.collection import Collection
 import bs4
 import lxml.html
 import requests
+import requests.adapters
 import requests.exceptions
 from cached_property import cached_property
 
 # mine
 import ferenda
-from ferenda import util, errors, decorators, fulltextindex
+from ferenda import util, errors, decorators, fulltextindex, graphcache, packfile
 
 from ferenda import (Describer, TripleStore, FulltextIndex, Document,
                      DocumentEntry, TocPageset, TocPage,
                      DocumentStore, Transformer, Facet, Feed, Feedset,
-                     ResourceLoader, RequestHandler)
+                     ResourceLoader, RequestHandler, HostLimiter)
 from ferenda.elements import (Body, Link,
                               UnorderedList, ListItem, Paragraph)
 from ferenda.elements.html import elements_from_soup
-from ferenda.documentstore import RelateNeeded
+from ferenda.documentstore import RelateNeeded, HashManifest
+from ferenda.labelindex import LabelIndex
 # establish two central RDF Namespaces at the top level
 DCTERMS = Namespace(util.ns['dcterms'])
 PROV = Namespace(util.ns['prov'])
@@ -264,6 +268,11 @@ class DocumentRepository(object):
     time, there will exist no current version (in any of its forms, eg
     parsed or generated)."""
 
+    download_chunksize = 65536
+    """The number of bytes read at a time when a downloaded file is
+    written to disk by
+    :py:meth:`~ferenda.DocumentRepository.download_if_needed`."""
+
     download_iterlinks = True
     """If ``True`` (the default),
     :py:meth:`~ferenda.DocumentRepository.download_get_basefiles`
@@ -374,6 +383,8 @@ class DocumentRepository(object):
             self._config = config
         if not hasattr(self, 'store'):
             self.store = self.documentstore_class(self.config.datadir + os.sep + self.alias, compression=self.config.compress)
+            self._setup_hashmanifest()
+            self._setup_archivingpolicy()
         self.requesthandler = self.requesthandler_class(self)
         
         # allow this docrepo to override a particular property of its
@@ -446,9 +457,8 @@ class DocumentRepository(object):
                 continue
             ontopath = "vocab/%s.ttl" % prefix
             if self.resourceloader.exists(ontopath):
-                with self.resourceloader.open(ontopath) as fp:
-                    o.parse(data=fp.read(), format="turtle")                 
-                    o.bind(prefix, uri)
+                self.parse_resource_graph(ontopath, o)
+                o.bind(prefix, uri)
         return o
 
 
@@ -465,10 +475,30 @@ class DocumentRepository(object):
             if hasattr(cls, "alias"):
                 commonpath = "extra/%s.ttl" % cls.alias
                 if self.resourceloader.exists(commonpath):
-                    with self.resourceloader.open(commonpath, binary=True) as fp:
-                        cd.parse(data=fp.read(), format="turtle")                 
+                    self.parse_resource_graph(commonpath, cd)
         return cd
 
+    def parse_resource_graph(self, resourcename, graph=None):
+        """Adds the triples of the Turtle file *resourcename* (found
+        using the resource loader) to *graph*. The file is only parsed
+        once per process (see :py:mod:`ferenda.graphcache`), and if
+        the ``graphcache`` config option is set, the parsed triples
+        are also cached on disk for use by other processes.
+
+        :param resourcename: The name of the resource, eg. ``extra/sfs.ttl``
+        :type  resourcename: str
+        :param graph: The graph to add triples to (if not provided, a
+                      new graph is created)
+        :type  graph: rdflib.Graph
+        :returns: The graph
+        :rtype: rdflib.Graph
+        """
+        cachedir = None
+        if 'graphcache' in self.config and self.config.graphcache:
+            cachedir = self.config.datadir + os.sep + "graphcache"
+        return graphcache.parse(self.resourceloader.filename(resourcename),
+                                graph, cachedir=cachedir)
+
     @property
     def config(self):
         """The :py:class:`~layeredconfig.LayeredConfig` object that contains the
@@ -496,6 +526,19 @@ class DocumentRepository(object):
         if downloaded_suffixes and downloaded_suffixes != self.store.downloaded_suffixes:
             self.store.downloaded_suffixes.clear()
             self.store.downloaded_suffixes.extend(downloaded_suffixes)
+        self._setup_hashmanifest()
+        self._setup_archivingpolicy()
+
+    def _setup_hashmanifest(self):
+        if 'hashmanifest' in self.config and self.config.hashmanifest:
+            self.store.hashmanifest = HashManifest(
+                self.store.resourcepath("hashmanifest.txt"))
+
+    def _setup_archivingpolicy(self):
+        if 'archivingpolicy' in self.config and self.config.archivingpolicy == "blob":
+            self.store.archiving_policy = "blob"
+        if 'packentries' in self.config and self.config.packentries:
+            self.store.use_pack("entries")
 
     def lookup_resource(self, label, predicate=FOAF.name, cutoff=0.8, warn=True):
         """Given a textual identifier (ie. the name for something), lookup the
@@ -511,6 +554,11 @@ class DocumentRepository(object):
         :py:func:`difflib.get_close_matches`) using the cutoff
         parameter determines exactly how fuzzy this matching is.
 
+        The labels for each predicate are indexed (see
+        :py:class:`~ferenda.labelindex.LabelIndex`) the first time
+        they're needed, and the index is rebuilt if commondata
+        changes.
+
         If no resource matches the given label, a
         :py:exc:`KeyError` is raised.
 
@@ -529,22 +577,25 @@ class DocumentRepository(object):
 
         """
 
-        resources = {}
-        for (resource, candidate_label) in self.commondata.subject_objects(predicate):
-            if label == str(candidate_label):
-                return resource
-            else:
-                resources[str(candidate_label)] = resource
-
-        fuzz = difflib.get_close_matches(label, resources.keys(), 1, cutoff)
-        if fuzz:
-            # even if we want warnings, we don't want warnings for case changes
-            if warn and label.lower() != fuzz[0].lower():
-                self.log.warning("Assuming that '%s' should be '%s'?" %
-                                 (label, fuzz[0]))
-            return URIRef(resources[fuzz[0]])
-        else:
+        index = self._labelindexes.get(predicate)
+        if index is None or not index.is_current(self.commondata):
+            index = self._labelindexes[predicate] = LabelIndex(self.commondata, predicate)
+        try:
+            resource, match = index.lookup(label, cutoff)
+        except KeyError:
             raise KeyError("No good match for '%s'" % label)
+        if match == label:
+            return resource
+        # even if we want warnings, we don't want warnings for case changes
+        if warn and label.lower() != match.lower():
+            self.log.warning("Assuming that '%s' should be '%s'?" %
+                             (label, match))
+        return URIRef(resource)
+
+    @cached_property
+    def _labelindexes(self):
+        # predicate -> LabelIndex, used by lookup_resource
+        return {}
 
     @classmethod
     def get_default_options(cls):
@@ -561,6 +612,9 @@ class DocumentRepository(object):
         """
         return {  # 'loglevel': 'INFO',
             'allversions': False,
+            'annotationbatch': 0,
+            'annotationcache': True,
+            'archivingpolicy': 'file',
             'bulktripleload': False,
             'class': cls.__module__ + "." + cls.__name__,
             'clientname': '',
@@ -568,26 +622,43 @@ class DocumentRepository(object):
             'conditionalget': True,
             'datadir': 'data',
             'develurl': None,
+            'diffcache': False,
             'download': True,
+            'downloaddelay': 0,
+            'downloadhostlimit': 2,
             'downloadmax': nativeint,
+            'downloadworkers': 1,
             'force': False,
             'frontpagefeed': False,
             'fsmdebug': False,
             'fulltextindex': True,
             'generateforce': False,
+            'graphcache': False,
+            'hashmanifest': False,
             'ignorepatch': False,
             'indexlocation': 'data/whooshindex',
             'indextype': 'WHOOSH',
             'lastdownload': datetime,
+            'pagerenderbatch': 10,
+            'pagerenderers': 2,
+            'pagerenderwait': 5,
+            'packentries': False,
+            'parsedcache': False,
             'parseforce': False,
             'patchdir': 'patches',
             'patchformat': 'default',
+            'precomputediffs': False,
+            'prerenderpages': False,
             'primaryfrontpage': False,
             'processes': '1',
+            'rdfcache': 0,
             'refresh': False,
             'relate': True,
             'removeinvalidlinks': True,
             'republishsource': False,
+            'sectiondiff': True,
+            'sendfile': '',
+            'sendfileprefix': '/',
             'serializejson': False,
             'storelocation': 'data/ferenda.sqlite',
             'storerepository': 'ferenda',
@@ -812,7 +883,6 @@ with the *config* object as single parameter.
             self.log.debug("download: Not re-downloading downloaded files")
 
         self.log.debug("Starting at %s" % self.start_url)
-        updated = False
         resp = self.download_get_first_page()
         resp.raise_for_status()
         if self.download_iterlinks:
@@ -822,67 +892,150 @@ with the *config* object as single parameter.
         else:
             source = resp.text
             
-        for (basefile, params) in self.download_get_basefiles(source):
-            assert isinstance (params, dict), "You need to update your implementation of download_get_basefiles to return a dict instead of a string"
-            link = params['uri']
-            downloaded_path = self.store.downloaded_path(basefile)
-            if (refresh or
-                not os.path.exists(downloaded_path) or
-                os.path.getsize(downloaded_path) == 0):
-                ret = None
+        def jobs():
+            for (basefile, params) in self.download_get_basefiles(source):
+                assert isinstance (params, dict), "You need to update your implementation of download_get_basefiles to return a dict instead of a string"
+                downloaded_path = self.store.downloaded_path(basefile)
+                if (refresh or
+                    not os.path.exists(downloaded_path) or
+                    os.path.getsize(downloaded_path) == 0):
+                    yield basefile, params
+        updated = self.download_basefiles(jobs(), reporter)
+        # self.config.lastdownload = datetime.now()
+        return updated
+
+    def download_basefiles(self, jobs, reporter=None):
+        """Calls :py:meth:`~ferenda.DocumentRepository.download_basefile`
+        for every ``(basefile, params)`` tuple in *jobs*.
+
+        If the ``downloadworkers`` option is larger than 1, that many
+        documents are downloaded at the same time using a thread
+        pool. Results are still collected (and *reporter* called) in
+        the same order as *jobs*, no basefile is downloaded by two
+        threads at the same time, and the first error raised by any
+        download is re-raised here. The number of simultaneous
+        requests to any single host is further limited by
+        :py:data:`~ferenda.DocumentRepository.hostlimiter`.
+
+        :returns: True if any document was downloaded, False otherwise.
+        :rtype: bool
+        """
+        updated = False
+        workers = int(self.config.downloadworkers or 1)
+        if workers <= 1:
+            for (basefile, params) in jobs:
                 try:
-                    if 'title' in params:
-                        callback = lambda e: setattr(e, 'title', params['title'])
-                        
-                    else:
-                        callback = None
-                    ret = DocumentEntry.updateentry(self.download_single,
-                                                    'download',
-                                                    self.store.documententry_path,
-                                                    basefile,
-                                                    callback,
-                                                    basefile,
-                                                    link)
-                except requests.exceptions.HTTPError as e:
-                    if self.download_accept_404 and e.response.status_code == 404:
-                        self.log.error("%s: %s %s" % (basefile, link, e))
-                        ret = False
-                    elif self.download_accept_406 and e.response.status_code == 406:
-                        # The Eurlex CELLAR service sometimes return
-                        # this (if a doc is not available in our
-                        # wanted language, I think?) and we'd like to
-                        # distinguish this from a 404 error
-                        self.log.error("%s: %s %s" % (basefile, link, e))
-                        ret = False
-                    elif self.download_accept_400 and e.response.status_code == 400:
-                        # KKV does this for some (malformed) URLs like http://www.konkurrensverket.se/beslut/1_20160922110607_Nordic%20Camping%20&%20Resort%20AB.pdf
-                        self.log.error("%s: %s %s" % (basefile, link, e))
-                        ret = False
-                    else:
-                        raise e
-                except errors.DownloadFileNotFoundError as e:
-                    if self.download_accept_404:
-                        self.log.error("%s: %s %s" % (basefile, link, e))
-                        ret = False
-                    else:
-                        raise e
-                except errors.DocumentRemovedError as e:
-                    # download_single has signalled that a document
-                    # that download_get_basefiles thought would exist
-                    # did not in fact exist. Make a note of this so
-                    # that we don't need to call download_single for
-                    # this basefile ever again:
-                    if e.dummyfile:
-                        util.writefile(e.dummyfile, "")
-                    pass
+                    ret = self.download_basefile(basefile, params)
                 finally:
                     if reporter:
                         reporter(basefile)
-                        
                 updated = updated or ret
-        # self.config.lastdownload = datetime.now()
+            return updated
+
+        # make sure the connection pool is large enough for all threads
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        pending = deque()
+
+        def collect():
+            basefile, future = pending.popleft()
+            try:
+                return future.result()
+            finally:
+                if reporter:
+                    reporter(basefile)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for (basefile, params) in jobs:
+                    # keep a bounded number of jobs queued, and never
+                    # download the same basefile in two threads
+                    while pending and (len(pending) >= workers * 2 or
+                                       basefile in [b for b, f in pending]):
+                        updated = collect() or updated
+                    pending.append((basefile, executor.submit(
+                        self.download_basefile, basefile, params)))
+                while pending:
+                    updated = collect() or updated
+            except BaseException:
+                for basefile, future in pending:
+                    future.cancel()
+                raise
         return updated
 
+    def download_basefile(self, basefile, params):
+        """Downloads a single document found by
+        :py:meth:`~ferenda.DocumentRepository.download_get_basefiles`
+        by calling :py:meth:`~ferenda.DocumentRepository.download_single`
+        and updating its documententry. HTTP errors that this repo
+        accepts (see ``download_accept_404`` and similar) are logged
+        and the document is skipped.
+
+        :param basefile: The basefile of the document to download
+        :type  basefile: str
+        :param params: The metadata found by ``download_get_basefiles``
+                       (must at least contain ``uri``)
+        :type  params: dict
+        :returns: True if the document was downloaded, False otherwise.
+        :rtype: bool
+        """
+        link = params['uri']
+        ret = None
+        try:
+            if 'title' in params:
+                callback = lambda e: setattr(e, 'title', params['title'])
+            else:
+                callback = None
+            ret = DocumentEntry.updateentry(self.download_single,
+                                            'download',
+                                            self.store.documententry_path,
+                                            basefile,
+                                            callback,
+                                            basefile,
+                                            link)
+        except requests.exceptions.HTTPError as e:
+            if self.download_accept_404 and e.response.status_code == 404:
+                self.log.error("%s: %s %s" % (basefile, link, e))
+                ret = False
+            elif self.download_accept_406 and e.response.status_code == 406:
+                # The Eurlex CELLAR service sometimes return
+                # this (if a doc is not available in our
+                # wanted language, I think?) and we'd like to
+                # distinguish this from a 404 error
+                self.log.error("%s: %s %s" % (basefile, link, e))
+                ret = False
+            elif self.download_accept_400 and e.response.status_code == 400:
+                # KKV does this for some (malformed) URLs like http://www.konkurrensverket.se/beslut/1_20160922110607_Nordic%20Camping%20&%20Resort%20AB.pdf
+                self.log.error("%s: %s %s" % (basefile, link, e))
+                ret = False
+            else:
+                raise e
+        except errors.DownloadFileNotFoundError as e:
+            if self.download_accept_404:
+                self.log.error("%s: %s %s" % (basefile, link, e))
+                ret = False
+            else:
+                raise e
+        except errors.DocumentRemovedError as e:
+            # download_single has signalled that a document
+            # that download_get_basefiles thought would exist
+            # did not in fact exist. Make a note of this so
+            # that we don't need to call download_single for
+            # this basefile ever again:
+            if e.dummyfile:
+                util.writefile(e.dummyfile, "")
+        return ret
+
+    @cached_property
+    def hostlimiter(self):
+        """A :py:class:`~ferenda.HostLimiter` that limits the number of
+        simultaneous requests to each host (the ``downloadhostlimit``
+        option) and the minimum delay between them (the
+        ``downloaddelay`` option)."""
+        return HostLimiter(self.config.downloadhostlimit,
+                           self.config.downloaddelay)
+
     def download_get_first_page(self):
         """TBD"""
         resp = self.session.get(self.start_url)
@@ -1043,17 +1196,47 @@ with the *config* object as single parameter.
 
         # Take extra precautions in the event of temporary network
         # failures etc -- try 5 times with 1 second pause inbetween
-        # before giving up.
-        
-        response = util.robust_fetch(self.session.get, url, self.log,
-                                     sleep=sleep, headers=headers, timeout=10)
-        # response = util.robust_fetch(self.session.get, url, self.log,
-        #                              sleep=sleep, headers=headers, timeout=10)
-
-        if response is False:  # not modified
-            return False
-        with open(tmpfile, "wb") as fp:
-            fp.write(response.content)
+        # before giving up. Since the body is streamed, errors while
+        # reading it happen outside of robust_fetch, so the whole
+        # request is retried here in that case.
+        attempts = 5
+        try:
+            with self.hostlimiter.limit(url):
+                while True:
+                    response = util.robust_fetch(self.session.get, url, self.log,
+                                                 sleep=sleep, headers=headers, timeout=10,
+                                                 stream=True)
+                    if response is False:  # not modified
+                        os.unlink(tmpfile)
+                        return False
+                    # stream the response to disk (large PDF and ZIP
+                    # files shouldn't be kept in memory) and hash it
+                    # while we're at it
+                    digest = hashlib.md5()
+                    try:
+                        with open(tmpfile, "wb") as fp:
+                            for chunk in response.iter_content(chunk_size=self.download_chunksize):
+                                digest.update(chunk)
+                                fp.write(chunk)
+                        break
+                    except (requests.exceptions.ConnectionError,
+                            requests.exceptions.ChunkedEncodingError,
+                            requests.exceptions.Timeout,
+                            socket.timeout) as e:
+                        attempts -= 1
+                        if not attempts:
+                            self.log.error("Failed to download %s, giving up" % url)
+                            raise
+                        self.log.warning("Failed to download %s: err %s (%s remaining attempts)" %
+                                         (url, e, attempts))
+                        time.sleep(sleep)
+                        sleep *= 2
+                    finally:
+                        response.close()
+        except Exception:
+            util.robust_remove(tmpfile)
+            raise
+        checksum = "md5:%s" % digest.hexdigest()
 
         if not filename:
             filename = self.download_name_file(tmpfile,
@@ -1062,14 +1245,23 @@ with the *config* object as single parameter.
         if not os.path.exists(filename):
             util.robust_rename(tmpfile, filename)
             updated = True
-        elif self.download_is_different(filename, tmpfile):
-            if archive:
-                version = self.get_archive_version(basefile)
-                self.store.archive(basefile, version, overwrite=self.download_archive_overwrite, copy=self.download_archive_copy)
-            util.robust_rename(tmpfile, filename)
-            updated = True
         else:
-            updated = False
+            oldchecksum = self.download_checksum(basefile, filename)
+            if oldchecksum == checksum:
+                # byte-identical, so it can't be semantically different
+                updated = False
+            elif self.download_is_different(filename, tmpfile):
+                if archive:
+                    version = self.get_archive_version(basefile)
+                    self.store.archive(basefile, version, overwrite=self.download_archive_overwrite, copy=self.download_archive_copy)
+                util.robust_rename(tmpfile, filename)
+                updated = True
+            else:
+                updated = False
+                checksum = oldchecksum
+            if not updated:
+                os.unlink(tmpfile)
+        self.download_record_checksum(basefile, filename, checksum)
 
         if updated:
             # OK we have a new file in place. Now examine the
@@ -1092,6 +1284,39 @@ with the *config* object as single parameter.
             os.chmod(filename, stat.S_IRUSR|stat.S_IWUSR|stat.S_IRGRP|stat.S_IWGRP|stat.S_IROTH)
         return updated
 
+    def download_checksum(self, basefile, filename):
+        """Returns the checksum (on the form ``md5:<hexdigest>``) of a
+        previously downloaded file, as recorded in the documententry
+        for *basefile* by
+        :py:meth:`~ferenda.DocumentRepository.download_if_needed`. If
+        no checksum is recorded, it is calculated from the file.
+
+        :param basefile: The basefile of the downloaded document
+        :type  basefile: str
+        :param filename: The downloaded file (the main document or an
+                         attachment)
+        :type  filename: str
+        :returns: The checksum
+        :rtype: str
+        """
+        entry = DocumentEntry(self.store.documententry_path(basefile))
+        checksum = (entry.orig_checksums or {}).get(os.path.basename(filename))
+        if checksum:
+            return checksum
+        return "md5:%s" % util._file_md5(filename)
+
+    def download_record_checksum(self, basefile, filename, checksum):
+        """Records the checksum of a downloaded file in the documententry
+        for *basefile*, so that later downloads can use it to find out
+        if the file has changed without reading it."""
+        entry = DocumentEntry(self.store.documententry_path(basefile))
+        checksums = entry.orig_checksums or {}
+        key = os.path.basename(filename)
+        if checksums.get(key) != checksum:
+            checksums[key] = checksum
+            entry.orig_checksums = checksums
+            entry.save()
+
     def download_name_file(self, tmpfile, basefile, assumedfile):
         """TBD"""
         return assumedfile
@@ -1945,8 +2170,7 @@ with the *config* object as single parameter.
                     with util.logtime(self.log.debug,
                                       "Added %(triplecount)s triples to %(nttemp)s (%(elapsed).3f sec)",
                                       values):
-                        data = open(self.store.distilled_path(basefile), "rb").read()
-                        g = Graph().parse(data=data)
+                        g = self.distilled_graph(basefile)
                         with open(nttemp, "ab") as fp:
                             fp.write(g.serialize(format="nt"))
                         values['triplecount'] = len(g)
@@ -1997,6 +2221,67 @@ with the *config* object as single parameter.
             #                       context=self.dataset_uri())
             return len(data)
 
+    # bump whenever the layout of the pickled data changes, so that
+    # old caches are ignored
+    parsedcache_version = 1
+
+    def distilled_graph(self, basefile, version=None):
+        """Returns the distilled RDF metadata for the given basefile as a
+        graph. If the ``parsedcache`` config option is set and
+        :py:meth:`~ferenda.DocumentRepository.cache_distilled_graph`
+        has stored a cache that is newer than the distilled RDF/XML
+        file, the graph is loaded from that cache (which is several
+        times faster than parsing RDF/XML). Otherwise, the RDF/XML file
+        is parsed.
+
+        :param basefile: The basefile of the document
+        :type  basefile: str
+        :param version: Optional. The archived version id
+        :type  version: str
+        :returns: The distilled metadata
+        :rtype: rdflib.Graph
+        """
+        distilled = self.store.distilled_path(basefile, version)
+        if self.config.parsedcache:
+            cachepath = self.store.parsedcache_path(basefile, version)
+            if util.outfile_is_newer([distilled], cachepath):
+                try:
+                    with open(cachepath, "rb") as fp:
+                        cacheversion, namespaces, triples = pickle.load(fp)
+                    if cacheversion == self.parsedcache_version:
+                        g = Graph()
+                        for prefix, namespace in namespaces:
+                            g.bind(prefix, namespace)
+                        g.addN((s, p, o, g) for (s, p, o) in triples)
+                        return g
+                except Exception as e:
+                    self.log.warning("%s: Couldn't load %s (%s: %s), parsing %s instead" %
+                                     (basefile, cachepath, type(e).__name__, e, distilled))
+        with open(distilled, "rb") as fp:
+            return Graph().parse(data=fp.read(), format="xml")
+
+    def cache_distilled_graph(self, basefile, graph, version=None):
+        """Stores *graph* (the distilled metadata for the given basefile)
+        in a binary cache file, for later use by
+        :py:meth:`~ferenda.DocumentRepository.distilled_graph`. Called
+        by the :py:func:`~ferenda.decorators.render` decorator if the
+        ``parsedcache`` config option is set.
+
+        :param basefile: The basefile of the document
+        :type  basefile: str
+        :param graph: The distilled metadata
+        :type  graph: rdflib.Graph
+        :param version: Optional. The archived version id
+        :type  version: str
+        """
+        cachepath = self.store.parsedcache_path(basefile, version)
+        util.ensure_dir(cachepath)
+        data = (self.parsedcache_version,
+                list(graph.namespaces()),
+                list(graph))
+        with open(cachepath, "wb") as fp:
+            pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
+
     def _get_fulltext_indexer(self, repos, batchoptimize=False):
         if not hasattr(self, '_fulltextindexer'):
 
@@ -2024,7 +2309,7 @@ parsed document path to that documents dependency file."""
         with util.logtime(self.log.debug,
                           "Registered %(deps)s dependencies (%(elapsed).3f sec)",
                           values):
-            g = Graph().parse(data=util.readfile(self.store.distilled_path(basefile), encoding="utf-8"), format="xml")
+            g = self.distilled_graph(basefile)
             subjects = set([s for s, p, o in g])
             for (s, p, o) in g:
                 # the graph for a single doc can describe
@@ -2097,11 +2382,7 @@ parsed document path to that documents dependency file."""
                 repos = []
             indexer = self._get_fulltext_indexer(repos)
             tree = etree.parse(self.store.parsed_path(basefile))
-            g = Graph()
-            desc = Describer(
-                g.parse(
-                    data=util.readfile(
-                        self.store.distilled_path(basefile))))
+            desc = Describer(self.distilled_graph(basefile))
             qname_graph = self.make_graph()
             body = tree.find(".//{http://www.w3.org/1999/xhtml}body")
             resources = self._relate_fulltext_resources(body)
@@ -2239,6 +2520,11 @@ parsed document path to that documents dependency file."""
         :py:class:`~ferenda.Facet` objects returned by
         :py:meth:`~ferenda.DocumentRepository.facet`.
 
+        The data is cached in ``toc/faceted_data.json``. When the
+        triple store has changed since the cache was created, only the
+        rows for documents that have been related (or removed) since
+        are selected anew, if possible.
+
         .. note::
 
            The same document can occur multiple times if any of it's
@@ -2252,44 +2538,189 @@ parsed document path to that documents dependency file."""
         # (eg. to add additional useful data).
         cachepath = self.store.resourcepath("toc/faceted_data.json")
         dumppath = self.store.resourcepath("distilled/dump.nt")
+        data = documents = None
         if ((not self.config.force) and
                 os.path.exists(cachepath) and
-                os.path.getsize(cachepath) > 2 and  # a empty resultset is '[]' ie two bytes
-                util.outfile_is_newer([dumppath], cachepath)):
-            self.log.debug("Loading faceted_data from %s" % cachepath)
-            hook = util.make_json_date_object_hook('dcterms_issued')
-            with open(cachepath) as fp:
-                data = json.load(fp, object_hook=hook)
+                os.path.getsize(cachepath) > 2):  # a empty resultset is '[]' ie two bytes
+            params = {}
+            with util.logtime(self.log.debug,
+                              "faceted_data: loaded %(rowcount)s rows from cache (%(elapsed).3f sec)",
+                              params):
+                data, documents = self._load_faceted_data(cachepath)
+                params['rowcount'] = len(data)
+            if data and util.outfile_is_newer([dumppath], cachepath):
+                return data
+        changes = None
+        if data and documents is not None:
+            changes = self._faceted_data_changes(cachepath, documents)
+        if changes is None:
+            params = {}
+            with util.logtime(self.log.debug,
+                              "faceted_data: selected %(rowcount)s rows (%(elapsed).3f sec)",
+                              params):
+                data = self.facet_select(self.facet_query(self.dataset_uri()))
+                params['rowcount'] = len(data)
+            with util.logtime(self.log.debug,
+                              "faceted_data: removed duplicates (%(elapsed).3f sec)"):
+                data = self._dedupe_faceted_data(data)
+            documents = self._faceted_data_documents(data)
         else:
-            data = self.facet_select(self.facet_query(self.dataset_uri()))
-            # make sure the dataset contains no duplicate entries --
-            # note that it's not enough to check for row['uri']
-            # uniqueness, as multiple rows can share uri but differ in
-            # other values (if multiple_values = True for that facet)
-            rows = set()
-            dupes = []
-            for idx, row in enumerate(list(data)):
-                t = tuple(sorted(row.items())) # maybe use t.__hash__() to save space?
-                if t not in rows:
-                    rows.add(t)
-                else:
-                    self.log.warning("faceted_data: found duplicate row (uri %s) at #%s" % (row['uri'], idx))
-                    dupes.append(idx)
-            for idx in reversed(dupes):
-                self.log.warning("faceted_data: popping %s" % idx)
-                data.pop(idx) # note
-            uris = None
+            changed, removed = changes
+            params = {'changed': len(changed),
+                      'removed': len(removed)}
+            with util.logtime(self.log.debug,
+                              "faceted_data: updated rows for %(changed)s changed and "
+                              "%(removed)s removed documents (%(elapsed).3f sec)",
+                              params):
+                data = self._update_faceted_data(data, documents, changed, removed)
+        params = {'rowcount': len(data)}
+        with util.logtime(self.log.debug,
+                          "faceted_data: saved %(rowcount)s rows (%(elapsed).3f sec)",
+                          params):
+            self._save_faceted_data(cachepath, data, documents)
+        return data
 
+    def cached_faceted_data(self):
+        """Returns the rows of faceted data as last cached by
+        :py:meth:`~ferenda.DocumentRepository.faceted_data`, without
+        checking whether the triple store has changed since (and
+        therefore without ever querying it).
 
-            util.ensure_dir(cachepath)
-            with open(cachepath, "w") as fp:
-                self.log.debug("Saving faceted_data to %s" % cachepath)
-                s = json.dumps(data, indent=4, separators=(', ', ': '), default=util.json_default_date)
-                fp.write(s)
-            if os.path.getsize(cachepath) == 0:
-                util.robust_remove(cachepath)
+        :returns: The cached rows, or None if no data has been cached
+        :rtype: list
+        """
+        cachepath = self.store.resourcepath("toc/faceted_data.json")
+        if not os.path.exists(cachepath) or os.path.getsize(cachepath) == 0:
+            return None
+        return self._load_faceted_data(cachepath)[0]
+
+    def _load_faceted_data(self, cachepath):
+        # Returns the cached rows and the mapping between basefiles
+        # and the uris of their rows. Older caches are plain lists of
+        # rows, without any such mapping.
+        hook = util.make_json_date_object_hook('dcterms_issued')
+        with open(cachepath) as fp:
+            cached = json.load(fp, object_hook=hook)
+        if isinstance(cached, list):
+            return cached, None
+        return cached['rows'], cached['documents']
+
+    def _save_faceted_data(self, cachepath, data, documents):
+        util.ensure_dir(cachepath)
+        with open(cachepath, "w") as fp:
+            self.log.debug("Saving faceted_data to %s" % cachepath)
+            s = json.dumps({'documents': documents, 'rows': data},
+                           separators=(',', ':'), default=util.json_default_date)
+            fp.write(s)
+        if os.path.getsize(cachepath) == 0:
+            util.robust_remove(cachepath)
+
+    def _dedupe_faceted_data(self, data):
+        # make sure the dataset contains no duplicate entries --
+        # note that it's not enough to check for row['uri']
+        # uniqueness, as multiple rows can share uri but differ in
+        # other values (if multiple_values = True for that facet)
+        rows = set()
+        dupes = []
+        for idx, row in enumerate(data):
+            t = tuple(sorted(row.items()))
+            if t not in rows:
+                rows.add(t)
+            else:
+                self.log.warning("faceted_data: found duplicate row (uri %s) at #%s" % (row['uri'], idx))
+                dupes.append(idx)
+        for idx in reversed(dupes):
+            self.log.warning("faceted_data: popping %s" % idx)
+            data.pop(idx)
         return data
 
+    def _faceted_data_documents(self, data):
+        # Maps each basefile to the uris of its rows, as far as
+        # basefile_from_uri can tell.
+        documents = dict((basefile, []) for basefile in
+                         self.store.list_basefiles_for("relate"))
+        for uri in sorted(set(row['uri'] for row in data)):
+            basefile = self.basefile_from_uri(uri)
+            if basefile in documents:
+                documents[basefile].append(uri)
+        return documents
+
+    def _faceted_data_changes(self, cachepath, documents):
+        # Finds the documents that have been related since the cache
+        # was saved. Returns a (changed, removed) tuple of lists of
+        # basefiles, or None if it's better to select everything anew.
+        if self._facet_query_for([]) is None:
+            return None
+        cachetime = os.path.getmtime(cachepath)
+        basefiles = set(self.store.list_basefiles_for("relate"))
+        changed = sorted(
+            basefile for basefile in basefiles if
+            basefile not in documents or
+            self._related_since(basefile, cachetime))
+        removed = sorted(basefile for basefile in documents if basefile not in basefiles)
+        if [basefile for basefile in removed if not documents[basefile]]:
+            # we don't know what rows the removed document provided
+            return None
+        if len(changed) + len(removed) > len(basefiles) / 2:
+            # selecting a large part of the data piecemeal is slower
+            # than selecting all of it at once
+            return None
+        return changed, removed
+
+    def _related_since(self, basefile, timestamp):
+        # A document might be distilled long before its triples are
+        # loaded into the triple store, so the relate time recorded
+        # in its entry is checked as well as its distilled file.
+        if os.path.getmtime(self.store.distilled_path(basefile)) > timestamp:
+            return True
+        entry = DocumentEntry(self.store.documententry_path(basefile))
+        return bool(entry.indexed_ts and
+                    entry.indexed_ts > datetime.fromtimestamp(timestamp))
+
+    def _facet_query_for(self, uris):
+        # Restricts facet_query to the given uris, which is only
+        # possible if the query selects from the dataset of this repo
+        # (which means that the rows stem from the distilled files of
+        # this repo)
+        context = self.dataset_uri()
+        query = self.facet_query(context)
+        if not query or "FROM <%s>" % context not in query:
+            return None
+        m = re.search(r"\bWHERE\s*{", query)
+        if not m:
+            return None
+        values = "\n    VALUES ?uri { %s }" % " ".join("<%s>" % uri for uri in uris)
+        return query[:m.end()] + values + query[m.end():]
+
+    def _update_faceted_data(self, data, documents, changed, removed):
+        # the rows of a changed document are re-selected for all
+        # top-level resources described in its distilled file, and for
+        # all uris that the document provided rows for previously
+        stale = set()
+        owner = {}
+        for basefile in removed:
+            stale.update(documents.pop(basefile))
+        for basefile in changed:
+            stale.update(documents.get(basefile, []))
+            documents[basefile] = []
+            distilled = self.store.distilled_path(basefile)
+            if os.path.getsize(distilled):
+                for s in self.distilled_graph(basefile).subjects():
+                    if isinstance(s, URIRef) and "#" not in s:
+                        owner[str(s)] = basefile
+        stale.update(owner)
+        data = [row for row in data if row['uri'] not in stale]
+        uris = sorted(owner)
+        newdata = []
+        batchsize = 500
+        for idx in range(0, len(uris), batchsize):
+            newdata.extend(self.facet_select(self._facet_query_for(uris[idx:idx + batchsize])))
+        newdata = self._dedupe_faceted_data(newdata)
+        for uri in sorted(set(row['uri'] for row in newdata)):
+            if uri in owner:
+                documents[owner[uri]].append(uri)
+        return data + newdata
+
     def facet_query(self, context):
         """Constructs a SPARQL SELECT query that fetches all
         information needed to create faceted data.
@@ -2408,13 +2839,20 @@ WHERE {
     def generate_all_setup(cls, config, *args, **kwargs):
         """
         Runs any action needed prior to generating all documents in a
-        docrepo. The default implementation does nothing.
+        docrepo. If the ``annotationbatch`` option is set, the
+        default implementation fetches annotations for all documents
+        in advance, using
+        :py:meth:`~ferenda.DocumentRepository.prefetch_annotations`.
+        Otherwise, it does nothing.
 
         .. note::
 
            Like :py:meth:`~ferenda.DocumentRepository.parse_all_setup`
            this might change to a instance method.
         """
+        repo = kwargs.get("currentrepo")
+        if repo and config.annotationbatch:
+            repo.prefetch_annotations()
 
     @classmethod
     def generate_all_teardown(cls, config, *args, **kwargs):
@@ -2462,13 +2900,8 @@ WHERE {
             # The annotationfile might be newer than all dependencies
             # (and thus not need regenerateion) even though the
             # outfile is older.
-            if os.path.exists(self.store.dependencies_path(basefile)):
-                deptxt = util.readfile(self.store.dependencies_path(basefile))
-                dependencies = deptxt.strip().split("\n")
-            else:
-                dependencies = []
-            if (self.config.force or (not
-                                      util.outfile_is_newer(dependencies, self.store.annotation_path(basefile, version)))):
+            dependencies = self._annotation_dependencies(basefile)
+            if self._annotations_needed(basefile, version, dependencies):
                 with util.logtime(self.log.debug,
                                   "prep_annotation_file (%(elapsed).3f sec)",
                                   {'basefile': basefile}):
@@ -2527,6 +2960,20 @@ WHERE {
             docentry.updated = now
             docentry.save()
 
+            if self.config.prerenderpages and not version:
+                with util.logtime(self.log.debug,
+                                  "prerender_pages (%(elapsed).3f sec)",
+                                  {'basefile': basefile}):
+                    self.requesthandler.prerender_pages(basefile)
+            if self.config.diffcache and self.config.precomputediffs and not version:
+                # a new version of the document might just have been
+                # archived, so the diff between that and this version
+                # is probably not cached yet
+                with util.logtime(self.log.debug,
+                                  "precompute_diffs (%(elapsed).3f sec)",
+                                  {'basefile': basefile}):
+                    self.requesthandler.precompute_diffs(basefile)
+
     def generate_set_params(self, basefile, version, params):
         return params
 
@@ -2640,10 +3087,16 @@ WHERE {
         the information found in the document that generate handles,
         like URI/title of other documents that refers to this one.
 
+        If the ``annotationcache`` option is ``False``, no file is
+        written. Instead, the annotations are returned as a lxml tree,
+        which :py:meth:`~ferenda.DocumentRepository.generate` hands
+        directly to the XSLT transform.
+
         :param basefile: The basefile for which to collect annotating
                          statements.
         :type basefile: str
-        :returns: The full path to the prepared RDF/XML file
+        :returns: The full path to the prepared RDF/XML file (or the
+                  annotation tree, see above)
         :rtype: str
 
         """
@@ -2652,13 +3105,188 @@ WHERE {
             return
         graph = self.construct_annotations(self.canonical_uri(basefile))
         if graph and len(graph) > 0:
-            with self.store.open_annotation(basefile, "w", version) as fp:
-                fp.write(self.graph_to_annotation_file(graph))
+            tree = self.graph_to_annotation_tree(graph)
+            if not self.config.annotationcache:
+                return tree
+            with self.store.open_annotation(basefile, "wb", version) as fp:
+                fp.write(etree.tostring(tree, pretty_print=True))
             return self.store.annotation_path(basefile, version)
         elif self.sparql_expect_results:
             self.log.warning(
                 "No annotation data fetched, something might be wrong with the SPARQL query")
 
+    def _annotation_dependencies(self, basefile):
+        if os.path.exists(self.store.dependencies_path(basefile)):
+            deptxt = util.readfile(self.store.dependencies_path(basefile))
+            return deptxt.strip().split("\n")
+        else:
+            return []
+
+    def _annotations_needed(self, basefile, version=None, dependencies=None):
+        if dependencies is None:
+            dependencies = self._annotation_dependencies(basefile)
+        return (self.config.force or not self.config.annotationcache or
+                not util.outfile_is_newer(dependencies,
+                                          self.store.annotation_path(basefile, version)))
+
+    def prefetch_annotations(self, basefiles=None):
+        """Fetches annotations for many documents at a time and writes them
+        to the files that
+        :py:meth:`~ferenda.DocumentRepository.prep_annotation_file`
+        would have created, so that
+        :py:meth:`~ferenda.DocumentRepository.generate` can use them
+        without querying the triple store itself. The number of
+        documents handled by each query is set by the
+        ``annotationbatch`` option.
+
+        Nothing is done if this docrepo provides its own
+        :py:meth:`~ferenda.DocumentRepository.prep_annotation_file` or
+        :py:meth:`~ferenda.DocumentRepository.construct_annotations`,
+        if the ``annotationcache`` option is ``False``, or if the
+        annotation query cannot be run for many documents at once
+        (see
+        :py:meth:`~ferenda.DocumentRepository.construct_annotations_batch`).
+
+        :param basefiles: The basefiles to fetch annotations for
+                          (defaults to all basefiles that can be
+                          generated, as long as their annotation
+                          files are out of date)
+        :type  basefiles: list
+        :returns: The number of annotation files written
+        :rtype: int
+        """
+        cls = type(self)
+        if (not self.sparql_annotations or
+                not self.config.annotationcache or
+                cls.prep_annotation_file is not DocumentRepository.prep_annotation_file or
+                cls.construct_annotations is not DocumentRepository.construct_annotations):
+            return 0
+        if basefiles is None:
+            basefiles = self.store.list_basefiles_for("generate")
+        todo = [b for b in basefiles
+                if (self.config.force or self.store.needed(b, "generate")) and
+                self._annotations_needed(b)]
+        batchsize = max(int(self.config.annotationbatch), 1)
+        values = {'written': 0}
+        with util.logtime(self.log.info,
+                          "prefetch_annotations: %(written)s annotation files (%(elapsed).3f sec)",
+                          values):
+            for idx in range(0, len(todo), batchsize):
+                uris = OrderedDict((self.canonical_uri(b), b)
+                                   for b in todo[idx:idx + batchsize])
+                graphs = self.construct_annotations_batch(list(uris))
+                if graphs is None:
+                    self.log.debug("prefetch_annotations: Annotation query "
+                                   "can't be batched, skipping")
+                    break
+                for uri, basefile in uris.items():
+                    graph = graphs[uri]
+                    if len(graph) == 0 and self.sparql_expect_results:
+                        self.log.warning(
+                            "%s: No annotation data fetched, something might "
+                            "be wrong with the SPARQL query" % basefile)
+                    with self.store.open_annotation(basefile, "wb") as fp:
+                        fp.write(etree.tostring(self.graph_to_annotation_tree(graph),
+                                                pretty_print=True))
+                    values['written'] += 1
+        return values['written']
+
+    def construct_annotations_batch(self, uris):
+        """Like :meth:`~ferenda.DocumentRepository.construct_annotations`,
+        but for many URIs at once, using a single query. The CONSTRUCT
+        query from
+        :meth:`~ferenda.DocumentRepository.construct_sparql_query` is
+        rewritten into a SELECT query with a ``VALUES`` block
+        containing all URIs, and the CONSTRUCT template is then
+        applied to each result row.
+
+        This only works if the URI of the document is used as a
+        complete IRI (ie ``<%(uri)s>``) in the query. Otherwise,
+        ``None`` is returned.
+
+        :param uris: The URIs of the documents to annotate
+        :type  uris: list
+        :returns: A graph with annotations for each URI
+        :rtype: dict
+        """
+        batchquery = self._batch_annotation_query()
+        if batchquery is None:
+            return None
+        query, template, var = batchquery
+        sq = query % " ".join("<%s>" % uri for uri in uris)
+        graphs = OrderedDict()
+        for uri in uris:
+            graphs[uri] = Graph()
+            for prefix, ns in list(self.ns.items()):
+                graphs[uri].bind(prefix, ns)
+        ts = self._get_triplestore()
+        res = Result.parse(BytesIO(ts.select(sq, "sparql")), format="xml")
+        for row in res.bindings:
+            graph = graphs.get(str(row.get(var)))
+            if graph is None:
+                continue
+            bnodes = {}
+            for triple in template:
+                triple = [row.get(t) if isinstance(t, Variable) else
+                          bnodes.setdefault(t, BNode()) if isinstance(t, BNode) else
+                          t for t in triple]
+                if (None not in triple and
+                        not isinstance(triple[0], Literal) and
+                        isinstance(triple[1], URIRef)):
+                    graph.add(triple)
+        return graphs
+
+    # the URI used in place of the document URI when building the query
+    # for construct_annotations_batch
+    _batch_annotation_uri = "urn:x-ferenda:annotated-document"
+
+    def _batch_annotation_query(self):
+        # returns a (SELECT query with a %s placeholder for the
+        # VALUES block, CONSTRUCT template, variable for the document
+        # URI) tuple, or None if the query can't be batched.
+        if hasattr(self, '_batchquery'):
+            return self._batchquery
+        self._batchquery = None
+        marker = self._batch_annotation_uri
+        sq = self.construct_sparql_query(marker)
+        if sq.count(marker) != sq.count("<%s>" % marker):
+            return None
+        m = re.search(r"\bCONSTRUCT\s*{", sq, re.IGNORECASE)
+        if not m:
+            return None
+        depth = 0
+        for idx in range(m.end() - 1, len(sq)):
+            if sq[idx] == "{":
+                depth += 1
+            elif sq[idx] == "}":
+                depth -= 1
+                if depth == 0:
+                    break
+        where = sq[idx + 1:]
+        if "{" not in where:
+            return None
+        # the SPARQL parser takes a long time to import, and is only
+        # needed here
+        from rdflib.plugins.sparql import prepareQuery
+        try:
+            template = prepareQuery(sq).algebra.template
+        except Exception as e:
+            self.log.warning("Couldn't parse annotation query: %s" % e)
+            return None
+        var = Variable("_annotated")
+        pos = where.index("{") + 1
+        query = (sq[:m.start()].replace("%", "%%") + "SELECT *" +
+                 where[:pos].replace("%", "%%") + " VALUES ?_annotated { %s } " +
+                 where[pos:].replace("%", "%%"))
+        query = query.replace("<%s>" % marker, "?_annotated")
+        # some triple stores get the query with newlines replaced by
+        # spaces, which would make a comment swallow the entire query
+        query = re.sub(r"(?m)^\s*#.*$", "", query)
+        template = [tuple(var if t == URIRef(marker) else t for t in triple)
+                    for triple in template]
+        self._batchquery = (query, template, var)
+        return self._batchquery
+
     def construct_annotations(self, uri):
         """Construct a RDF graph containing metadata by running the query
         provided by
@@ -2703,14 +3331,78 @@ WHERE {
         :returns: A serialized XML document with the RDF statements
         :rtype: str
         """
-        fp = BytesIO(graph.serialize(format="xml"))
-        intree = etree.parse(fp)
-        with self.resourceloader.open("xsl/rdfxml-grit.xsl") as fp:
-            transform = etree.XSLT(etree.parse(fp))
-        resulttree = transform(intree)
-        res = etree.tostring(resulttree, pretty_print=format)
+        res = etree.tostring(self.graph_to_annotation_tree(graph),
+                             pretty_print=True)
         return res.decode('utf-8')
 
+    def graph_to_annotation_tree(self, graph):
+        """Like :py:meth:`~ferenda.DocumentRepository.graph_to_annotation_file`,
+        but returns the Grit document as a lxml tree instead of a string.
+
+        :param graph: The graph to convert
+        :type  graph: rdflib.graph.Graph
+        :returns: The Grit document
+        :rtype: lxml.etree._ElementTree
+        """
+        return self._grit_transform(self._graph_to_rdfxml_tree(graph))
+
+    @cached_property
+    def _grit_transform(self):
+        with self.resourceloader.open("xsl/rdfxml-grit.xsl") as fp:
+            return etree.XSLT(etree.parse(fp))
+
+    # Builds the same tree as parsing the output of
+    # graph.serialize(format="xml") would, without going through
+    # the (slow) serializer and the parser.
+    def _graph_to_rdfxml_tree(self, graph):
+        nm = graph.namespace_manager
+        bindings = {"rdf": str(RDF)}
+        qnames = {}
+        for predicate in set(graph.predicates()):
+            prefix, namespace, name = nm.compute_qname(predicate)
+            bindings[prefix] = str(namespace)
+            qnames[predicate] = "{%s}%s" % (namespace, name)
+        # the order of namespace declarations carries over to the
+        # grit document
+        nsmap = OrderedDict((prefix or None, bindings[prefix])
+                            for prefix in sorted(bindings))
+        rdfabout = "{%s}about" % RDF
+        rdfnodeid = "{%s}nodeID" % RDF
+        rdfresource = "{%s}resource" % RDF
+        rdfdatatype = "{%s}datatype" % RDF
+        xmllang = "{http://www.w3.org/XML/1998/namespace}lang"
+        root = etree.Element("{%s}RDF" % RDF, nsmap=nsmap)
+        root.text = "\n"
+        seen = set()
+        for subject in graph.subjects():
+            if subject in seen or not isinstance(subject, (BNode, URIRef)):
+                continue
+            seen.add(subject)
+            desc = etree.SubElement(root, "{%s}Description" % RDF)
+            if isinstance(subject, BNode):
+                desc.set(rdfnodeid, str(subject))
+            else:
+                desc.set(rdfabout, str(subject))
+            desc.tail = "\n"
+            # the serializer output has whitespace between each
+            # property, which is significant to the grit transform
+            desc.text = "\n"
+            for predicate, obj in graph.predicate_objects(subject):
+                prop = etree.SubElement(desc, qnames[predicate])
+                prop.tail = "\n"
+                if isinstance(obj, Literal):
+                    if obj.language:
+                        prop.set(xmllang, obj.language)
+                    if obj.datatype:
+                        prop.set(rdfdatatype, str(obj.datatype))
+                    if str(obj):
+                        prop.text = str(obj)
+                elif isinstance(obj, BNode):
+                    prop.set(rdfnodeid, str(obj))
+                else:
+                    prop.set(rdfresource, str(obj))
+        return root.getroottree()
+
     # the inverse of graph_to_annotation_file
     def annotation_file_to_graph(self, annotation_file):
         """Converts a annotation file (using the Grit format) back into an
@@ -3165,8 +3857,10 @@ WHERE {
         # create an iterable of all the dependencies. If any of these
         # is newer than outfile (cachepath) the outfile_is_newer
         # immediately returns false.
+        entrypack = packfile.get(self.store.resourcepath("entries"))
         dependencies = chain(
             [self.store.resourcepath("feed/faceted_entries.json")],
+            entrypack.files() if entrypack is not None else [],
             util.list_dirs(self.store.resourcepath("entries"), ".json")
         )
         if ((not self.config.force) and
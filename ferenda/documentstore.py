@@ -14,6 +14,7 @@ except ImportError: # probably on py2.7/py3.4
     JSONDecodeError = ValueError
     
 import filecmp
+import hashlib
 import operator
 import os
 import sys
@@ -37,6 +38,7 @@ except ImportError:
 
 from ferenda import util
 from ferenda import errors
+from ferenda import packfile
 from ferenda import DocumentEntry
 
 
@@ -50,6 +52,201 @@ def _compressed_suffix(compression):
     else:
         return ""
 
+class HashManifest(object):
+    """Keeps track of the MD5 hashes of files written through a
+    :py:class:`~ferenda.DocumentStore`. When a file is rewritten, the
+    hash of the new content (computed while it's being written) can
+    then be compared with the recorded hash, instead of reading and
+    comparing the existing file byte by byte.
+
+    The manifest is an append-only text file with one line per
+    written file. A recorded hash is only trusted if the size and
+    modification time of the file is unchanged since it was recorded,
+    so files changed by other means are compared the ordinary way.
+
+    :param filename: The file used to store the manifest
+    :type  filename: str
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.basedir = os.path.dirname(filename)
+        self.entries = None  # loaded on first use
+        self.files_skipped = 0
+        self.bytes_avoided = 0
+
+    def _key(self, path):
+        return os.path.relpath(path, self.basedir).replace(os.sep, "/")
+
+    def _signature(self, path):
+        st = os.stat(path)
+        return st.st_size, repr(st.st_mtime)
+
+    def _load(self):
+        self.entries = {}
+        if not os.path.exists(self.filename):
+            return
+        lines = 0
+        with codecs.open(self.filename, encoding="utf-8") as fp:
+            for line in fp:
+                lines += 1
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) == 4:
+                    key, digest, size, mtime = parts
+                    self.entries[key] = (digest, int(size), mtime)
+        if lines > 2 * len(self.entries) + 1000:
+            # mostly superseded lines -- compact the manifest
+            tmpname = self.filename + ".tmp"
+            with codecs.open(tmpname, "w", encoding="utf-8") as fp:
+                for key, (digest, size, mtime) in sorted(self.entries.items()):
+                    fp.write("%s\t%s\t%s\t%s\n" % (key, digest, size, mtime))
+            util.robust_rename(tmpname, self.filename)
+
+    def digest(self, path):
+        """Returns the recorded hash for *path*, or None if no hash is
+        recorded or if the file has been changed since."""
+        if self.entries is None:
+            self._load()
+        entry = self.entries.get(self._key(path))
+        if entry and os.path.exists(path) and self._signature(path) == entry[1:]:
+            return entry[0]
+
+    def unchanged(self, path, digest):
+        """Returns True if *path* is known to have the content with the
+        hash *digest* (and counts the bytes that thereby don't have
+        to be compared)."""
+        if self.digest(path) == digest:
+            self.files_skipped += 1
+            self.bytes_avoided += os.path.getsize(path)
+            return True
+        return False
+
+    def record(self, path, digest):
+        """Records that *path* now has the content with the hash
+        *digest*."""
+        if self.entries is None:
+            self._load()
+        key = self._key(path)
+        if "\t" in key or "\n" in key:
+            return
+        size, mtime = self._signature(path)
+        if self.entries.get(key) == (digest, size, mtime):
+            return
+        self.entries[key] = (digest, size, mtime)
+        util.ensure_dir(self.filename)
+        with codecs.open(self.filename, "a", encoding="utf-8") as fp:
+            fp.write("%s\t%s\t%s\t%s\n" % (key, digest, size, mtime))
+
+
+class ArchiveIndex(object):
+    """Keeps track of which versions of which basefiles have been
+    archived, so that
+    :py:meth:`~ferenda.DocumentStore.list_versions` doesn't need to
+    walk the archive directories. Used by stores with the ``blob``
+    archiving policy.
+
+    Like :py:class:`~ferenda.documentstore.HashManifest`, the index
+    is an append-only text file with one line per archived version.
+
+    :param filename: The file used to store the index
+    :type  filename: str
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = None  # loaded on first use
+        self._signature = None
+
+    def _load(self):
+        self.entries = {}
+        self._signature = None
+        if not os.path.exists(self.filename):
+            return
+        with codecs.open(self.filename, encoding="utf-8") as fp:
+            for line in fp:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) == 3:
+                    action, basefile, version = parts
+                    self.entries.setdefault((action, basefile), set()).add(version)
+        st = os.stat(self.filename)
+        self._signature = (st.st_size, st.st_mtime)
+
+    def _current(self):
+        # reload if some other process or store has added versions
+        if os.path.exists(self.filename):
+            st = os.stat(self.filename)
+            signature = (st.st_size, st.st_mtime)
+        else:
+            signature = None
+        if self.entries is None or signature != self._signature:
+            self._load()
+        return self.entries
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def versions(self, action, basefile):
+        """Returns all recorded versions of *basefile* for *action*,
+        sorted in the same order as a directory walk would."""
+        return sorted(self._current().get((action, basefile), ()),
+                      key=lambda v: [util.split_numalpha(seg)
+                                     for seg in v.split("/")])
+
+    def record(self, action, basefile, version):
+        """Records that *version* of *basefile* has been archived for
+        *action*."""
+        if "\t" in basefile + version or "\n" in basefile + version:
+            return
+        if version in self._current().get((action, basefile), ()):
+            return
+        self.entries.setdefault((action, basefile), set()).add(version)
+        util.ensure_dir(self.filename)
+        with codecs.open(self.filename, "a", encoding="utf-8") as fp:
+            fp.write("%s\t%s\t%s\n" % (action, basefile, version))
+
+    def rebuild(self, records):
+        """Replaces the index with the ``(action, basefile, version)``
+        tuples in *records*."""
+        util.ensure_dir(self.filename)
+        tmpname = self.filename + ".tmp"
+        with codecs.open(tmpname, "w", encoding="utf-8") as fp:
+            for action, basefile, version in records:
+                if "\t" in basefile + version or "\n" in basefile + version:
+                    continue
+                fp.write("%s\t%s\t%s\n" % (action, basefile, version))
+        util.robust_rename(tmpname, self.filename)
+        self.entries = None
+
+
+class _HashingWriter(object):
+    # Wraps a (binary) file object and computes the MD5 hash of
+    # everything written to it. Seeking or truncating makes the hash
+    # useless, in which case hash is set to None.
+    def __init__(self, fp):
+        self._fp = fp
+        self.hash = hashlib.md5()
+
+    def write(self, data):
+        if self.hash is not None:
+            self.hash.update(data)
+        return self._fp.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def seek(self, *args, **kwargs):
+        self.hash = None
+        return self._fp.seek(*args, **kwargs)
+
+    def truncate(self, *args, **kwargs):
+        self.hash = None
+        return self._fp.truncate(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+
 class _open(object):
     """This class can work both as a context manager and as a substitute
     for a straight open() call. Most of the time you want to use it as
@@ -66,10 +263,12 @@ class _open(object):
     def __exit__(self, *args):
         self.close(*args)
         
-    def __init__(self, filename, mode, compression=None):
+    def __init__(self, filename, mode, compression=None, hashmanifest=None):
         self.filename = filename
         self.mode = mode
         self.compression = compression
+        self.hashmanifest = hashmanifest
+        self.hasher = None
         suffix = _compressed_suffix(compression)
         def wrap_fp(fp):
             if suffix == ".gz":
@@ -119,7 +318,11 @@ class _open(object):
                 tempmode = "w+b"
             else:
                 tempmode = mode
-            self.fp = wrap_fp(NamedTemporaryFile(mode=tempmode, delete=False))
+            fp = NamedTemporaryFile(mode=tempmode, delete=False)
+            if hashmanifest and "b" in tempmode:
+                # hash the bytes as they're written to disk
+                self.hasher = fp = _HashingWriter(fp)
+            self.fp = wrap_fp(fp)
         else:
             if "a" in mode and not os.path.exists(filename):
                 util.ensure_dir(filename)
@@ -136,6 +339,12 @@ class _open(object):
         if "w" in self.mode:
             tempname = util.name_from_fp(self.fp)
             ret = self.fp.close()
+            digest = None
+            if self.hasher and self.hasher.hash is not None:
+                digest = self.hasher.hash.hexdigest()
+                if self.hashmanifest.unchanged(self.filename, digest):
+                    os.unlink(tempname)
+                    return ret
             if not os.path.exists(self.filename) or not filecmp.cmp(tempname, self.filename):
                 util.ensure_dir(self.filename)
                 shutil.move(tempname, self.filename)
@@ -146,6 +355,8 @@ class _open(object):
                 os.chmod(self.filename, stat.S_IRUSR|stat.S_IWUSR|stat.S_IRGRP|stat.S_IWGRP|stat.S_IROTH)
             else:
                 os.unlink(tempname)
+            if digest:
+                self.hashmanifest.record(self.filename, digest)
             return ret
         else:
             # This is needed sometimes since
@@ -244,9 +455,27 @@ class DocumentStore(object):
                         and
                         :py:meth:`~ferenda.DocumentStore.open_intermediate`.
     :type compression: str
+    :param archiving_policy: How archived versions are stored. With
+                             ``file`` (the default), each version
+                             is stored as ordinary files below the
+                             ``archive`` directory. ``blob`` uses the
+                             same paths, but identical downloaded
+                             files are stored only once (as hard
+                             links to a content-addressed file in
+                             ``archive/.blobs``), and archived
+                             versions are listed from an index
+                             instead of by walking directories.
+                             Other files (parsed, generated etc) are
+                             not linked, since they may be
+                             re-created for a single version.
+    :type archiving_policy: str
 
     """
     compression = None
+    hashmanifest = None
+    """If set to a :py:class:`~ferenda.documentstore.HashManifest`
+    object, files written through this store are compared with the
+    existing files using recorded hashes, instead of byte by byte."""
     downloaded_suffixes = [".html"]
     intermediate_suffixes = [".xml"]
     invalid_suffixes = [".invalid"]
@@ -257,7 +486,8 @@ class DocumentStore(object):
         assert self.storage_policy in ("dir", "file"), "unknown storage policy %s" % self.storage_policy
         self.compression = compression
         self.archiving_policy = archiving_policy
-        assert self.archiving_policy in ("zip", "file"), "unknown archiving policy %s" % self.archiving_policy
+        assert self.archiving_policy in ("zip", "file", "blob"), "unknown archiving policy %s" % self.archiving_policy
+        self._archiveindex = None
 
         # store1 = DocStore("data/sfs", archiving_policy="file")
         # store2 = DocStore("data/sfs", archiving_policy="zip")
@@ -274,6 +504,33 @@ class DocumentStore(object):
     
 
 
+    def _open(self, filename, mode="r", compression=None):
+        fp = packfile.open(filename, mode)
+        if fp is not None:
+            return fp
+        return _open(filename, mode, compression, hashmanifest=self.hashmanifest)
+
+    def use_pack(self, maindir):
+        """Stores all files in *maindir* (eg. ``entries``) in a single
+        :py:class:`~ferenda.packfile.PackFile` (``<maindir>.sqlite``)
+        instead of as separate files. Files are still identified by
+        their ordinary paths, but must be accessed through
+        :py:meth:`~ferenda.DocumentStore.open`,
+        :py:class:`~ferenda.DocumentEntry` or the functions in
+        :py:mod:`ferenda.packfile`.
+
+        :param maindir: The directory to pack
+        :type  maindir: str
+        :returns: The pack
+        :rtype: ferenda.packfile.PackFile
+        """
+        pack = packfile.get(self.resourcepath(maindir))
+        if pack is None:
+            pack = packfile.PackFile(self.resourcepath(maindir + ".sqlite"),
+                                     self.resourcepath(maindir))
+            packfile.register(pack)
+        return pack
+
     # TODO: Maybe this is a worthwhile extension to the API? Could ofc
     # easily be done everywhere where a non-document related path is
     # needed.
@@ -282,7 +539,7 @@ class DocumentStore(object):
 
     def open_resource(self, resourcename, mode="r"):
         filename = self.resourcepath(resourcename)
-        return _open(filename, mode)
+        return self._open(filename, mode)
 
     def path(self, basefile, maindir, suffix, version=None, attachment=None,
              storage_policy=None, archiving_policy=None):
@@ -349,7 +606,7 @@ class DocumentStore(object):
             v_pathfrag = self.basefile_to_pathfrag(version)
             if archiving_policy == "zip":
                 segments = [self.datadir, 'archive', pathfrag + ".zip#" + maindir, v_pathfrag]
-            elif archiving_policy == "file":
+            elif archiving_policy in ("file", "blob"):
                 segments = [self.datadir,
                             'archive', maindir, pathfrag, '.versions', v_pathfrag]
         else:
@@ -394,7 +651,7 @@ class DocumentStore(object):
 
         """
         filename = self.path(basefile, maindir, suffix, version, attachment)
-        return _open(filename, mode, compression)
+        return self._open(filename, mode, compression)
 
 
     def needed(self, basefile, action, version=None):
@@ -536,6 +793,12 @@ dependencies (in the form of source files for the action).
         if not directory:
             raise ValueError("No directory calculated for action %s" % action)
 
+        pack = packfile.get(directory) if action == "news" else None
+        if pack is not None:
+            for key in pack.keys():
+                if key.endswith(".json"):
+                    yield self.pathfrag_to_basefile(key[:-len(".json")].replace("/", os.sep))
+
         if not os.path.exists(directory):
             return
 
@@ -641,6 +904,18 @@ dependencies (in the form of source files for the action).
         else:
             actions = ('downloaded', 'parsed', 'generated')
 
+        if self.archiving_policy == "blob":
+            yielded_versions = []
+            for action in actions:
+                for version in self.archiveindex.versions(action, basefile):
+                    if version not in yielded_versions:
+                        yielded_versions.append(version)
+                        yield version
+            return
+        for version in self._walk_versions(basefile, actions):
+            yield version
+
+    def _walk_versions(self, basefile, actions):
         basedir = self.datadir
         pathfrag = self.basefile_to_pathfrag(basefile)
         yielded_basefiles = []
@@ -681,6 +956,108 @@ dependencies (in the form of source files for the action).
                         yielded_basefiles.append(basefile)
                         yield basefile
 
+    @property
+    def archiveindex(self):
+        """The :py:class:`~ferenda.documentstore.ArchiveIndex` used by the
+        ``blob`` archiving policy. If it doesn't exist yet (eg. if the
+        archiving policy has been changed from ``file``), it's
+        created from the existing archive directories."""
+        if self._archiveindex is None:
+            self._archiveindex = ArchiveIndex(
+                self.resourcepath("archive/versions.txt"))
+            if not self._archiveindex.exists():
+                self._archiveindex.rebuild(self._scan_archive())
+        return self._archiveindex
+
+    def _scan_archive(self):
+        # yields (action, basefile, version) for all archived versions
+        for action in ('downloaded', 'parsed', 'generated'):
+            root = os.sep.join((self.datadir, "archive", action))
+            for dirpath, dirnames, filenames in os.walk(root):
+                if ".versions" in dirnames:
+                    dirnames.remove(".versions")
+                    basefile = self.pathfrag_to_basefile(
+                        os.path.relpath(dirpath, root))
+                    for version in self._walk_versions(basefile, (action,)):
+                        yield action, basefile, version
+
+    def _blob_path(self, digest):
+        return self.resourcepath("archive/.blobs/%s/%s" % (digest[:2], digest[2:]))
+
+    def _link_blob(self, filename):
+        # replace filename with a hard link to the content-addressed
+        # blob with the same content, or make it that blob if none
+        # exists. Returns the number of bytes saved.
+        digest = hashlib.sha256()
+        with open(filename, "rb") as fp:
+            for chunk in iter(lambda: fp.read(65536), b""):
+                digest.update(chunk)
+        blob = self._blob_path(digest.hexdigest())
+        try:
+            if not os.path.exists(blob):
+                util.ensure_dir(blob)
+                os.link(filename, blob)
+                return 0
+            if os.path.samefile(blob, filename):
+                return 0
+            size = os.path.getsize(filename)
+            tmpname = filename + ".blob"
+            os.link(blob, tmpname)
+            os.replace(tmpname, filename)
+            return size
+        except OSError:
+            # no hard link support on this filesystem (or someone
+            # else created the blob just now), keep the plain file
+            return 0
+
+    def _unlink_blob(self, filename):
+        # make filename a plain file again, so that writing to it
+        # doesn't change other files with the same content
+        tmpname = filename + ".blob"
+        shutil.copy2(filename, tmpname)
+        os.replace(tmpname, filename)
+
+    def _link_blobs(self, path):
+        if os.path.isdir(path):
+            files = list(util.list_dirs(path))
+        else:
+            files = [path]
+        return sum(self._link_blob(f) for f in files)
+
+    def deduplicate_archive(self):
+        """Stores all downloaded files in the archive (including those
+        archived before the ``blob`` archiving policy was used) as
+        hard links to content-addressed blobs, removes blobs that are
+        no longer used by any archived version and rebuilds the index
+        of archived versions. Any other archived files that are
+        linked to blobs are made into plain files again.
+
+        :returns: The number of bytes saved
+        :rtype: int
+        """
+        saved = 0
+        archivedir = self.resourcepath("archive")
+        downloadeddir = self.resourcepath("archive/downloaded") + os.sep
+        blobdir = self.resourcepath("archive/.blobs")
+        for dirpath, dirnames, filenames in os.walk(archivedir):
+            if dirpath == archivedir and ".blobs" in dirnames:
+                dirnames.remove(".blobs")
+            for filename in filenames:
+                path = dirpath + os.sep + filename
+                if dirpath == archivedir or filename.endswith(".blob"):
+                    continue  # the index itself, or leftovers
+                if path.startswith(downloadeddir):
+                    saved += self._link_blob(path)
+                elif os.stat(path).st_nlink > 1:
+                    self._unlink_blob(path)
+        if os.path.exists(blobdir):
+            for blob in list(util.list_dirs(blobdir)):
+                if os.stat(blob).st_nlink == 1:
+                    util.robust_remove(blob)
+        self._archiveindex = ArchiveIndex(self.resourcepath("archive/versions.txt"))
+        self._archiveindex.rebuild(self._scan_archive())
+        return saved
+
     def list_versions_for_basefiles(self, basefiles, action, force=False):
         adjective = {'parse': 'downloaded',
                      'generate': 'parsed',
@@ -795,6 +1172,9 @@ dependencies (in the form of source files for the action).
         :type version: str
         """
 
+        actions = {self.downloaded_path: 'downloaded',
+                   self.parsed_path: 'parsed',
+                   self.generated_path: 'generated'}
         for meth in (self.downloaded_path, self.documententry_path,
                      self.parsed_path, self.serialized_path,
                      self.distilled_path,
@@ -808,6 +1188,18 @@ dependencies (in the form of source files for the action).
                                                          self.generated_path):
                 src = os.path.dirname(src)
                 dest = os.path.dirname(dest)
+            if packfile.lookup(src)[0] is not None and not os.path.exists(src):
+                # archived versions of packed files are stored as
+                # ordinary files
+                if not packfile.exists(src):
+                    continue
+                if os.path.exists(dest) and not overwrite:
+                    raise errors.ArchivingError(
+                        "Archive destination %s for basefile %s version %s already exists!" % (dest, basefile, version))
+                util.writefile(dest, packfile.read(src))
+                if not copy:
+                    packfile.remove(src)
+                continue
             if not os.path.exists(src):
                 continue
             if os.path.exists(dest):
@@ -823,6 +1215,15 @@ dependencies (in the form of source files for the action).
                 shutil.copy2(src, dest)
             else:
                 shutil.move(src, dest)
+            if self.archiving_policy == "blob":
+                # only downloaded files are never written to after
+                # being archived -- eg. generate(basefile, version)
+                # rewrites archived generated files in place, which
+                # would change all linked versions
+                if meth == self.downloaded_path:
+                    self._link_blobs(dest)
+                if meth in actions:
+                    self.archiveindex.record(actions[meth], basefile, version)
 
     def remove(self, basefile):
         """Like archive, but doesn't actually archive anything, just removes the current version"""
@@ -837,6 +1238,10 @@ dependencies (in the form of source files for the action).
                                                          self.parsed_path,
                                                          self.generated_path):
                 src = os.path.dirname(src)
+            if packfile.lookup(src)[0] is not None:
+                if packfile.remove(src):
+                    removed += 1
+                continue
             if not os.path.exists(src):
                 continue
             else:
@@ -875,7 +1280,7 @@ dependencies (in the form of source files for the action).
         """
 
         filename = self.downloaded_path(basefile, version, attachment)
-        return _open(filename, mode)
+        return self._open(filename, mode)
 
     def documententry_path(self, basefile, version=None):
         """Get the full path for the documententry JSON file for the given
@@ -925,7 +1330,7 @@ dependencies (in the form of source files for the action).
         :meth:`~ferenda.DocumentStore.intermediate_path`.
         """
         filename = self.intermediate_path(basefile, version, attachment, suffix)
-        return _open(filename, mode, self.compression)
+        return self._open(filename, mode, self.compression)
 
     def parsed_path(self, basefile, version=None, attachment=None):
         """Get the full path for the parsed XHTML file for the given
@@ -953,7 +1358,7 @@ dependencies (in the form of source files for the action).
 
         """
         filename = self.parsed_path(basefile, version, attachment)
-        return _open(filename, mode)
+        return self._open(filename, mode)
 
     def serialized_path(self, basefile, version=None, attachment=None):
         """Get the full path for the serialized JSON file for the given
@@ -977,7 +1382,7 @@ dependencies (in the form of source files for the action).
 
         """
         filename = self.serialized_path(basefile, version)
-        return _open(filename, mode)
+        return self._open(filename, mode)
 
     def distilled_path(self, basefile, version=None):
         """Get the full path for the distilled RDF/XML file for the given
@@ -1001,7 +1406,22 @@ dependencies (in the form of source files for the action).
 
         """
         filename = self.distilled_path(basefile, version)
-        return _open(filename, mode)
+        return self._open(filename, mode)
+
+    def parsedcache_path(self, basefile, version=None):
+        """Get the full path for the binary cache of the distilled RDF
+        data for the given basefile (see
+        :py:meth:`~ferenda.DocumentRepository.distilled_graph`).
+
+        :param basefile: The basefile for which to calculate the path
+        :type  basefile: str
+        :param  version: Optional. The archived version id
+        :type   version: str
+        :returns: The full filesystem path
+        :rtype:   str
+        """
+        return self.path(basefile, 'parsedcache', '.pickle',
+                         version, storage_policy="file")
 
     def generated_path(self, basefile, version=None, attachment=None):
         """Get the full path for the generated file for the given
@@ -1028,7 +1448,7 @@ dependencies (in the form of source files for the action).
 
         """
         filename = self.generated_path(basefile, version, attachment)
-        return _open(filename, mode)
+        return self._open(filename, mode)
 
 
 # Removed this method until I find a reason to use it
@@ -1063,7 +1483,7 @@ dependencies (in the form of source files for the action).
         the same as for
         :meth:`~ferenda.DocumentStore.annotation_path`."""
         filename = self.annotation_path(basefile, version)
-        return _open(filename, mode)
+        return self._open(filename, mode)
 
     def dependencies_path(self, basefile):
         """Get the full path for the dependency file for the given
@@ -1082,7 +1502,7 @@ dependencies (in the form of source files for the action).
         the same as for
         :meth:`~ferenda.DocumentStore.dependencies_path`."""
         filename = self.dependencies_path(basefile)
-        return _open(filename, mode)
+        return self._open(filename, mode)
 
     def atom_path(self, basefile):
         """Get the full path for the atom file for the given
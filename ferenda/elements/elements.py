@@ -29,10 +29,9 @@ import json
 import logging
 import re
 import inspect
-import unicodedata
 import xml.etree.cElementTree as ET
 import sys
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 
 from layeredconfig import LayeredConfig
@@ -92,6 +91,51 @@ def deserialize(xmlstr, format="xml", caller_globals=None):
         t = __deserialize_json(root)
         return t
 
+# The standard xhtml attributes (including some RDFa ones) that
+# AbstractElement.as_xhtml and CompoundElement.as_xhtml copy from
+# element objects. FIXME: There should be an overridable class
+# variable with this list. action and method is really only
+# applicable to html.Form, for is only for html.Label, and
+# type+name+placeholder for html.Input, and rows+cols for
+# html.Textarea. 'style' is useful when handling FixedLayoutSource
+# documents, but probably harmful in other cases.
+_BASIC_XHTML_ATTRS = ('class', 'id', 'dir', 'lang', 'src', 'href', 'name',
+                      'alt', 'role', 'action', 'method', 'style')
+_XHTML_ATTRS = ('class', 'id', 'dir', 'lang', 'src', 'href', 'name', 'alt',
+                'role', 'typeof', 'datatype', 'property', 'rel', 'about',
+                'action', 'method', 'for', 'type', 'value', 'rows', 'cols',
+                'checked', 'placeholder', 'style')
+
+# characters that are not allowed in XML documents (see
+# CompoundElement._cleanstring) and control characters (see
+# UnicodeElement.clean_string)
+_invalid_xml_chars = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+_control_chars = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]")
+
+_RenderingPlan = namedtuple("RenderingPlan", "tagname classattrs")
+_rendering_plans = {}
+
+
+def _rendering_plan(cls):
+    """Returns the precomputed facts about *cls* that as_xhtml needs:
+    the tagname (if the class uses the default, class name-based
+    one) and which of the xhtml attributes are defined on the class
+    itself (the remaining ones can only be set on instances)."""
+    try:
+        return _rendering_plans[cls]
+    except KeyError:
+        pass
+    tagname = None
+    for klass in cls.__mro__:
+        if 'tagname' in klass.__dict__:
+            if klass is AbstractElement:
+                tagname = cls.__name__.lower()
+            break
+    plan = _RenderingPlan(tagname,
+                          frozenset(a for a in _XHTML_ATTRS if hasattr(cls, a)))
+    _rendering_plans[cls] = plan
+    return plan
+
 
 class AbstractElement(object):
 
@@ -157,12 +201,24 @@ that includes this element."""
                     in the resulting XHTML.
         :type uri: str
 """
-        attrs = {}
-        for stdattr in ('class', 'id', 'dir', 'lang', 'src',
-                        'href', 'name', 'alt', 'role', 'action', 'method', 'style'):
-            if hasattr(self, stdattr) and getattr(self, stdattr):
-                attrs[stdattr] = getattr(self, stdattr)
-        return E(self.tagname, attrs)
+        plan = _rendering_plan(self.__class__)
+        return E(plan.tagname or self.tagname,
+                 self._xhtml_attrs(plan, _BASIC_XHTML_ATTRS, {}))
+
+    def _xhtml_attrs(self, plan, names, attrs):
+        # Copies all truthy attributes in names to the attrs dict. An
+        # attribute that isn't defined by the class can only be an
+        # instance attribute, so we look for it in __dict__ directly
+        # (avoiding the exception raised by a failed hasattr)
+        instanceattrs = self.__dict__
+        for name in names:
+            if name in plan.classattrs:
+                value = getattr(self, name, None)
+            else:
+                value = instanceattrs.get(name)
+            if value:
+                attrs[name] = value
+        return attrs
 
 
 class UnicodeElement(AbstractElement, str):
@@ -199,12 +255,9 @@ properties (such as ordinal label, date of enactment, etc)."""
     def clean_string(self):
         # remove any control characters (except TAB, CR or LF as these
         # are allowed in XML) that might have been present in the
-        # source
-        newstring = ""
-        for char in str(self):
-            if char in ('\r', '\n', '\t') or unicodedata.category(char) != "Cc":
-                newstring += char
-        return newstring
+        # source. _control_chars matches exactly the characters in
+        # the unicode category Cc, minus the allowed ones.
+        return _control_chars.sub("", str(self))
 
     def __str__(self):
         if sys.version_info[0] < 3:
@@ -236,6 +289,10 @@ class CompoundElement(AbstractElement, list):
         return len(self) != 0
 
     def _cleanstring(self, s):
+        # most strings don't contain any invalid chars at all, which
+        # can be determined quickly
+        if not _invalid_xml_chars.search(s):
+            return s
         # valid chars according to the XML spec
         def _valid(i):
             return (
@@ -265,9 +322,10 @@ class CompoundElement(AbstractElement, list):
     # subsection ordinal="1.1" uri=body.uri+"#S"+ordinal, ispartof=parent.uri
     # subsubsection ordinal="1.1.1" uri=body.uri+"#S"+ordinal, ispartof=parent.uri
     def as_xhtml(self, uri=None, parent_uri=None):
+        plan = _rendering_plan(self.__class__)
         children = []
         # start by handling all children recursively
-
+        p = None
         for subpart in self:
             if (isinstance(subpart, AbstractElement) or
                     hasattr(subpart, 'as_xhtml')):
@@ -278,15 +336,18 @@ class CompoundElement(AbstractElement, list):
                 # SectionalElement.as_xhtml (which overrides and calls
                 # this method). can self.uri be a property method,
                 # what will it need? (uri and self.ordinal)
-
-                if hasattr(self, 'uri') and self.uri:
-                    p = self.uri
-                elif hasattr(self, 'compute_uri'):
-                    p = self.compute_uri(baseuri=uri)
-                elif parent_uri:
-                    p = parent_uri
-                else:
-                    p = uri
+                #
+                # p is the same for all children, so it's only
+                # computed once.
+                if p is None:
+                    if hasattr(self, 'uri') and self.uri:
+                        p = self.uri
+                    elif hasattr(self, 'compute_uri'):
+                        p = self.compute_uri(baseuri=uri)
+                    elif parent_uri:
+                        p = parent_uri
+                    else:
+                        p = uri
                 node = subpart.as_xhtml(uri, p)
                 if node is not None:
                     children.append(node)
@@ -305,18 +366,8 @@ class CompoundElement(AbstractElement, list):
             attrs['class'] = self.classname
 
         # copy (a subset of) standard xhtml attributes (including some
-        # RDFa ones). FIXME: There should be an overridable class
-        # variable with this list. action and method is really only
-        # applicable to html.Form, for is only for html.Label, and
-        # type+name+placeholder for html.Input, and rows+cols for
-        # html.Textarea. 'style' is useful when handling
-        # FixedLayoutSource documents, but probably harmful in other
-        # cases.
-        for stdattr in ('class', 'id', 'dir', 'lang', 'src',
-                        'href', 'name', 'alt', 'role', 'typeof',
-                        'datatype', 'property', 'rel', 'about', 'action', 'method', 'for', 'type', 'name', 'value', 'rows', 'cols', 'checked', 'placeholder', 'style'):
-            if hasattr(self, stdattr) and getattr(self, stdattr):
-                attrs[stdattr] = getattr(self, stdattr)
+        # RDFa ones), see _XHTML_ATTRS
+        self._xhtml_attrs(plan, _XHTML_ATTRS, attrs)
 
         # create extra attributes depending on circumstances
         if hasattr(self, 'uri') and self.uri:
@@ -352,7 +403,7 @@ class CompoundElement(AbstractElement, list):
 
         # for each childen that is a string, make sure it doesn't
         # contain any XML illegal characters
-        res = E(self.tagname, attrs, *children)
+        res = E(plan.tagname or self.tagname, attrs, *children)
         return res
     
     
@@ -205,3 +205,9 @@ class RequestHandlerError(FerendaException):
     """Raised when :py:class:`~ferenda.RequestHandler` attempts to handle
     an incoming request that it thinks it can support, but fails."""
 
+
+
+class PageRendererBusy(RequestHandlerError):
+    """Raised when :py:class:`~ferenda.PageRenderer` can't render a page
+    image within a reasonable time, since the maximum number of
+    renders are already running."""
@@ -4,9 +4,11 @@ from __future__ import (absolute_import, division,
 from builtins import *
 
 import builtins
-from collections import deque
+from collections import deque, OrderedDict
+from timeit import default_timer
 import logging
 import inspect
+import os
 
 from ferenda.errors import FSMStateError
 
@@ -24,6 +26,10 @@ class FSMParser():
 
     def __init__(self):
         self.debug = False
+        # if True, record calls, hits and time spent for each
+        # recognizer (see profile_report())
+        self.profile = bool(os.environ.get('FERENDA_FSMPROFILE'))
+        self.profiledata = OrderedDict()  # reset by parse()
         self.transitions = None  # set by set_transitions
         self.recognizers = None  # set by set_recognizers() or set_transitions()
         self.reader = None  # set by parse()
@@ -32,6 +38,7 @@ class FSMParser():
         self.initial_constructor = None
         # pseudo-internal
         self._state_stack = []
+        self._applicable = {}
         self.log = logging.getLogger(__name__)
 
     def _debug(self, msg):
@@ -49,9 +56,11 @@ class FSMParser():
         order to recognize symbols from the stream of text
         chunks. Recognizers are tried in the order specified here."""
         self.recognizers = args
+        self._applicable = {}
 
     def remove_recognizer(self, recognizer):
         self.recognizers = tuple(x for x in self.recognizers if x != recognizer)
+        self._applicable = {}
 
     def set_transitions(self, transitions):
         """Set the transition table for the state matchine.
@@ -60,6 +69,7 @@ class FSMParser():
 
         """
         self.transitions = {}
+        self._applicable = {}
         for (before, after) in transitions.items():
             (before_states, recognizer) = before
             if not callable(after):
@@ -109,47 +119,78 @@ class FSMParser():
         self._debug("Starting parse")
         self.reader = Peekable(chunks)
         self._state_stack = [self.initial_state]
-        return self.initial_constructor(self)
+        self._applicable = {}
+        self.profiledata = OrderedDict()
+        res = self.initial_constructor(self)
+        if self.profile:
+            self.log.info("Recognizer profile:\n%s" % self.profile_report())
+        return res
+
+    def applicable_recognizers(self, state):
+        """Returns the recognizers that has a transition from the given
+        state, in the order specified by set_recognizers()."""
+        try:
+            return self._applicable[state]
+        except KeyError:
+            applicable = tuple(x for x in self.recognizers
+                               if (state, x) in self.transitions)
+            self._applicable[state] = applicable
+            return applicable
+
+    def profile_report(self):
+        """Returns a summary of the data collected for each recognizer
+        during the last call to parse(), if self.profile is True, with
+        the most time-consuming recognizers first."""
+        lines = []
+        for recognizer, (calls, hits, elapsed) in sorted(
+                self.profiledata.items(), key=lambda x: x[1][2], reverse=True):
+            lines.append("%-32s %8d calls %8d hits %10.3f ms" %
+                         (recognizer.__name__, calls, hits, elapsed * 1000))
+        return "\n".join(lines)
+
+    def _chunk_display(self, rawchunk):
+        chunk = str(rawchunk)
+        if len(chunk) > 90:
+            seg = (chunk[:25], chunk[-10:])
+            try:
+                chunk = "%s [...] %s" % seg
+            except UnicodeDecodeError:
+                chunk = "%r [...] %r" % seg
+        return chunk
 
     def analyze_symbol(self):
         """Internal function used by make_children()"""
         try:
             rawchunk = self.reader.peek()
-            chunk = str(rawchunk)
-            # chunk = repr(rawchunk)
-            if len(chunk) > 90:
-                # chunk = chunk[:25] + "[...]" + chunk[-10:]
-                seg = (chunk[:25], chunk[-10:])
-                try:
-                    chunk = "%s [...] %s" % seg
-                except UnicodeDecodeError:
-                    chunk = "%r [...] %r" % seg
-            else:
-                chunk = chunk
-
         except StopIteration:
             self._debug("We're done!")
             return None
 
-        applicable_tmp = [x[1]
-                          for x in self.transitions.keys() if x[0] == self._state_stack[-1]]
-        # Create correct sorting of applicable_recognizers
-        applicable_recognizers = []
-        for recognizer in self.recognizers:
-            if recognizer in applicable_tmp:
-                applicable_recognizers.append(recognizer)
-
-        applicable_display = ", ".join([x.__name__ for x in applicable_recognizers])
+        applicable_recognizers = self.applicable_recognizers(self._state_stack[-1])
         for recognizer in applicable_recognizers:
-            if recognizer(self):
-                self._debug("Tested '%s' against %s -> %s " %
-                            (chunk, applicable_display,
-                             recognizer.__name__))
-                # self._debug("%r -> %s" % (chunk, recognizer.__name__))
+            if self.profile:
+                start = default_timer()
+                hit = recognizer(self)
+                elapsed = default_timer() - start
+                if recognizer not in self.profiledata:
+                    self.profiledata[recognizer] = [0, 0, 0.0]
+                stats = self.profiledata[recognizer]
+                stats[0] += 1
+                stats[1] += bool(hit)
+                stats[2] += elapsed
+            else:
+                hit = recognizer(self)
+            if hit:
+                if self.debug:
+                    self._debug("Tested '%s' against %s -> %s " %
+                                (self._chunk_display(rawchunk),
+                                 ", ".join([x.__name__ for x in applicable_recognizers]),
+                                 recognizer.__name__))
                 return recognizer
         raise FSMStateError(
             "No recognizer match for %s (tried %s)" %
-            (chunk, applicable_display))
+            (self._chunk_display(rawchunk),
+             ", ".join([x.__name__ for x in applicable_recognizers])))
 
     def transition(self, currentstate, symbol):
         """Internal function used by make_children()"""
@@ -18,6 +18,7 @@ import tempfile
 import requests
 import requests.exceptions
 from bs4 import BeautifulSoup
+from cached_property import cached_property
 
 from ferenda import util, errors
 import logging
@@ -162,6 +163,11 @@ class FulltextIndex(object):
         """Returns the number of currently indexed (non-deleted) documents."""
         raise NotImplementedError  # pragma: no cover
 
+    def generation(self):
+        """Returns a value that changes whenever changes to the index are
+        committed, or None if that can't be determined cheaply."""
+        return None
+
     def query(self, q=None, pagenum=1, pagelen=10, ac_query=False, exclude_repos=None, boost_repos=None, include_fragments=False, **kwargs):
         """Perform a free text query against the full text index, optionally
            restricted with parameters for individual fields.
@@ -342,20 +348,17 @@ class Results(list):
     # list-like object.
     pass
 
-import whoosh.index
-import whoosh.fields
-import whoosh.analysis
-import whoosh.query
-import whoosh.qparser
-import whoosh.writing
-import whoosh.highlight
+# NOTE: whoosh is imported by the methods that need it, not at module
+# level, since importing it takes a noticeable amount of time and most
+# ferenda-build.py commands never use the fulltext index.
 
 from ferenda.elements import html
 
 
-class ElementsFormatter(whoosh.highlight.Formatter):
+class ElementsFormatter(object):
 
-    """Returns a tree of ferenda.elements representing the formatted hit."""
+    """Returns a tree of ferenda.elements representing the formatted hit.
+    Implements the interface of :py:class:`whoosh.highlight.Formatter`."""
 
     def __init__(self, wrapelement=html.P, hitelement=html.Strong,
                  classname="match", between=" ... "):
@@ -364,6 +367,9 @@ class ElementsFormatter(whoosh.highlight.Formatter):
         self.classname = classname
         self.between = between
 
+    def __call__(self, text, fragments):
+        return self.format(fragments)
+
     def format(self, fragments, replace=False):
         res = self.wrapelement()
         first = True
@@ -377,6 +383,7 @@ class ElementsFormatter(whoosh.highlight.Formatter):
     re_collapse = re.compile("\s+").sub
 
     def format_fragment(self, fragment, replace):
+        import whoosh.highlight
         output = []
         index = fragment.startchar
         text = fragment.text
@@ -394,23 +401,27 @@ class ElementsFormatter(whoosh.highlight.Formatter):
 
 class WhooshIndex(FulltextIndex):
 
-    fieldmapping = ((Identifier(),    whoosh.fields.ID(unique=True, stored=True)),
-                    (Label(),         whoosh.fields.ID(stored=True)),
-                    (Label(boost=16), whoosh.fields.ID(field_boost=16, stored=True)),
-                    (Text(boost=4),   whoosh.fields.TEXT(field_boost=4, stored=True,
-                                                         analyzer=whoosh.analysis.StemmingAnalyzer(
-                                                         ))),
-                    (Text(boost=2),   whoosh.fields.TEXT(field_boost=2, stored=True,
-                                                         analyzer=whoosh.analysis.StemmingAnalyzer(
-                                                         ))),
-                    (Text(),          whoosh.fields.TEXT(stored=True,
-                                                         analyzer=whoosh.analysis.StemmingAnalyzer())),
-                    (Datetime(),      whoosh.fields.DATETIME(stored=True)),
-                    (Boolean(),       whoosh.fields.BOOLEAN(stored=True)),
-                    (URI(),           whoosh.fields.ID(stored=True, field_boost=1.1)),
-                    (Keyword(),       whoosh.fields.KEYWORD(stored=True)),
-                    (Resource(),      whoosh.fields.IDLIST(stored=True)),
-                    )
+    @cached_property
+    def fieldmapping(self):
+        import whoosh.analysis
+        import whoosh.fields
+        return ((Identifier(),    whoosh.fields.ID(unique=True, stored=True)),
+                (Label(),         whoosh.fields.ID(stored=True)),
+                (Label(boost=16), whoosh.fields.ID(field_boost=16, stored=True)),
+                (Text(boost=4),   whoosh.fields.TEXT(field_boost=4, stored=True,
+                                                     analyzer=whoosh.analysis.StemmingAnalyzer(
+                                                     ))),
+                (Text(boost=2),   whoosh.fields.TEXT(field_boost=2, stored=True,
+                                                     analyzer=whoosh.analysis.StemmingAnalyzer(
+                                                     ))),
+                (Text(),          whoosh.fields.TEXT(stored=True,
+                                                     analyzer=whoosh.analysis.StemmingAnalyzer())),
+                (Datetime(),      whoosh.fields.DATETIME(stored=True)),
+                (Boolean(),       whoosh.fields.BOOLEAN(stored=True)),
+                (URI(),           whoosh.fields.ID(stored=True, field_boost=1.1)),
+                (Keyword(),       whoosh.fields.KEYWORD(stored=True)),
+                (Resource(),      whoosh.fields.IDLIST(stored=True)),
+                )
 
     def __init__(self, location, repos):
         self._writer = None
@@ -429,12 +440,16 @@ class WhooshIndex(FulltextIndex):
                 self._multiple[fld] = facet.multiple_values
 
     def exists(self):
+        import whoosh.index
         return whoosh.index.exists_in(self.location)
 
     def open(self):
+        import whoosh.index
         return whoosh.index.open_dir(self.location)
 
     def create(self, repos):
+        import whoosh.fields
+        import whoosh.index
         schema = self.make_schema(repos)
         whoosh_fields = {}
         for key, fieldtype in schema.items():
@@ -488,6 +503,7 @@ class WhooshIndex(FulltextIndex):
 
     def commit(self):
         if self._writer:
+            import whoosh.writing
             self._writer.commit()
             if not isinstance(self._writer, whoosh.writing.BufferedWriter):
                 # A bufferedWriter can be used again after commit(), a regular writer cannot
@@ -500,7 +516,13 @@ class WhooshIndex(FulltextIndex):
     def doccount(self):
         return self.index.doc_count()
 
+    def generation(self):
+        return self.index.latest_generation()
+
     def query(self, q=None, pagenum=1, pagelen=10, ac_query=False, exclude_repos=None, boost_repos=None, include_fragments=False, **kwargs):
+        import whoosh.fields
+        import whoosh.qparser
+        import whoosh.query
         # 1: Filter on all specified fields (exact or by using ranges)
         filter = []
         for k, v in kwargs.items():
@@ -567,6 +589,7 @@ class WhooshIndex(FulltextIndex):
     def _convert_result(self, res):
         # converts a whoosh.searching.ResultsPage object to a plain
         # list of dicts
+        import whoosh.highlight
         l = Results()
         hl = whoosh.highlight.Highlighter(formatter=ElementsFormatter())
         resourcefields = []
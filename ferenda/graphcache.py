@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""A process-wide cache of parsed RDF files (the ontologies and
+commondata of each docrepo, and similar resource files).
+
+Parsing Turtle with rdflib is slow, and the same files are parsed by
+every docrepo instance that uses them, in every process. This module
+parses each file once per process, keeps the resulting triples in
+memory (keyed by the path and modification time of the file) and
+creates new graphs from those triples. Optionally, the triples are
+also stored in a binary pickle file, so that new processes can load
+them without parsing.
+
+Graphs returned by :py:func:`parse` are always new objects that the
+caller is free to modify. The cached triples themselves are never
+modified, so after a call to :py:func:`preload` in the parent process
+of a forking server, all child processes share them.
+"""
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+
+import hashlib
+import logging
+import os
+import pickle
+
+from rdflib import Graph
+
+from ferenda import util
+
+# bump whenever the layout of the pickled data changes, so that old
+# caches are ignored
+CACHE_VERSION = 1
+
+# absolute path -> ((mtime, size), namespaces, triples)
+_graphs = {}
+
+
+def _signature(filename):
+    st = os.stat(filename)
+    return (st.st_mtime, st.st_size)
+
+
+def _cachepath(cachedir, filename):
+    return "%s%s%s.pickle" % (cachedir, os.sep,
+                              hashlib.sha1(filename.encode("utf-8")).hexdigest())
+
+
+def load(filename, format="turtle", cachedir=None):
+    """Returns the namespaces and triples of the RDF file *filename*,
+    parsing it only if it hasn't already been parsed by this process
+    (or cached in *cachedir* by any process) since it was last
+    modified.
+
+    :param filename: The RDF file
+    :type  filename: str
+    :param format: The RDF serialization format of the file
+    :type  format: str
+    :param cachedir: Optional. A directory where the parsed triples
+                     are cached between processes.
+    :type  cachedir: str
+    :returns: A tuple ``(namespaces, triples)``, which must not be modified
+    :rtype: tuple
+    """
+    filename = os.path.abspath(filename)
+    signature = _signature(filename)
+    cached = _graphs.get(filename)
+    if cached and cached[0] == signature:
+        return cached[1], cached[2]
+    log = logging.getLogger("graphcache")
+    data = None
+    if cachedir:
+        cachepath = _cachepath(cachedir, filename)
+        if os.path.exists(cachepath):
+            try:
+                with open(cachepath, "rb") as fp:
+                    cacheversion, cachesignature, namespaces, triples = pickle.load(fp)
+                if cacheversion == CACHE_VERSION and cachesignature == signature:
+                    data = namespaces, triples
+            except Exception as e:
+                log.warning("Couldn't load %s (%s: %s), parsing %s instead" %
+                            (cachepath, type(e).__name__, e, filename))
+    if data is None:
+        with util.logtime(log.debug, "%(filename)s: parsed in %(elapsed).3f sec",
+                          {'filename': filename}):
+            g = Graph()
+            with open(filename, "rb") as fp:
+                g.parse(data=fp.read(), format=format)
+            data = tuple(g.namespaces()), tuple(g)
+        if cachedir:
+            util.ensure_dir(cachepath)
+            tmppath = "%s.%s" % (cachepath, os.getpid())
+            with open(tmppath, "wb") as fp:
+                pickle.dump((CACHE_VERSION, signature) + data, fp,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(tmppath, cachepath)
+    _graphs[filename] = (signature,) + data
+    return data
+
+
+def parse(filename, graph=None, format="turtle", cachedir=None):
+    """Adds the triples of the RDF file *filename* to *graph* (or a new
+    graph), like :py:meth:`rdflib.graph.Graph.parse`, but using the
+    cache described by :py:func:`load`.
+
+    :param filename: The RDF file
+    :type  filename: str
+    :param graph: The graph to add triples to
+    :type  graph: rdflib.Graph
+    :param format: The RDF serialization format of the file
+    :type  format: str
+    :param cachedir: Optional. A directory where the parsed triples
+                     are cached between processes.
+    :type  cachedir: str
+    :returns: The graph
+    :rtype: rdflib.Graph
+    """
+    namespaces, triples = load(filename, format, cachedir)
+    if graph is None:
+        graph = Graph()
+    for prefix, namespace in namespaces:
+        graph.bind(prefix, namespace)
+    graph.addN((s, p, o, graph) for (s, p, o) in triples)
+    return graph
+
+
+def preload(filenames, format="turtle", cachedir=None):
+    """Loads all *filenames* into the cache, eg. before a server forks
+    its worker processes.
+
+    :returns: The number of triples loaded
+    :rtype: int
+    """
+    return sum(len(load(f, format, cachedir)[1]) for f in filenames)
+
+
+def clear():
+    """Empties the in-memory cache."""
+    _graphs.clear()
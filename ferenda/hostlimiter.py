@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import threading
+import time
+
+
+class HostLimiter(object):
+    """Limits the number of concurrent requests to each remote host,
+    and optionally enforces a minimum delay between the start of two
+    requests to the same host. Used by
+    :py:meth:`~ferenda.DocumentRepository.download_if_needed` so that
+    downloading with several threads doesn't hammer any single server.
+
+    :param concurrency: The maximum number of simultaneous requests
+                        to a single host
+    :type  concurrency: int
+    :param delay: The minimum number of seconds between the start of
+                  two requests to a single host
+    :type  delay: float
+    """
+
+    def __init__(self, concurrency=2, delay=0):
+        self.concurrency = max(1, int(concurrency))
+        self.delay = float(delay or 0)
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._nextstart = {}
+
+    def host(self, url):
+        return urlparse(url).netloc.lower()
+
+    def semaphore(self, host):
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.concurrency)
+            return self._semaphores[host]
+
+    @contextmanager
+    def limit(self, url):
+        """Context manager that blocks until a request to the host of
+        *url* may start, and keeps a slot for that host occupied until
+        the block exits."""
+        host = self.host(url)
+        semaphore = self.semaphore(host)
+        semaphore.acquire()
+        try:
+            if self.delay:
+                with self._lock:
+                    now = time.time()
+                    start = max(now, self._nextstart.get(host, 0))
+                    self._nextstart[host] = start + self.delay
+                if start > now:
+                    time.sleep(start - now)
+            yield
+        finally:
+            semaphore.release()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+
+from bisect import bisect_left, bisect_right
+from difflib import SequenceMatcher
+
+
+class LabelIndex(object):
+    """An index of the labels (eg. ``foaf:name`` values) of all resources
+    in a graph, used by
+    :py:meth:`~ferenda.DocumentRepository.lookup_resource` to find the
+    resource for a label without iterating over the graph.
+
+    Fuzzy lookups give the same result as
+    :py:func:`difflib.get_close_matches` over all labels. However, only
+    those labels whose lengths make a match possible at all are
+    compared, and results are memoized per label and cutoff.
+
+    :param graph: The graph to index
+    :type  graph: rdflib.Graph
+    :param predicate: The predicate whose objects are the labels
+    :type  predicate: rdflib.term.URIRef
+    """
+
+    def __init__(self, graph, predicate):
+        self.graph = graph
+        self.size = len(graph)
+        # for exact matches, the first resource with a label wins,
+        # for fuzzy matches the last one (like lookup_resource always
+        # has done)
+        self.exact = {}
+        self.resources = {}
+        for (resource, label) in graph.subject_objects(predicate):
+            label = str(label)
+            self.exact.setdefault(label, resource)
+            self.resources[label] = resource
+        self.labels = sorted(self.resources, key=len)
+        self.lengths = [len(label) for label in self.labels]
+        self.memo = {}
+
+    def is_current(self, graph):
+        """Returns whether the index still reflects *graph* (ie. it is
+        the same graph and no triples have been added or removed)."""
+        return graph is self.graph and len(graph) == self.size
+
+    def lookup(self, label, cutoff=0.8):
+        """Returns the resource with the label *label*, or the label
+        that's the closest match for it.
+
+        :returns: A tuple ``(resource, matched label)``
+        :rtype: tuple
+        :raises KeyError: If no label is close enough
+        """
+        if label in self.exact:
+            return self.exact[label], label
+        key = (label, cutoff)
+        if key not in self.memo:
+            self.memo[key] = self.closest(label, cutoff)
+        match = self.memo[key]
+        if match is None:
+            raise KeyError(label)
+        return self.resources[match], match
+
+    def closest(self, label, cutoff=0.8):
+        """Returns the label most similar to *label*, as determined by
+        :py:func:`difflib.get_close_matches`, or ``None``."""
+        if not 0.0 <= cutoff <= 1.0:
+            raise ValueError("cutoff must be in [0.0, 1.0]: %r" % (cutoff,))
+        # SequenceMatcher.real_quick_ratio, the first test
+        # get_close_matches does, is 2*min(a,b)/(a+b) for labels of
+        # length a and b, so only a range of lengths can pass it. The
+        # range is widened by one to avoid rounding issues, since the
+        # real tests are made below anyway.
+        length = len(label)
+        lo = bisect_left(self.lengths, int(length * cutoff / (2 - cutoff)) - 1)
+        if cutoff > 0:
+            hi = bisect_right(self.lengths, int(length * (2 - cutoff) / cutoff) + 1)
+        else:
+            hi = len(self.labels)
+        s = SequenceMatcher()
+        s.set_seq2(label)
+        best = None
+        for candidate in self.labels[lo:hi]:
+            s.set_seq1(candidate)
+            if (s.real_quick_ratio() >= cutoff and
+                    s.quick_ratio() >= cutoff and
+                    s.ratio() >= cutoff):
+                score = (s.ratio(), candidate)
+                if best is None or score > best:
+                    best = score
+        return best[1] if best else None
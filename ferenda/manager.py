@@ -29,6 +29,7 @@ from time import sleep
 from urllib.parse import urlsplit
 
 from contextlib import contextmanager
+from functools import partial
 import argparse
 import builtins
 import cProfile
@@ -90,15 +91,19 @@ DEFAULT_CONFIG = {
     'datadir': 'data',
     'disallowrobots': False,
     'download': True,
+    'graphcache': False,
     'imgfiles': ['img/atom.png'],
     'jsfiles': ['js/ferenda.js'],
     'legacyapi': False,
     'logfile': True,
     'loglevel': 'DEBUG',
+    'preloadgraphs': False,
     'processes': '1',
     'profile': False,
     'relate': True,
     'removeinvalidlinks': True,
+    'searchcache': 0,
+    'searchcachettl': 300,
     'searchendpoint': "/search/",
     'serverport': 5555,
     'sitedescription': 'Just another Ferenda site',
@@ -354,7 +359,10 @@ def make_wsgi_app(config, enabled=None, repos=None):
             enabled = enabled_classes()
         repos = [_instantiate_class(cls, config) for cls in _classes_from_classname(enabled, 'all')]
     cls = _load_class(config.wsgiappclass)
-    return cls(repos, config)
+    app = cls(repos, config)
+    if LayeredConfig.get(config, 'preloadgraphs'):
+        app.preload()
+    return app
 
 
 loglevels = {'DEBUG': logging.DEBUG,
@@ -1048,12 +1056,16 @@ def _run_class(enabled, argv, config):
             # things like URI transformation to work. FIXME: However we might
             # not need all repos (ie. not repos where relate or even
             # tabs is set to false)
+            #
+            # The other repos are only instantiated if and when the
+            # action actually uses them (see _LazyRepo), but we need
+            # their configuration to find out which ones to include.
             otherrepos = []
             for othercls in _classes_from_classname(enabled, 'all'):
                 if othercls != inst.__class__:
-                    obj = _instantiate_class(othercls, config, argv=argv)
-                    if getattr(obj.config, action, True):
-                        otherrepos.append(obj)
+                    clsconfig = _class_config(othercls, config, argv=argv)
+                    if getattr(clsconfig, action, True):
+                        otherrepos.append(_LazyRepo(othercls, partial(othercls, clsconfig)))
             kwargs['otherrepos'] = otherrepos
 
         if 'all' in inst.config and inst.config.all is True:
@@ -1125,6 +1137,10 @@ def _run_class(enabled, argv, config):
                                 alias)
                         res.append(r)
                 cls.teardown(action, inst.config)
+                manifest = getattr(inst.store, 'hashmanifest', None)
+                if manifest and manifest.files_skipped:
+                    log.info("%s %s: %s unchanged files (%s bytes) didn't need to be compared" %
+                             (alias, action, manifest.files_skipped, manifest.bytes_avoided))
         else:
             # The only thing that kwargs may contain is a 'otherrepos'
             # parameter.
@@ -1156,8 +1172,77 @@ def _run_class(enabled, argv, config):
                     log.error("%s %s failed: %s (%s)" %
                               (action, alias, e, loc))
                     raise e
+    if 'otherrepos' in kwargs:
+        _log_startup_times(log, alias, action, kwargs['otherrepos'])
     return res
 
+
+def _log_startup_times(log, alias, action, repos):
+    # report how long it took to instantiate the other repos that
+    # were actually used, so that slow-starting repos can be found
+    used = sorted([repo for repo in repos if repo.elapsed is not None],
+                  key=lambda repo: repo.elapsed, reverse=True)
+    log.debug("%s %s: instantiated %s of %s other repos in %.3f sec%s" %
+              (alias, action, len(used), len(repos),
+               sum(repo.elapsed for repo in used),
+               " (%s)" % ", ".join("%s: %.3f" % (repo.alias, repo.elapsed)
+                                   for repo in used) if used else ""))
+
+
+class _LazyRepo(object):
+    """Stands in for a docrepo in the otherrepos list, but doesn't
+    create the actual docrepo object (which can take some time, as
+    it sets up stores, resource loaders and often loads commondata)
+    until one of its attributes is first accessed.
+
+    :param cls: The docrepo class
+    :param factory: A callable that returns a configured instance of *cls*
+
+    """
+
+    def __init__(self, cls, factory):
+        object.__setattr__(self, '_cls', cls)
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_inst', None)
+        # the time (in seconds) it took to instantiate the docrepo, or
+        # None if it hasn't been instantiated
+        object.__setattr__(self, 'elapsed', None)
+
+    # makes isinstance() and similar checks work without
+    # instantiating the docrepo
+    @property
+    def __class__(self):
+        return self._cls
+
+    @property
+    def alias(self):
+        return self._cls.alias
+
+    @property
+    def instance(self):
+        """The docrepo object, created when first needed."""
+        if self._inst is None:
+            values = {'classname': self._cls.__name__}
+            with util.logtime(getlog().debug,
+                              "%(classname)s instantiated in %(elapsed).3f sec",
+                              values):
+                inst = self._factory()
+            object.__setattr__(self, '_inst', inst)
+            object.__setattr__(self, 'elapsed', values['elapsed'])
+        return self._inst
+
+    def __getattr__(self, name):
+        if name in ('_cls', '_factory', '_inst'):
+            # not initialized (eg. during unpickling)
+            raise AttributeError(name)
+        return getattr(self.instance, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.instance, name, value)
+
+    def __repr__(self):
+        return "<lazy %s.%s>" % (self._cls.__module__, self._cls.__name__)
+
 # The functions runbuildclient, _queuejobs, _make_client_manager,
 # __make_server_manager, _run_jobqueue_multiprocessing and
 # _build_worker are based on the examples in
@@ -1304,13 +1389,22 @@ def _build_worker(jobqueue, resultqueue, clientname):
         # from the parent process (would that even work?)
         if job['command'] in ('relate', 'generate', 'transformlinks'):
             if job['classname'] not in repos:
+                # like in _run_class, the other repos are only
+                # instantiated if and when they're used.
                 otherrepos = []
                 inst = insts[job['classname']]
                 for alias, classname in enabled_classes().items():
                     if alias != inst.alias:
-                        obj = _instantiate_and_configure(classname, job['config'], logrecords, clientname)
-                        if getattr(obj.config, job['command'], True):
-                            otherrepos.append(obj)
+                        cls = _load_class(classname)
+                        if job['command'] in job['config']:
+                            enabled = job['config'][job['command']]
+                        else:
+                            enabled = getattr(_class_config(cls), job['command'], True)
+                        if enabled:
+                            otherrepos.append(
+                                _LazyRepo(cls, partial(_instantiate_and_configure,
+                                                       classname, job['config'],
+                                                       logrecords, clientname)))
                 repos[job['classname']] = otherrepos
             kwargs['otherrepos'] = repos[job['classname']]
                         
@@ -1751,8 +1845,14 @@ def _instantiate_class(cls, config=None, argv=[]):
     """Given a class object, instantiate that class and make sure the
        instance is properly configured given it's own defaults, a
        config file, and command line parameters."""
+    return cls(_class_config(cls, config, argv))
+
+
+def _class_config(cls, config=None, argv=[]):
+    """Returns the config object that :py:func:`_instantiate_class`
+       uses for the given class, without instantiating it."""
     if hasattr(config, cls.alias):
-        return cls(getattr(config, cls.alias))
+        return getattr(config, cls.alias)
     clsdefaults = cls.get_default_options()
     if not config:
         defaults = dict(DEFAULT_CONFIG)
@@ -1785,9 +1885,7 @@ def _instantiate_class(cls, config=None, argv=[]):
             continue
         if param not in clsconfig._sources[0].source:
             clsconfig._sources[0].source[param] = value
-
-    inst = cls(clsconfig)
-    return inst
+    return clsconfig
 
 
 def enabled_classes(inifile=None, config=None):
@@ -1925,6 +2023,12 @@ def _filter_argv_options(args):
     return options
 
 
+# classname -> (module, class object), for classes loaded by
+# _load_class. An entry is only used as long as the module it came
+# from hasn't been removed from (or replaced in) sys.modules.
+_loaded_classes = {}
+
+
 def _load_class(classname):
     """Given a classname, imports and returns the corresponding class object.
 
@@ -1933,6 +2037,10 @@ def _load_class(classname):
     :returns: Corresponding class object
     :rtype: class
     """
+    if classname in _loaded_classes:
+        m, cls = _loaded_classes[classname]
+        if sys.modules.get(m.__name__) is m:
+            return cls
     if "." in classname:
         (modulename, localclassname) = classname.rsplit(".", 1)
     else:
@@ -1949,11 +2057,11 @@ def _load_class(classname):
     # print("modulename: %s, localclassname: %s" % (modulename,localclassname))
     # print("sys.modules: %s" % sys.modules.keys())
     m = sys.modules[modulename]
-    classes = dict(inspect.getmembers(m, inspect.isclass))
-    for name, cls in list(classes.items()):
-        if name == localclassname:
-            return cls
-    raise ImportError("No class named '%s'" % classname)
+    cls = getattr(m, localclassname, None)
+    if not inspect.isclass(cls):
+        raise ImportError("No class named '%s'" % classname)
+    _loaded_classes[classname] = (m, cls)
+    return cls
 
 
 def find_config_file(path=None, create=False):
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+
+import io
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from ferenda import util
+
+
+class PackFile(object):
+    """Stores all small files below a directory (eg. the ``entries``
+    directory of a docrepo) as rows in a single SQLite database,
+    instead of as millions of separate files.
+
+    Files are still identified by their ordinary paths (as calculated
+    by :py:meth:`~ferenda.DocumentStore.path`). Once a pack is
+    registered with :py:func:`register`, the module-level functions
+    (:py:func:`read`, :py:func:`write`, :py:func:`exists` et al) and
+    :py:class:`~ferenda.DocumentEntry` read and write files below
+    its directory from the pack. Files that aren't in the pack (yet)
+    are read from the file system, and files whose names start with a
+    period are never packed.
+
+    :param filename: The SQLite database file
+    :type  filename: str
+    :param directory: The directory whose files are stored in the pack
+    :type  directory: str
+    """
+
+    def __init__(self, filename, directory):
+        self.filename = filename
+        self.directory = os.path.normpath(directory)
+        self._local = threading.local()
+        self._inherited = []
+
+    @property
+    def conn(self):
+        # sqlite connections can't be shared between threads, or
+        # between processes (eg. the worker processes that
+        # _run_jobqueue_multiprocessing forks)
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid != os.getpid():
+            # a connection inherited from the parent process must not
+            # be used, nor closed (as that might checkpoint or remove
+            # the WAL file that the parent still uses)
+            self._inherited.append(conn)
+            conn = None
+        if conn is None:
+            util.ensure_dir(self.filename)
+            conn = sqlite3.connect(self.filename, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS files "
+                         "(key TEXT PRIMARY KEY, data BLOB, mtime REAL)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            if self._local.pid == os.getpid():
+                conn.close()
+            else:
+                self._inherited.append(conn)
+            self._local.conn = None
+
+    def key(self, path):
+        """Returns the key for *path*, or ``None`` if *path* isn't
+        stored in this pack."""
+        path = os.path.normpath(path)
+        if not path.startswith(self.directory + os.sep):
+            return None
+        if os.path.basename(path).startswith("."):
+            return None
+        return path[len(self.directory) + 1:].replace(os.sep, "/")
+
+    def path(self, key):
+        return self.directory + os.sep + key.replace("/", os.sep)
+
+    def read(self, key):
+        """Returns the content of the file *key* as bytes, or ``None``."""
+        row = self.conn.execute("SELECT data FROM files WHERE key = ?",
+                                (key,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def write(self, key, data, mtime=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO files (key, data, mtime) "
+                              "VALUES (?, ?, ?)",
+                              (key, sqlite3.Binary(data),
+                               time.time() if mtime is None else mtime))
+
+    def stat(self, key):
+        """Returns ``(size, mtime)`` for the file *key*, or ``None``."""
+        row = self.conn.execute("SELECT length(data), mtime FROM files "
+                                "WHERE key = ?", (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def delete(self, key):
+        with self.conn:
+            cursor = self.conn.execute("DELETE FROM files WHERE key = ?", (key,))
+        return cursor.rowcount > 0
+
+    def keys(self, prefix=""):
+        """Returns the keys of all files in the pack (that start with
+        *prefix*), in sorted order."""
+        return [key for (key,) in self.conn.execute(
+            "SELECT key FROM files WHERE key >= ? AND key < ? ORDER BY key",
+            (prefix, prefix + "\U0010ffff"))]
+
+    def files(self):
+        """Returns the database files that currently make up the pack
+        (eg. for checking if anything has been written to it)."""
+        return [f for f in (self.filename, self.filename + "-wal")
+                if os.path.exists(f)]
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def import_files(self):
+        """Moves all files below the directory into the pack.
+
+        :returns: The number of files moved
+        :rtype: int
+        """
+        cnt = 0
+        if not os.path.exists(self.directory):
+            return cnt
+        for path in list(util.list_dirs(self.directory)):
+            key = self.key(path)
+            if key is None:
+                continue
+            with io.open(path, "rb") as fp:
+                self.write(key, fp.read(), os.path.getmtime(path))
+            os.unlink(path)
+            cnt += 1
+        return cnt
+
+    def export_files(self):
+        """Moves all files in the pack back to ordinary files below the
+        directory.
+
+        :returns: The number of files moved
+        :rtype: int
+        """
+        cnt = 0
+        for key in self.keys():
+            path = self.path(key)
+            util.ensure_dir(path)
+            with io.open(path, "wb") as fp:
+                fp.write(self.read(key))
+            mtime = self.stat(key)[1]
+            os.utime(path, (mtime, mtime))
+            self.delete(key)
+            cnt += 1
+        return cnt
+
+
+_packs = {}
+
+
+def register(pack):
+    """Makes files below ``pack.directory`` be read from and written to
+    *pack*."""
+    _packs[pack.directory] = pack
+
+
+def unregister(pack):
+    if _packs.get(pack.directory) is pack:
+        del _packs[pack.directory]
+    pack.close()
+
+
+def get(directory):
+    """Returns the pack registered for *directory*, or ``None``."""
+    return _packs.get(os.path.normpath(directory))
+
+
+def lookup(path):
+    """Returns ``(pack, key)`` for the registered pack that stores
+    *path*, or ``(None, None)`` if it's an ordinary file."""
+    if _packs:
+        path = os.path.normpath(path)
+        directory = os.path.dirname(path)
+        while True:
+            pack = _packs.get(directory)
+            if pack is not None:
+                key = pack.key(path)
+                return (pack, key) if key is not None else (None, None)
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            directory = parent
+    return None, None
+
+
+def read(path):
+    """Returns the content of *path* (as a str), from a pack or from the
+    file system, or ``None`` if it doesn't exist."""
+    pack, key = lookup(path)
+    if pack is not None:
+        data = pack.read(key)
+        if data is not None:
+            return data.decode("utf-8")
+    if os.path.exists(path):
+        with io.open(path, encoding="utf-8") as fp:
+            return fp.read()
+    return None
+
+
+def write(path, data):
+    """Writes *data* to *path* if it's stored in a pack. Returns
+    ``False`` (and writes nothing) if it's an ordinary file."""
+    pack, key = lookup(path)
+    if pack is None:
+        return False
+    pack.write(key, data)
+    if os.path.exists(path):
+        # a stale unpacked copy would otherwise be read if the pack
+        # is ever disabled
+        util.robust_remove(path)
+    return True
+
+
+def exists(path):
+    pack, key = lookup(path)
+    return bool(pack is not None and pack.stat(key)) or os.path.exists(path)
+
+
+def getsize(path):
+    pack, key = lookup(path)
+    stat = pack.stat(key) if pack is not None else None
+    return stat[0] if stat else os.path.getsize(path)
+
+
+def remove(path):
+    """Removes *path* from its pack and/or the file system. Returns
+    ``True`` if anything was removed."""
+    pack, key = lookup(path)
+    removed = bool(pack is not None and pack.delete(key))
+    if os.path.exists(path):
+        util.robust_remove(path)
+        removed = True
+    return removed
+
+
+def copy(src, dst, link=True):
+    """Like :py:func:`ferenda.util.link_or_copy` (or
+    :py:func:`shutil.copy` if *link* is ``False``), but for files that
+    may be stored in packs."""
+    if lookup(src)[0] is not None or lookup(dst)[0] is not None:
+        data = read(src)
+        if data is None:
+            raise IOError("%s does not exist" % src)
+        if not write(dst, data):
+            util.writefile(dst, data)
+    elif link:
+        util.link_or_copy(src, dst)
+    else:
+        util.ensure_dir(dst)
+        shutil.copy(src, dst)
+
+
+class _PackedFile(object):
+    # a file object for a packed file, which is read into memory and
+    # (if opened for writing) written back to the pack when closed
+    def __init__(self, pack, key, mode):
+        self.pack, self.key, self.mode = pack, key, mode
+        data = b""
+        if "w" not in mode:
+            data = pack.read(key)
+            if data is None:
+                if "r" in mode:
+                    raise IOError("No such file in %s: %s" % (pack.filename, key))
+                data = b""
+        if "b" in mode:
+            self.fp = io.BytesIO(data)
+        else:
+            self.fp = io.StringIO(data.decode("utf-8"))
+        if "a" in mode:
+            self.fp.seek(0, io.SEEK_END)
+        self.name = self.realname = pack.path(key)
+
+    def close(self):
+        if not self.fp.closed:
+            if set("wa+") & set(self.mode):
+                self.pack.write(self.key, self.fp.getvalue())
+            self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+    def __iter__(self):
+        return iter(self.fp)
+
+
+def open(path, mode="r"):
+    """Opens a file stored in a pack. Returns ``None`` if *path* is an
+    ordinary file."""
+    pack, key = lookup(path)
+    if pack is None:
+        return None
+    return _PackedFile(pack, key, mode)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+
+import os
+import re
+import shutil
+import tempfile
+import time
+import zlib
+
+from ferenda import util
+from ferenda.errors import PageRendererBusy
+
+
+class PageRenderer(object):
+    """Renders pages of PDF files as trimmed images, using ``pdftoppm``
+    and ImageMagick ``convert``.
+
+    The number of renders that may run at the same time is limited,
+    and only one render at a time is done for each PDF file. Since
+    the renderer is typically used by several web server processes,
+    the limits are enforced with lock files in a shared directory.
+
+    Pages are rendered in batches, with a single ``pdftoppm``
+    invocation, so that the images for the pages following a
+    requested page are already available when they are requested.
+
+    :param lockdir: The directory for lock files
+    :type  lockdir: str
+    :param workers: The maximum number of simultaneous renders
+    :type  workers: int
+    :param batchsize: The number of pages rendered in each batch
+    :type  batchsize: int
+    :param wait: The number of seconds to wait for a render slot (or
+                 for another process rendering the same file) before
+                 giving up
+    :type  wait: float
+    """
+
+    staletimeout = 600
+    """Lock files older than this (in seconds) are assumed to be left
+    behind by a render that crashed, and are removed."""
+
+    pollinterval = 0.1
+
+    def __init__(self, lockdir, workers=2, batchsize=10, wait=5):
+        self.lockdir = lockdir
+        self.workers = int(workers)
+        self.batchsize = int(batchsize)
+        self.wait = float(wait)
+
+    def render(self, sourcefile, page, outfile, prepare=None):
+        """Renders a page of sourcefile, along with the following pages
+        of the batch, unless they're already rendered.
+
+        :param sourcefile: The PDF file
+        :type  sourcefile: str
+        :param page: The 0-based page number
+        :type  page: int
+        :param outfile: Returns the image path for a 0-based page
+                        number. The extension of the path decides the
+                        image format.
+        :type  outfile: callable
+        :param prepare: Called before rendering, after all locks have
+                        been acquired (eg. to download a missing
+                        sourcefile)
+        :type  prepare: callable
+        :raises PageRendererBusy: if no render could be started within
+                                  ``wait`` seconds
+        """
+        if os.path.exists(outfile(page)):
+            return
+        deadline = time.time() + self.wait
+        doclock = self._doclockfile(sourcefile)
+        while not self._acquire(doclock):
+            # another process renders this file, probably including
+            # this page
+            if os.path.exists(outfile(page)):
+                return
+            self._sleep(deadline, sourcefile)
+        try:
+            if os.path.exists(outfile(page)):
+                return
+            slot = None
+            while slot is None:
+                for i in range(self.workers):
+                    if self._acquire(self._lockfile("slot-%s" % i)):
+                        slot = self._lockfile("slot-%s" % i)
+                        break
+                else:
+                    self._sleep(deadline, sourcefile)
+            try:
+                if prepare:
+                    prepare()
+                self.render_batch(sourcefile,
+                                  list(range(page, page + self.batchsize)),
+                                  outfile)
+            finally:
+                util.robust_remove(slot)
+        finally:
+            util.robust_remove(doclock)
+
+    def render_batch(self, sourcefile, pages, outfile):
+        """Renders a range of pages of sourcefile with a single call to
+        ``pdftoppm``, without any locking. Pages after the last page of
+        sourcefile are ignored, as are pages that already have images.
+
+        :param sourcefile: The PDF file
+        :type  sourcefile: str
+        :param pages: consecutive 0-based page numbers
+        :type  pages: list
+        :param outfile: Returns the image path for a 0-based page number
+        :type  outfile: callable
+        :returns: The number of rendered pages
+        :rtype: int
+        """
+        pages = [p for p in pages if not os.path.exists(outfile(p))]
+        if not pages:
+            return 0
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # pdftoppm is 1-based, and stops at the last page
+            util.runcmd('pdftoppm -f %s -l %s -png "%s" "%s"' %
+                        (pages[0] + 1, pages[-1] + 1, sourcefile,
+                         tmpdir + os.sep + "page"),
+                        require_success=True)
+            rendered = 0
+            # files are named page-1.png, page-01.png or page-001.png
+            # depending on the number of pages in the document
+            for f in os.listdir(tmpdir):
+                m = re.match(r"page-(\d+)\.png$", f)
+                if not m:
+                    continue
+                page = int(m.group(1)) - 1
+                if page not in pages:
+                    continue
+                target = outfile(page)
+                util.ensure_dir(target)
+                # write to a temporary name first, so that other
+                # processes never see a half-written image
+                root, ext = os.path.splitext(target)
+                tmptarget = root + ".tmp" + ext
+                util.runcmd('convert "%s" -trim "%s"' % (tmpdir + os.sep + f, tmptarget),
+                            require_success=True)
+                os.replace(tmptarget, target)
+                rendered += 1
+            return rendered
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def page_count(self, sourcefile):
+        """Returns the number of pages in sourcefile, using ``pdfinfo``."""
+        (returncode, stdout, stderr) = util.runcmd('pdfinfo "%s"' % sourcefile,
+                                                   require_success=True)
+        return int(re.search(r"Pages:\s+(\d+)", stdout).group(1))
+
+    def _doclockfile(self, sourcefile):
+        return self._lockfile("doc-%08x" % zlib.crc32(sourcefile.encode("utf-8")))
+
+    def _lockfile(self, name):
+        return os.path.join(self.lockdir, name + ".lock")
+
+    def _acquire(self, lockfile):
+        util.ensure_dir(lockfile)
+        try:
+            if time.time() - os.path.getmtime(lockfile) > self.staletimeout:
+                util.robust_remove(lockfile)
+        except OSError:  # the lockfile doesn't exist
+            pass
+        try:
+            fd = os.open(lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            return False
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return True
+
+    def _sleep(self, deadline, sourcefile):
+        if time.time() + self.pollinterval > deadline:
+            raise PageRendererBusy("Can't render pages of %s right now" % sourcefile)
+        time.sleep(self.pollinterval)
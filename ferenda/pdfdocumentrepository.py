@@ -84,7 +84,8 @@ class PDFDocumentRepository(DocumentRepository):
                             doc.basefile, attachment=os.path.basename(page.background))
                         dest = self.store.parsed_path(
                             doc.basefile, attachment=os.path.basename(page.background))
-                        if util.copy_if_different(src, dest):
+                        if util.copy_if_different(src, dest,
+                                                  hashmanifest=self.store.hashmanifest):
                             self.log.debug("Copied %s to %s" % (src, dest))
                         resources.append(dest)
                         fp.write("#page%03d { background: url('%s');}\n" %
@@ -4,15 +4,21 @@
 # request.
 
 from wsgiref.util import request_uri
+import operator
 import re
 import os
 import sys
+import tempfile
+import time
+import zlib
+from difflib import SequenceMatcher
 from io import BytesIO
 from functools import partial, wraps
 from urllib.parse import urlparse, unquote, parse_qsl
 import mimetypes
 import traceback
 from copy import deepcopy
+from datetime import datetime
 
 from lxml import etree
 from lxml.etree import XMLSyntaxError
@@ -22,13 +28,13 @@ from werkzeug.routing import Rule, BaseConverter, Map
 from werkzeug.datastructures import Headers
 from werkzeug.wrappers import Request, Response
 from werkzeug.wsgi import wrap_file
-from werkzeug.exceptions import NotAcceptable, Forbidden
+from werkzeug.exceptions import NotAcceptable, Forbidden, ServiceUnavailable
+from werkzeug.http import http_date, is_resource_modified, quote_etag
 from werkzeug.test import EnvironBuilder
-from jinja2 import Template
 
 from ferenda import util
-from ferenda import Transformer
-from ferenda.errors import RequestHandlerError
+from ferenda import PageRenderer, Transformer
+from ferenda.errors import PageRendererBusy, RequestHandlerError
 from ferenda.thirdparty.htmldiff import htmldiff
 
 class UnderscoreConverter(BaseConverter):
@@ -352,30 +358,28 @@ class RequestHandler(object):
                     else:
                         sourcefile = method(basefile)
 
-                    # we might run this on a host to where we haven't
-                    # transferred the downloaded files -- try to
-                    # re-aquire them now that someone wants to watch
-                    # them.
-                    if not os.path.exists(sourcefile):
-                        repo.download(basefile)
-
                     assert params["page"].isdigit(), "%s is not a digit" % params["page"]
                     assert params["format"] in ("png", "jpg"), ("%s is not a valid image format" %
                                                                 params["format"])
-                    baseattach = "page_%s.%s" % (params["page"], params["format"])
-                    if "attachment" in params:
-                        baseattach = "%s_%s" % (params["attachment"], baseattach)
-                    outfile = repo.store.intermediate_path(basefile, attachment=baseattach)
-                    if not os.path.exists(outfile):
-                        # params['page'] is 0-based, pdftoppm is 1-based
-                        cmdline = "pdftoppm -f %s -singlefile -png %s %s" % (int(params["page"])+1, sourcefile, outfile.replace(".png",".tmp"))
-                        util.runcmd(cmdline, require_success=True)
-                        cmdline = "convert %s -trim %s" % (outfile.replace(".png", ".tmp.png"), outfile)
-                        util.runcmd(cmdline, require_success=True)
-                        os.unlink(outfile.replace(".png", ".tmp.png"))
+                    outfile = partial(self.page_image_path, repo, basefile,
+                                      format=params["format"],
+                                      attachment=params.get("attachment"))
+                    baseattach = os.path.basename(outfile(int(params["page"])))
+                    if not os.path.exists(outfile(int(params["page"]))):
+                        def prepare():
+                            # we might run this on a host to where we
+                            # haven't transferred the downloaded files
+                            # -- try to re-aquire them now that
+                            # someone wants to watch them.
+                            if not os.path.exists(sourcefile):
+                                repo.download(basefile)
+                        self.pagerenderer.render(sourcefile, int(params["page"]),
+                                                 outfile, prepare)
                         logfile = self.repo.config._parent.datadir + os.sep + "ua.log"
                         with open(logfile, "a") as fp:
-                            fp.write("%s\t%s\t%s\n" % (outfile, environ.get("User-Agent"), environ.get("Referer")))
+                            fp.write("%s\t%s\t%s\n" % (outfile(int(params["page"])), environ.get("User-Agent"), environ.get("Referer")))
+                except PageRendererBusy as e:
+                    raise ServiceUnavailable(str(e), retry_after=30)
                 except Exception as e:
                     if not baseattach:
                         baseattach = "page_error.png"
@@ -406,6 +410,50 @@ class RequestHandler(object):
 
         return method
 
+    @cached_property
+    def pagerenderer(self):
+        # the lock files are shared by all repos
+        config = self.repo.config
+        return PageRenderer(os.path.join(config.datadir, "pagerenderer"),
+                            workers=getattr(config, 'pagerenderers', 2),
+                            batchsize=getattr(config, 'pagerenderbatch', 10),
+                            wait=getattr(config, 'pagerenderwait', 5))
+
+    def page_image_path(self, repo, basefile, page, format="png", attachment=None):
+        """Returns the path to the image of a (0-based) page of a PDF
+        file for a document, or for one of its attachments."""
+        baseattach = "page_%s.%s" % (page, format)
+        if attachment:
+            baseattach = "%s_%s" % (attachment, baseattach)
+        return repo.store.intermediate_path(basefile, attachment=baseattach)
+
+    def prerender_pages(self, basefile):
+        """Renders images of all pages of the downloaded PDF files (the
+        main file and any attachments) for a document, so that they
+        don't have to be rendered when requested.
+
+        :returns: The number of rendered pages
+        :rtype: int
+        """
+        store = self.repo.store
+        if store.storage_policy != "dir":
+            # page images are stored as attachments
+            return 0
+        sources = [(store.downloaded_path(basefile), None)]
+        sources.extend((store.downloaded_path(basefile, attachment=a), a)
+                       for a in store.list_attachments(basefile, "downloaded"))
+        rendered = 0
+        for sourcefile, attachment in sources:
+            if not (sourcefile.lower().endswith(".pdf") and os.path.exists(sourcefile)):
+                continue
+            outfile = partial(self.page_image_path, self.repo, basefile,
+                              attachment=attachment)
+            batchsize = self.pagerenderer.batchsize
+            for page in range(0, self.pagerenderer.page_count(sourcefile), batchsize):
+                rendered += self.pagerenderer.render_batch(
+                    sourcefile, list(range(page, page + batchsize)), outfile)
+        return rendered
+
     def get_dataset_pathfunc(self, environ, params, contenttype, suffix):
         suffix = {"text/html": "html",
                   "application/atom+xml": "atom"}.get(contenttype, None)
@@ -429,21 +477,14 @@ class RequestHandler(object):
         pathfunc = self.get_pathfunc(environ, basefile, params, contenttype, suffix)
         if not pathfunc:
             # no static file exists, we need to call code to produce data
-            if contenttype in self._rdfformats or suffix in self._rdfsuffixes:
-                g = Graph()
-                g.parse(self.repo.store.distilled_path(basefile))
-                if 'extended' in params:
-                    if os.path.exists(self.repo.store.annotation_path(basefile)):
-                        annotation_graph = self.repo.annotation_file_to_graph(
-                            self.repo.store.annotation_path(basefile))
-                        g += annotation_graph
-                path = None
             if contenttype in self._rdfformats:
-                data = g.serialize(format=self._rdfformats[contenttype])
+                return self.lookup_graph(basefile, self._rdfformats[contenttype],
+                                         'extended' in params)
             elif suffix in self._rdfsuffixes:
-                data = g.serialize(format=rdfsuffixes[suffix])
+                return self.lookup_graph(basefile, self._rdfsuffixes[suffix],
+                                         'extended' in params)
             elif 'diff' in params and params.get('from') != "None":
-                data = self.diff_versions(basefile, params.get('from'), params.get('to'))
+                return self.lookup_diff(basefile, params.get('from'), params.get('to'))
             else:
                 data = None
         path = None
@@ -452,6 +493,151 @@ class RequestHandler(object):
             data = None
         return path, data
 
+    def lookup_graph(self, basefile, format, extended=False):
+        """Serializes the distilled RDF metadata for a document (optionally
+        extended with the annotation graph) in the given format. If the
+        ``rdfcache`` config option is set, the serialization is cached
+        on disk, and the path to the cached file is returned
+        instead of the data itself.
+
+        :returns: a ``(path, data)`` tuple, where one of the members is None
+        :rtype: tuple
+        """
+        sources = [self.repo.store.distilled_path(basefile)]
+        annotation_path = self.repo.store.annotation_path(basefile)
+        if extended and os.path.exists(annotation_path):
+            sources.append(annotation_path)
+        cachepath = None
+        if self.repo.config.rdfcache:
+            cachepath = self.rdfcache_path(basefile, format, extended)
+            if util.outfile_is_newer(sources, cachepath):
+                # update atime so that pruning removes the least
+                # recently used files. The mtime is left as is, since
+                # it's used for the ETag and Last-Modified headers.
+                st = os.stat(cachepath)
+                os.utime(cachepath, ns=(int(time.time() * 1000000000),
+                                        st.st_mtime_ns))
+                return cachepath, None
+        g = self.repo.distilled_graph(basefile)
+        if len(sources) > 1:
+            g += self.repo.annotation_file_to_graph(annotation_path)
+        data = g.serialize(format=format)
+        if cachepath:
+            try:
+                self.write_rdfcache(cachepath, data)
+                return cachepath, None
+            except (IOError, OSError) as e:
+                self.repo.log.warning("%s: Couldn't cache %s: %s" % (basefile, cachepath, e))
+        return None, data
+
+    def rdfcache_path(self, basefile, format, extended=False):
+        suffix = {'pretty-xml': '.rdf',
+                  'turtle': '.ttl',
+                  'nt': '.nt',
+                  'json-ld': '.json'}.get(format, '.' + format)
+        if extended:
+            suffix = ".extended" + suffix
+        return self.repo.store.path(basefile, "rdfcache", suffix)
+
+    def write_rdfcache(self, cachepath, data):
+        count = self.rdfcache_count()
+        self._write_cachefile(cachepath, data)
+        self._rdfcache_count = count + 1
+        if self._rdfcache_count > self.repo.config.rdfcache:
+            self.prune_rdfcache()
+
+    _rdfcache_count = None
+
+    def rdfcache_count(self):
+        if self._rdfcache_count is None:
+            self._rdfcache_count = len(self._rdfcache_files())
+        return self._rdfcache_count
+
+    def prune_rdfcache(self):
+        """Removes the least recently used files from the RDF cache, until
+        it's 10 % below the size given by the ``rdfcache`` config
+        option."""
+        files = sorted(self._rdfcache_files(), key=operator.itemgetter(1))
+        keep = int(self.repo.config.rdfcache * 0.9)
+        for path, atime in files[:max(len(files) - keep, 0)]:
+            util.robust_remove(path)
+        self._rdfcache_count = min(len(files), keep)
+
+    def _rdfcache_files(self):
+        files = []
+        for dirpath, dirnames, filenames in os.walk(
+                os.path.join(self.repo.store.datadir, "rdfcache")):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    files.append((path, os.path.getatime(path)))
+                except OSError:  # removed by a concurrent request
+                    pass
+        return files
+
+    def _write_cachefile(self, cachepath, data):
+        util.ensure_dir(cachepath)
+        # write to a temporary file first so that concurrent requests
+        # never see a partially written file
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(cachepath),
+                                       suffix=".tmp")
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        os.replace(tmppath, cachepath)
+
+    def lookup_diff(self, basefile, from_version, to_version):
+        """Returns the diff between two versions of a document (see
+        :py:meth:`diff_versions`). If the ``diffcache`` config option
+        is set, the diff is cached on disk until any of the versions
+        is re-generated, and the path to the cached file is returned
+        instead of the data itself.
+
+        :returns: a ``(path, data)`` tuple, where one of the members is None
+        :rtype: tuple
+        """
+        if not self.repo.config.diffcache:
+            return None, self.diff_versions(basefile, from_version, to_version)
+        cachepath = self.diffcache_path(basefile, from_version, to_version)
+        if not self.diffcache_fresh(basefile, from_version, to_version):
+            data = self.diff_versions(basefile, from_version, to_version)
+            try:
+                self._write_cachefile(cachepath, data)
+            except (IOError, OSError) as e:
+                self.repo.log.warning("%s: Couldn't cache %s: %s" % (basefile, cachepath, e))
+                return None, data
+        return cachepath, None
+
+    def diffcache_path(self, basefile, from_version, to_version):
+        key = "%s %s" % (from_version, to_version)
+        return self.repo.store.path(basefile, "diffcache",
+                                    ".%08x.html" % zlib.crc32(key.encode("utf-8")))
+
+    def diffcache_fresh(self, basefile, from_version, to_version):
+        store = self.repo.store
+        return util.outfile_is_newer(
+            [store.generated_path(basefile, version=from_version),
+             store.generated_path(basefile, version=to_version)],
+            self.diffcache_path(basefile, from_version, to_version))
+
+    def precompute_diffs(self, basefile):
+        """Caches the diffs between all adjacent versions of a document
+        (the last archived version is compared to the current version)
+        that aren't already cached.
+
+        :returns: The number of computed diffs
+        :rtype: int
+        """
+        versions = sorted(self.repo.store.list_versions(basefile, "generated"),
+                          key=util.split_numalpha)
+        computed = 0
+        for from_version, to_version in zip(versions, versions[1:] + [None]):
+            if not self.diffcache_fresh(basefile, from_version, to_version):
+                self._write_cachefile(
+                    self.diffcache_path(basefile, from_version, to_version),
+                    self.diff_versions(basefile, from_version, to_version))
+                computed += 1
+        return computed
+
     def diff_versions(self, basefile, from_version, to_version):
         def cleantree(tree, savednodes=None):
             for xpath, save in (("//div[@class='docversions']", False),
@@ -480,7 +666,11 @@ class RequestHandler(object):
         to_area = to_tree.find("//article")
 
         # 4 diff the content areas
-        diffstr = '<article class="col-sm-9">' + htmldiff(from_area, to_area, include_hrefs=False) + '</article>'
+        if self.repo.config.sectiondiff:
+            diffstr = self.diff_sections(from_area, to_area)
+        else:
+            diffstr = htmldiff(from_area, to_area, include_hrefs=False)
+        diffstr = '<article class="col-sm-9">' + diffstr + '</article>'
         diff_tree = etree.HTML(diffstr)[0][0]
         # 5 re-insert the stored-away parts
         for parent in to_area.xpath("//div[@class='row']"):
@@ -494,6 +684,38 @@ class RequestHandler(object):
         area.getparent().replace(area, diff_tree)
         return etree.tostring(template_tree)
 
+    def diff_sections(self, from_area, to_area):
+        """Diffs two content areas section by section, so that only
+        those top-level sections that have changed are run through
+        htmldiff. Sections are matched by their ``@about`` ids (other
+        top-level nodes by their content), and added or removed
+        sections are diffed as a whole."""
+        def serialize(nodes):
+            return "".join(etree.tostring(node, method="html", with_tail=False,
+                                          encoding="unicode") for node in nodes)
+
+        def key(node):
+            return node.get("about") or serialize([node])
+        from_nodes = list(from_area)
+        to_nodes = list(to_area)
+        matcher = SequenceMatcher(None, [key(n) for n in from_nodes],
+                                  [key(n) for n in to_nodes], autojunk=False)
+        res = []
+        for op, i1, i2, j1, j2 in matcher.get_opcodes():
+            if op == "equal":
+                for from_node, to_node in zip(from_nodes[i1:i2], to_nodes[j1:j2]):
+                    from_str = serialize([from_node])
+                    to_str = serialize([to_node])
+                    if from_str == to_str:
+                        res.append(to_str)
+                    else:
+                        res.append(htmldiff(from_str, to_str, include_hrefs=False))
+            else:
+                res.append(htmldiff(serialize(from_nodes[i1:i2]),
+                                    serialize(to_nodes[j1:j2]),
+                                    include_hrefs=False))
+        return "".join(res)
+
     def lookup_dataset(self, environ, params, contenttype, suffix):
         # FIXME: This should also make use of pathfunc
         data = None
@@ -535,8 +757,25 @@ class RequestHandler(object):
                 status = 500
             elif path.endswith(".404"):
                 status = 404
+            if status == 200:
+                st = os.stat(path)
+                etag = self.file_etag(path, st)
+                mtime = datetime.utcfromtimestamp(int(st.st_mtime))
+                validators = {'ETag': quote_etag(etag),
+                              'Last-Modified': http_date(mtime),
+                              'Vary': 'Accept'}
+                if not is_resource_modified(request.environ, etag=etag,
+                                            last_modified=mtime):
+                    return Response(status=304, headers=validators)
+                sendfile = self.sendfile_header(path)
+                if sendfile:
+                    validators[sendfile[0]] = sendfile[1]
+                    return Response(status=status, headers=validators,
+                                    mimetype=contenttype)
             fp = wrap_file(request.environ, open(path, 'rb'))
             headers = Headers({"Content-length": os.path.getsize(path)})
+            if status == 200:
+                headers.extend(validators)
         elif data:
             fp = wrap_file(request.environ, BytesIO(data))
             status = 200
@@ -550,6 +789,27 @@ class RequestHandler(object):
         return Response(fp, status, headers, mimetype=contenttype, direct_passthrough=True)
 
 
+    def file_etag(self, path, st):
+        """Returns a strong ETag (without quotes) for a file, based on its
+        path, size and modification time."""
+        return "%x-%x-%x" % (zlib.crc32(path.encode("utf-8")) & 0xffffffff,
+                             st.st_size, int(st.st_mtime * 1000000))
+
+    def sendfile_header(self, path):
+        """If the ``sendfile`` config option is set to ``X-Sendfile``
+        (Apache, lighttpd) or ``X-Accel-Redirect`` (nginx), returns a
+        ``(header, value)`` tuple that makes the web server send the
+        file instead of the app. Otherwise returns None."""
+        header = self.repo.config.sendfile
+        if not header:
+            return None
+        if header.lower() == "x-accel-redirect":
+            # nginx needs an internal location that maps to the
+            # datadir, not a filesystem path
+            relpath = os.path.relpath(path, self.repo.config.datadir)
+            return header, self.repo.config.sendfileprefix + relpath.replace(os.sep, "/")
+        return header, os.path.abspath(path)
+
     def render_template(self, jinja_template, page_title, **context):
         from ferenda import DocumentRepository
         repo = DocumentRepository(config=self.repo.config)
@@ -563,6 +823,8 @@ class RequestHandler(object):
   </body>
 </html>
 """ % (locals())
+        # jinja2 is only needed for this (rarely used) kind of page
+        from jinja2 import Template
         t = Template(jinja_template, autoescape=True)
         text = t.render(context).encode("utf-8")
         try:
@@ -458,8 +458,7 @@ class Resources(object):
                     ontopath = repo.resourceloader.filename(resourcename)
                     if ontopath not in paths:
                         self.log.debug("Loading vocabulary %s" % ontopath)
-                        with open(ontopath) as onto:
-                            bigg.parse(onto, format="turtle")
+                        repo.parse_resource_graph(resourcename, bigg)
                         paths.add(ontopath)
 
         g.bind("foaf", "http://xmlns.com/foaf/0.1/")
@@ -491,8 +490,7 @@ class Resources(object):
                         commonpath = repo.resourceloader.filename(resourcename)
                         if commonpath not in paths:
                             self.log.debug("loading data %s" % commonpath)
-                            with open(commonpath) as common:
-                                bigg.parse(common, format="turtle")
+                            repo.parse_resource_graph(resourcename, bigg)
                             paths.add(commonpath)
         for (s, p, o) in bigg:
             if p in (FOAF.name, SKOS.prefLabel,
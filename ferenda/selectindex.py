@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+
+from glob import glob
+import json
+import os
+import pickle
+import re
+import sqlite3
+
+from cached_property import cached_property
+
+from ferenda import util
+from ferenda.triplestore import TripleStore
+
+
+class SelectIndex(object):
+    """Stores precomputed results of SPARQL SELECT queries that are
+    otherwise run once for every document (typically when preparing
+    annotation files), so that the triple store only needs to be
+    queried once for each query.
+
+    A query template is indexable if the document URI (and any other
+    per-document parameter) is only used in one of two ways:
+
+    * As a complete IRI, ie ``<%(uri)s>``. The IRI is replaced with a
+      variable, which is added to the projection, and rows are looked
+      up by exact match.
+    * In a filter on the form ``STRSTARTS(STR(?var), "%(uri)s")``,
+      where ``?var`` is a projected variable. The filter is made to
+      match everything, and rows are looked up by prefix match on
+      ``?var``, just like the filter would have done.
+
+    All other parameters (like ``%(context)s``) must be the same for
+    all documents, and are provided when the query is indexed.
+
+    The index is stored in a SQLite database.
+
+    :param filename: The file used to store the index
+    :type  filename: str
+    """
+
+    keyvar = "_indexkey"
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            util.ensure_dir(self.filename)
+            self._conn = sqlite3.connect(self.filename)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS queries "
+                               "(id INTEGER PRIMARY KEY, name TEXT, "
+                               "params TEXT, mode TEXT, keyparams TEXT)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS rows "
+                               "(query INTEGER, seq INTEGER, key TEXT, "
+                               "data BLOB)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS rows_key "
+                               "ON rows (query, key)")
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def clear(self):
+        """Removes all indexed queries."""
+        self.close()
+        util.robust_remove(self.filename)
+
+    re_strstarts = re.compile(r'STRSTARTS\s*\(\s*STR\s*\(\s*\?(\w+)\s*\)\s*,'
+                              r'\s*"%\((\w+)\)s"\s*\)', re.IGNORECASE)
+    re_iri = re.compile(r'<%\((\w+)\)s>')
+    re_param = re.compile(r'%\((\w+)\)s')
+    re_projection = re.compile(r'\bSELECT\s+(DISTINCT\s+|REDUCED\s+)?(.*?)\s*\bWHERE\b',
+                               re.IGNORECASE | re.DOTALL)
+
+    def rewrite(self, template, params):
+        """Rewrites a per-document query template into a query for all
+        documents.
+
+        :param template: The query template
+        :type  template: str
+        :param params: Values for all parameters that are the same
+                       for all documents
+        :type  params: dict
+        :returns: A ``(query, mode, keyvar, keyparams)`` tuple, or
+                  ``None`` if the template can't be indexed
+        :rtype: tuple
+        """
+        m = self.re_projection.search(template)
+        if not m:
+            return None
+        distinct, projection = m.group(1), m.group(2).split()
+        filters = self.re_strstarts.findall(template)
+        # IRIs for constant parameters (like GRAPH <%(context)s>) are
+        # filled in as usual
+        iris = [param for param in self.re_iri.findall(template)
+                if param not in params]
+        if filters and not iris:
+            keyvars = set(var for var, param in filters)
+            keyparams = sorted(set(param for var, param in filters))
+            if len(keyvars) != 1:
+                return None
+            keyvar = keyvars.pop()
+            if "*" not in projection and "?" + keyvar not in projection:
+                return None
+            if len(filters) > 1 and not distinct:
+                # rows matching more than one filter would be
+                # returned more than once
+                return None
+            mode = "prefix"
+            query = self.re_strstarts.sub(
+                lambda m: 'STRSTARTS(STR(?%s), "")' % m.group(1), template)
+        elif iris and not filters:
+            keyparams = sorted(set(iris))
+            if len(keyparams) != 1:
+                return None
+            keyvar = self.keyvar
+            mode = "exact"
+            query = self.re_iri.sub(
+                lambda m: "?" + keyvar if m.group(1) in keyparams else m.group(0),
+                template)
+            if "*" not in projection:
+                m = self.re_projection.search(query)
+                query = (query[:m.start(2)] + "?" + keyvar + " " +
+                         query[m.start(2):])
+        else:
+            return None
+        # all other placeholders must be constant
+        for param in self.re_param.findall(query):
+            if param in keyparams or param not in params:
+                return None
+        return query % params, mode, keyvar, keyparams
+
+    def build(self, store, name, template, params=None, **kwargs):
+        """Runs the query once for all documents and stores the results
+        in the index.
+
+        :param store: The triple store to query
+        :type  store: ferenda.TripleStore
+        :param name: The name used for looking up the results (usually
+                     the resource name of the query template)
+        :type  name: str
+        :param template: The query template
+        :type  template: str
+        :param params: Values for all parameters that are the same for
+                       all documents
+        :type  params: dict
+        :returns: The number of indexed rows, or ``None`` if the query
+                  can't be indexed
+        :rtype: int
+        """
+        params = dict(params or {})
+        rewritten = self.rewrite(template, params)
+        if rewritten is None:
+            return None
+        query, mode, keyvar, keyparams = rewritten
+        rows = store.select(query, "python", **kwargs)
+        conn = self.conn
+        with conn:
+            self._delete(name, params)
+            cursor = conn.execute("INSERT INTO queries (name, params, mode, keyparams) "
+                                  "VALUES (?, ?, ?, ?)",
+                                  (name, self._paramkey(params), mode,
+                                   json.dumps(keyparams)))
+            queryid = cursor.lastrowid
+            records = []
+            for seq, row in enumerate(rows):
+                if mode == "exact":
+                    key = row.pop(keyvar, None)
+                else:
+                    key = row.get(keyvar)
+                if key is None:
+                    continue
+                records.append((queryid, seq, str(key),
+                                pickle.dumps(row, protocol=2)))
+            conn.executemany("INSERT INTO rows (query, seq, key, data) "
+                             "VALUES (?, ?, ?, ?)", records)
+        return len(records)
+
+    def select(self, name, params):
+        """Returns the precomputed results of a query for a single
+        document.
+
+        :param name: The name used when the query was indexed
+        :type  name: str
+        :param params: All parameters that would be used to fill the
+                       query template
+        :type  params: dict
+        :returns: The same list of dicts that
+                  :py:meth:`~ferenda.TripleStore.select` would have
+                  returned, or ``None`` if the query isn't indexed
+        :rtype: list
+        """
+        if not os.path.exists(self.filename):
+            return None
+        for queryid, mode, keyparams, constparams in self.conn.execute(
+                "SELECT id, mode, keyparams, params FROM queries WHERE name = ?",
+                (name,)):
+            keyparams = json.loads(keyparams)
+            constparams = json.loads(constparams)
+            if any(params.get(k) != v for k, v in constparams.items()):
+                continue
+            keys = [params[k] for k in keyparams if params.get(k) is not None]
+            if not keys:
+                return []
+            if mode == "exact":
+                clause = " OR ".join(["key = ?"] * len(keys))
+                args = keys
+            else:
+                # the highest possible code point sorts after all
+                # strings that start with key
+                clause = " OR ".join(["(key >= ? AND key < ?)"] * len(keys))
+                args = [arg for key in keys for arg in (key, key + "\U0010ffff")]
+            return [pickle.loads(data) for (data,) in self.conn.execute(
+                "SELECT data FROM rows WHERE query = ? AND (%s) ORDER BY seq" % clause,
+                [queryid] + args)]
+        return None
+
+    def _paramkey(self, params):
+        return json.dumps(params, sort_keys=True)
+
+    def _delete(self, name, params):
+        for (queryid,) in list(self.conn.execute(
+                "SELECT id FROM queries WHERE name = ? AND params = ?",
+                (name, self._paramkey(params)))):
+            self.conn.execute("DELETE FROM rows WHERE query = ?", (queryid,))
+            self.conn.execute("DELETE FROM queries WHERE id = ?", (queryid,))
+
+
+class AnnotationIndexMixin(object):
+    """Mixin for docrepos that run the same SELECT queries for every
+    document when preparing annotation files. With the
+    ``annotationindex`` option set, these queries are run once for
+    all documents in ``generate_all_setup``, and the results are
+    stored in a :py:class:`~ferenda.SelectIndex` that
+    :py:meth:`store_select` then uses instead of the triple store.
+
+    Docrepos using this mixin should list their queries in
+    :py:meth:`annotation_index_queries`, and run them through
+    :py:meth:`store_select`.
+    """
+
+    @classmethod
+    def get_default_options(cls):
+        opts = super(AnnotationIndexMixin, cls).get_default_options()
+        opts['annotationindex'] = False  # precompute annotation queries in generate_all_setup
+        return opts
+
+    @classmethod
+    def generate_all_setup(cls, config, *args, **kwargs):
+        ret = super(AnnotationIndexMixin, cls).generate_all_setup(config, *args, **kwargs)
+        repo = kwargs.get("currentrepo")
+        if repo and config.annotationindex and ret is not False:
+            repo.build_annotation_index()
+        return ret
+
+    def annotation_index_queries(self):
+        """Returns the ``(query_template, context)`` pairs for all
+        queries that should be precomputed by
+        :py:meth:`build_annotation_index`."""
+        return []
+
+    def store_select(self, store, query_template, uri, context=None, extraparams=None):
+        """Runs the query in the resource *query_template* for the
+        document *uri*, using the annotation index if possible.
+
+        :returns: The same list of dicts that
+                  :py:meth:`~ferenda.TripleStore.select` returns
+        :rtype: list
+        """
+        params = {'uri': uri,
+                  'context': context}
+        if extraparams:
+            params.update(extraparams)
+        if self.annotation_index:
+            result = self.annotation_index.select(query_template, params)
+            if result is not None:
+                return result
+        sq = self._query_template(query_template) % params
+        return store.select(sq, "python", **self._select_kwargs(context))
+
+    def build_annotation_index(self):
+        """Runs all queries from :py:meth:`annotation_index_queries`
+        once for all documents, and stores the results in a
+        :py:class:`~ferenda.SelectIndex`."""
+        index = SelectIndex(self.store.resourcepath("annotationindex.sqlite"))
+        index.clear()
+        store = TripleStore.connect(self.config.storetype,
+                                    self.config.storelocation,
+                                    self.config.storerepository)
+        for query_template, context in self.annotation_index_queries():
+            values = {'query': query_template,
+                      'rows': None}
+            with util.logtime(self.log.info,
+                              "%(query)s: indexed %(rows)s rows (%(elapsed).3f sec)",
+                              values):
+                values['rows'] = index.build(store, query_template,
+                                             self._query_template(query_template),
+                                             {'context': context},
+                                             **self._select_kwargs(context))
+        index.close()
+        self.__dict__.pop('annotation_index', None)
+
+    @cached_property
+    def annotation_index(self):
+        # Only use the index if it has been built after the last
+        # relate of any repo, since the queries might use triples
+        # from all of them.
+        path = self.store.resourcepath("annotationindex.sqlite")
+        if (self.config.annotationindex and
+                util.outfile_is_newer(self._annotation_index_dumps(), path)):
+            return SelectIndex(path)
+
+    def _annotation_index_dumps(self):
+        # every repo that shares our datadir writes a dump of its
+        # triples to <datadir>/<alias>/distilled/dump.nt when relating
+        return glob(os.path.join(self.config.datadir, "*", "distilled", "dump.nt"))
+
+    @cached_property
+    def _query_templates(self):
+        return {}
+
+    def _query_template(self, query_template):
+        if query_template not in self._query_templates:
+            with self.resourceloader.open(query_template, binary=True) as fp:
+                self._query_templates[query_template] = fp.read().decode('utf-8')
+        return self._query_templates[query_template]
+
+    def _select_kwargs(self, context):
+        # Only FusekiStore.select supports (or needs) uniongraph
+        if self.config.storetype == "FUSEKI":
+            if context:
+                return {'uniongraph': False}
+            else:
+                return {'uniongraph': True}
+        else:
+            return {}
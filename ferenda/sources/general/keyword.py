@@ -20,7 +20,8 @@ import yaml
 
 # my libs
 from ferenda import util
-from ferenda import DocumentRepository, TripleStore, DocumentStore, Describer
+from ferenda import (DocumentRepository, TripleStore, DocumentStore, Describer,
+                     AnnotationIndexMixin)
 from ferenda.decorators import managedparsing
 from ferenda.elements import Body
 
@@ -40,7 +41,7 @@ class KeywordStore(DocumentStore):
         return basefile
 
 
-class Keyword(DocumentRepository):
+class Keyword(AnnotationIndexMixin, DocumentRepository):
 
     """Implements support for 'keyword hubs', or concepts to which documents in other sources are related. 
 
@@ -248,22 +249,15 @@ class Keyword(DocumentRepository):
 
 
     re_tagstrip = re.compile(r'<[^>]*>')
-    # FIXME: This is copied verbatim from sfs.py -- maybe it could go
-    # into DocumentRepository or util? (or possibly triplestore?)
-    def store_select(self, store, query_template, uri, context=None):
-        params = {'uri': uri,
-                  'context': context}
-        with self.resourceloader.open(query_template, "rb") as fp:
-            sq = fp.read().decode('utf-8') % params
-        # Only FusekiStore.select supports (or needs) uniongraph
-        if self.config.storetype == "FUSEKI":
-            if context:
-                kwargs = {'uniongraph': False}
-            else:
-                kwargs = {'uniongraph': True}
-        else:
-            kwargs = {}
-        return store.select(sq, "python", **kwargs)
+
+    def annotation_index_queries(self):
+        """Returns the ``(query_template, context)`` pairs for all
+        queries run by
+        :py:meth:`~ferenda.sources.general.Keyword.prep_annotation_file`
+        (and
+        :py:meth:`~ferenda.sources.general.Keyword.prep_annotation_file_termsets`).
+        Subclasses that run additional queries should extend this list."""
+        return [("sparql/keyword_subjects.rq", None)]
 
     def time_store_select(
             self, store, query_template, basefile, context=None, label="things"):
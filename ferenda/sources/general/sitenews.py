@@ -64,7 +64,7 @@ class Sitenews(DocumentRepository):
                 if m:
                     if ofp:
                         ofp.close()
-                        if util.replace_if_different(temppath, path):
+                        if util.replace_if_different(temppath, path, hashmanifest=self.store.hashmanifest):
                             self.log.info("%s: creating news item" % basefile)
                     d = datetime.strptime(m.group(1), "%Y-%m-%d %H:%M:%S")
                     basefile = str(int(d.timestamp()))
@@ -75,7 +75,7 @@ class Sitenews(DocumentRepository):
                     ofp = os.fdopen(fileno, "w")
                 ofp.write(line)
             ofp.close()
-            if util.replace_if_different(temppath, path):
+            if util.replace_if_different(temppath, path, hashmanifest=self.store.hashmanifest):
                 self.log.info("%s: download OK (creating news item)" % basefile)
                 
 
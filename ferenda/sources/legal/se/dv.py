@@ -209,8 +209,7 @@ class DV(SwedishLegalSource):
         if not os.path.exists(p):
             raise ValueError("No distilled file for basefile %s at %s" % (basefile, p))
 
-        with self.store.open_distilled(basefile) as fp:
-            g = Graph().parse(data=fp.read())
+        g = self.distilled_graph(basefile)
         for uri, rdftype in g.subject_objects(predicate=RDF.type):
             if rdftype in (RPUBL.Rattsfallsreferat,
                            RPUBL.Rattsfallsnotis):
@@ -1331,19 +1330,19 @@ class DV(SwedishLegalSource):
 
     @cached_property
     def rattsfall_parser(self):
-        return SwedishCitationParser(LegalRef(LegalRef.RATTSFALL, LegalRef.EURATTSFALL),
+        return SwedishCitationParser(LegalRef(LegalRef.RATTSFALL, LegalRef.EURATTSFALL, cachesize=self.config.refcachesize),
                                      self.minter,
                                      self.commondata)
 
     @cached_property
     def lagrum_parser(self):
-        return SwedishCitationParser(LegalRef(LegalRef.LAGRUM, LegalRef.EULAGSTIFTNING),
+        return SwedishCitationParser(LegalRef(LegalRef.LAGRUM, LegalRef.EULAGSTIFTNING, cachesize=self.config.refcachesize),
                                        self.minter,
                                        self.commondata)
 
     @cached_property
     def litteratur_parser(self):
-        return SwedishCitationParser(LegalRef(LegalRef.FORARBETEN),
+        return SwedishCitationParser(LegalRef(LegalRef.FORARBETEN, cachesize=self.config.refcachesize),
                                        self.minter,
                                        self.commondata)
 
@@ -1586,8 +1585,7 @@ class DV(SwedishLegalSource):
         if not os.path.exists(p):
             raise ValueError("No distilled file for basefile %s at %s" % (basefile, p))
 
-        with self.store.open_distilled(basefile) as fp:
-            g = Graph().parse(data=fp.read())
+        g = self.distilled_graph(basefile)
         uri = self.canonical_uri(basefile)
         return str(g.value(URIRef(uri), DCTERMS.identifier))
         
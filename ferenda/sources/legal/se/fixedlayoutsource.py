@@ -284,7 +284,8 @@ class FixedLayoutSource(SwedishLegalSource):
                     dest = self.store.parsed_path(
                         doc.basefile, attachment=os.path.basename(page.background))
                     resources.append(dest)
-                    if util.copy_if_different(src, dest):
+                    if util.copy_if_different(src, dest,
+                                              hashmanifest=self.store.hashmanifest):
                         self.log.debug("Copied %s to %s" % (src, dest))
                     desturi = "%s?dir=parsed&attachment=%s" % (doc.uri, os.path.basename(dest))
                     desturi = urltransform(desturi)
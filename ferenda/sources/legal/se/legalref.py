@@ -7,6 +7,7 @@ import logging
 import os
 import sys
 import re
+from collections import OrderedDict, namedtuple
 from datetime import date
 try:
     from functools import lru_cache
@@ -59,6 +60,8 @@ from . import RPUBL, RINFOEX
 # i SFS. Sådana funktioner/avsnitt är markerat med "SFS-specifik
 # [...]" eller "KOD FÖR LAGRUM"
 
+ParseCacheInfo = namedtuple("ParseCacheInfo", "hits misses maxsize currsize")
+
 class LegalRef:
     # Kanske detta borde vara 1,2,4,8 osv, så att anroparen kan be om
     # LAGRUM | FORESKRIFTER, och så vi kan definera samlingar av
@@ -111,6 +114,11 @@ class LegalRef:
         self.load_ebnf(fname("res/ebnf/base.ebnf"))
         self.args = args
         self.failfast = False
+        # Optional memoization of parse() results, since legal texts
+        # tend to repeat the same citations over and over. Disabled
+        # by default (cachesize=0).
+        self.cachesize = kwargs.get('cachesize', 0)
+        self.clear_cache()
         
         if self.LAGRUM in args:
             productions = self.load_ebnf(fname("res/ebnf/lagrum.ebnf"))
@@ -297,6 +305,24 @@ class LegalRef:
         else:
             self.nobaseuri = False
 
+        if self.cachesize:
+            if (minter is not self._cacheminter or
+                    self.metadata_graph is not self._cachegraph):
+                # results are only valid for the minter and metadata
+                # that produced them
+                self.clear_cache()
+                self._cacheminter = minter
+                self._cachegraph = self.metadata_graph
+            cachekey = self._cachekey(indata)
+            if cachekey in self._parsecache:
+                self.cachehits += 1
+                nodes, state = self._parsecache.pop(cachekey)
+                # re-insert to mark as most recently used
+                self._parsecache[cachekey] = (nodes, state)
+                self._restore_cachestate(state)
+                return self._clone_nodes(nodes)
+            self.cachemisses += 1
+
         # Det är svårt att få EBNF-grammatiken att känna igen
         # godtyckliga ord som slutar på ett givet suffix (exv
         # 'bokföringslagen' med suffixet 'lagen'). Därför förbehandlar
@@ -391,8 +417,70 @@ class LegalRef:
             else:
                 normres[i] = self.re_xmlcharref.sub(
                     self.unescape_xmlcharref, normres[i])
+        if self.cachesize:
+            self._parsecache[cachekey] = (self._clone_nodes(normres),
+                                          self._cachestate())
+            if len(self._parsecache) > self.cachesize:
+                self._parsecache.popitem(last=False)
         return normres
 
+    def clear_cache(self):
+        """Remove all memoized results of parse() and reset the hit/miss
+        counters."""
+        self._parsecache = OrderedDict()
+        self._cacheminter = None
+        self._cachegraph = None
+        self.cachehits = 0
+        self.cachemisses = 0
+
+    def cache_info(self):
+        """Returns statistics for the parse() result cache, in the same
+        form as functools.lru_cache."""
+        return ParseCacheInfo(self.cachehits, self.cachemisses,
+                              self.cachesize, len(self._parsecache))
+
+    def _cachekey(self, indata):
+        # parse() results depend not only on the arguments but also
+        # on context remembered from earlier calls (last named law
+        # etc), so that must be part of the key as well.
+        return (indata,
+                tuple(sorted(self.baseuri_attributes.items())),
+                self.allow_relative,
+                self.predicate,
+                self._cachestate())
+
+    def _cachestate(self):
+        return (self.lastlaw,
+                tuple(sorted(self.currentlynamedlaws.items())),
+                tuple(sorted(self.current_forarbete_attributes.items())),
+                tuple(sorted(self.last_forarbete_attributes.items())),
+                getattr(self, 'kommittensbetankande', None))
+
+    def _restore_cachestate(self, state):
+        (self.lastlaw, namedlaws, current_forarbete,
+         last_forarbete, kommittensbetankande) = state
+        # callers might hold a reference to currentlynamedlaws, so
+        # update it in place
+        self.currentlynamedlaws.clear()
+        self.currentlynamedlaws.update(namedlaws)
+        self.current_forarbete_attributes = dict(current_forarbete)
+        self.last_forarbete_attributes = dict(last_forarbete)
+        self.currentlaw = None
+
+    def _clone_nodes(self, nodes):
+        # Link objects might get attributes set on them by the caller
+        # (or be placed in a document tree), so never hand out the
+        # same object twice
+        res = []
+        for node in nodes:
+            if isinstance(node, LinkSubject):
+                node = LinkSubject(str(node), uri=node.uri,
+                                   predicate=node.predicate)
+            elif isinstance(node, Link):
+                node = Link(str(node), uri=node.uri)
+            res.append(node)
+        return res
+
     def reset(self):
         """Reset any context related to discovered/remembered data about
         things found in previous calls to parse() (last named law etc)"""
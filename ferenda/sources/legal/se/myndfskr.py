@@ -35,7 +35,7 @@ from .fixedlayoutsource import FixedLayoutStore
 from .swedishlegalsource import SwedishCitationParser, SwedishLegalStore
 from .elements import *
 from ferenda import TextReader, Describer, Facet, PDFReader, DocumentEntry, DocumentRepository, PDFReader, PDFAnalyzer, FSMParser
-from ferenda import util, decorators, errors, fulltextindex
+from ferenda import util, decorators, errors, fulltextindex, packfile
 from ferenda.decorators import newstate
 from ferenda.elements import (Link, Body, CompoundElement,
                               Preformatted, UnorderedList, ListItem, serialize)
@@ -177,7 +177,7 @@ class MyndFskrBase(FixedLayoutSource):
 
     def remote_url(self, basefile):
         # if we already know the remote url, don't go to the landing page
-        if os.path.exists(self.store.documententry_path(basefile)):
+        if packfile.exists(self.store.documententry_path(basefile)):
             entry = DocumentEntry(self.store.documententry_path(basefile))
             return entry.orig_url
         else:
@@ -847,8 +847,7 @@ class MyndFskrBase(FixedLayoutSource):
         if not os.path.exists(p):
             raise ValueError("No distilled file for basefile %s at %s" % (basefile, p))
 
-        with self.store.open_distilled(basefile) as fp:
-            g = Graph().parse(data=fp.read())
+        g = self.distilled_graph(basefile)
         uri = self.canonical_uri(basefile)
         return str(g.value(URIRef(uri), DCTERMS.identifier))
 
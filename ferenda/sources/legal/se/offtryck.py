@@ -486,6 +486,12 @@ class Offtryck(SwedishLegalSource):
                                            "found %s refs. %s coin calls (%.3f %%) were avoided)" %
                                            (seen, proc, processed_percent, refs,
                                             hits, avoided * 100))
+                            if self.config.refcachesize:
+                                info = self.refparser._legalrefparser.cache_info()
+                                self.log.debug("refparser: parse cache had %s hits, "
+                                               "%s misses (%s of max %s entries)" %
+                                               (info.hits, info.misses,
+                                                info.currsize, info.maxsize))
                             self.refparser.reset()
                     elif tag in ('frontmatter', 'endregister'):
                         # Frontmatter and endregister is defined as pages with
@@ -988,7 +994,8 @@ class Offtryck(SwedishLegalSource):
 
             # If running under RepoTester, the source PNG files may not exist.
             if os.path.exists(src):
-                if util.copy_if_different(src, dest):
+                if util.copy_if_different(src, dest,
+                                          hashmanifest=self.store.hashmanifest):
                     self.log.debug("Copied %s to %s" % (src, dest))
 
             fp.write("#page%03d { background: url('%s');}\n" %
@@ -29,9 +29,9 @@ from . import Trips, SwedishCitationParser, RPUBL, SwedishLegalStore, RINFOEX
 from .elements import *
 from .legalref import LegalRef, LinkSubject
 from .swedishlegalsource import SwedishLegalHandler
-from ferenda import DocumentEntry, TripleStore
-from ferenda import TextReader, Facet
-from ferenda import util
+from ferenda import DocumentEntry, TripleStore, AnnotationIndexMixin
+from ferenda import TextReader, MmapTextReader, Facet
+from ferenda import util, packfile
 from ferenda.elements.html import UL, LI, Body
 from ferenda.errors import FerendaException, DocumentRemovedError, ParseError
 from ferenda.requesthandler import UnderscoreConverter
@@ -110,7 +110,7 @@ class SFSDocumentStore(SwedishLegalStore):
         return self.path(basefile, "metadata", ".html")
 
 
-class SFS(Trips):
+class SFS(AnnotationIndexMixin, Trips):
 
     """Handles consolidated (codified) versions of statutes from SFS
     (Svensk författningssamling).
@@ -181,14 +181,16 @@ class SFS(Trips):
     @cached_property
     def lagrum_parser(self):
         return SwedishCitationParser(LegalRef(LegalRef.LAGRUM,
-                                              LegalRef.EULAGSTIFTNING),
+                                              LegalRef.EULAGSTIFTNING,
+                                              cachesize=self.config.refcachesize),
                                      self.minter,
                                      self.commondata,
                                      allow_relative=True)
 
     @cached_property
     def forarbete_parser(self):
-        return SwedishCitationParser(LegalRef(LegalRef.FORARBETEN),
+        return SwedishCitationParser(LegalRef(LegalRef.FORARBETEN,
+                                              cachesize=self.config.refcachesize),
                                      self.minter,
                                      self.commondata)
 
@@ -439,8 +441,11 @@ class SFS(Trips):
         return self._find_uppdaterad_tom(basefile, sfst_file)
 
     def _find_uppdaterad_tom(self, sfsnr, filename=None, reader=None, fail_silently=True):
-        if not reader:
-            reader = TextReader(filename, encoding=self.source_encoding)
+        ownreader = not reader
+        if ownreader:
+            # the metadata is near the top of the file, so there's no
+            # need to read and decode all of it
+            reader = MmapTextReader(filename, encoding=self.source_encoding)
         try:
             # FIXME: older files use <b> around the metadata value
             # instead of <span> around the metadata key
@@ -462,6 +467,9 @@ class SFS(Trips):
                 return sfsnr  # the base SFS nr
             else:
                 raise e
+        finally:
+            if ownreader:
+                reader.close()
 
     def _find_upphavts_genom(self, filename):
         return None # this info is not available in the SFST document
@@ -977,7 +985,7 @@ class SFS(Trips):
                 # updated this document (since we do it all the time)
                 basefile = str(attributes['SFS-nummer'])
                 entrypath = self.store.documententry_path(basefile)
-                if os.path.exists(entrypath):
+                if packfile.exists(entrypath):
                     entry = DocumentEntry(self.store.documententry_path(basefile))
                     if entry.orig_updated:
                         issued = entry.orig_updated.date()
@@ -1401,7 +1409,7 @@ class SFS(Trips):
                 (self.find_definitions, False))
 
     def generate_set_params(self, basefile, version, params):
-        resource = Graph().parse(self.store.distilled_path(basefile, version)).resource(self.canonical_uri(basefile))
+        resource = self.distilled_graph(basefile, version).resource(self.canonical_uri(basefile))
         upph = resource.value(RPUBL.upphavandedatum)
         if upph and upph.value < date.today():
             params['expired'] = 'true'
@@ -1447,26 +1455,18 @@ class SFS(Trips):
 
     
     _document_name_cache = {}
-    _query_template_cache = {}
-    def store_select(self, store, query_template, uri, context=None, extraparams=None):
-        params = {'uri': uri,
-                  'context': context}
-        if extraparams:
-            params.update(extraparams)
-        if query_template not in self._query_template_cache:
-            with self.resourceloader.open(query_template) as fp:
-                self._query_template_cache[query_template] = fp.read()
-        sq = self._query_template_cache[query_template] % params
-        # Only FusekiStore.select supports (or needs) uniongraph
-        if self.config.storetype == "FUSEKI":
-            if context:
-                kwargs = {'uniongraph': False}
-            else:
-                kwargs = {'uniongraph': True}
-        else:
-            kwargs = {}
-        return store.select(sq, "python", **kwargs)
-
+    def annotation_index_queries(self):
+        """Returns the ``(query_template, context)`` pairs for all
+        queries run by
+        :py:meth:`~ferenda.sources.legal.se.SFS.prep_annotation_file`."""
+        sfsdataset = self.dataset_uri()
+        return [("sparql/sfs_rattsfallsref.rq", None),
+                ("sparql/sfs_inboundlinks.rq", sfsdataset),
+                ("sparql/sfs_wikientries.rq", None),
+                ("sparql/sfs_bemyndiganden.rq", None),
+                ("sparql/sfs_changes.rq", None),
+                ("sparql/sfs_forfattningskommentar.rq", None),
+                ("sparql/sfs_upphaver.rq", sfsdataset)]
 
     # FIXME: Copied verbatim from keyword.py
     def time_store_select(self, store, query_template, basefile,
@@ -1668,7 +1668,7 @@ class SFS(Trips):
 
         # 7. all forfattnigskommentar
         canonical_uri = self.canonical_uri(basefile)
-        g = Graph().parse(self.store.distilled_path(basefile))
+        g = self.distilled_graph(basefile)
         title = str(g.value(URIRef(self.canonical_uri(basefile)), DCTERMS.title))
         tempuri = self.temp_sfs_uri(title)
         tempsfs = tempuri.rsplit("/", 1)[1]
@@ -2071,7 +2071,7 @@ PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
 PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
 PREFIX rpubl: <http://rinfo.lagrummet.se/ns/2008/11/rinfo/publ#>
 
-SELECT DISTINCT ?uri ?rdf_type ?titel ?utgiven ?label ?creator ?issued
+SELECT DISTINCT ?uri ?rdf_type ?titel ?utgiven ?label ?creator ?issued ?upphavandedatum
 FROM <%s>
 WHERE {
     ?childuri rdf:type rpubl:KonsolideradGrundforfattning .
@@ -2082,6 +2082,7 @@ WHERE {
     OPTIONAL { ?uri rpubl:arsutgava ?utgiven . }
     OPTIONAL { ?childuri rdfs:label ?label . }
     OPTIONAL { ?childuri dcterms:creator ?creator . }
+    OPTIONAL { ?uri rpubl:upphavandedatum ?upphavandedatum . }
 
 }""" % context
 
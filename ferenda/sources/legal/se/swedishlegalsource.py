@@ -264,15 +264,11 @@ class SwedishLegalSource(DocumentRepository):
     @cached_property
     def minter(self):
         # print("%s (%s) loading minter" % (self.alias, id(self)))
-        filename = self.resourceloader.filename
-        spacefile = filename("uri/swedishlegalsource.space.ttl")
-        slugsfile = filename("uri/swedishlegalsource.slugs.ttl")
-        self.log.debug("Loading URISpace from %s" % spacefile)
-        with codecs.open(spacefile, encoding="utf-8") as space:
-            with codecs.open(slugsfile, encoding="utf-8") as slugs:
-                cfg = Graph().parse(space,
-                                    format="turtle").parse(slugs,
-                                                           format="turtle")
+        spacefile = "uri/swedishlegalsource.space.ttl"
+        slugsfile = "uri/swedishlegalsource.slugs.ttl"
+        self.log.debug("Loading URISpace from %s" % self.resourceloader.filename(spacefile))
+        cfg = self.parse_resource_graph(spacefile)
+        self.parse_resource_graph(slugsfile, cfg)
         COIN = Namespace("http://purl.org/court/def/2009/coin#")
         # select correct URI for the URISpace definition by
         # finding a single coin:URISpace object
@@ -283,11 +279,11 @@ class SwedishLegalSource(DocumentRepository):
     def refparser(self):
         cd = self.commondata
         if self.alias != "sfs" and self.resourceloader.exists("extra/sfs.ttl"):
-            with self.resourceloader.open("extra/sfs.ttl") as fp:
-                cd.parse(data=fp.read(), format="turtle")
+            self.parse_resource_graph("extra/sfs.ttl", cd)
         filter = SwedishCitationParser.FILTER_LAW if self.alias == "sfs" else SwedishCitationParser.FILTER_ALL
         return SwedishCitationParser(LegalRef(*self.parse_types,
-                                              logger=self.log),
+                                              logger=self.log,
+                                              cachesize=self.config.refcachesize),
                                      self.minter,
                                      cd,
                                      allow_relative=self.parse_allow_relative,
@@ -310,6 +306,7 @@ class SwedishLegalSource(DocumentRepository):
         opts = super(SwedishLegalSource, cls).get_default_options()
         opts['pdfimages'] = False
         opts['parserefs'] = True
+        opts['refcachesize'] = 0
         opts['cssfiles'] = ['css/swedishlegalsource.css']
         return opts
 
@@ -6,6 +6,7 @@ from builtins import *
 import os
 import codecs
 import copy
+import mmap
 
 
 class TextReader(object):
@@ -59,9 +60,7 @@ class TextReader(object):
         self.autodehyphenate = False
         self.expandtabs = True
         if filename:
-            self.f = codecs.open(self.name, "r", self.encoding)
-            self.data = self.f.read()
-            self.f.close()
+            self.data = self._load(filename)
         else:
             assert(isinstance(string, str))
             self.data = string
@@ -81,47 +80,68 @@ class TextReader(object):
         # self.iterfunc = self.readline
         return self
 
-    def __find(self, delimiter, startpos):
+    # All slicing of self.data, and conversion of search strings,
+    # goes through the following methods, so that subclasses can
+    # store data in other ways (see MmapTextReader).
+    def _load(self, filename):
+        with codecs.open(filename, "r", self.encoding) as fp:
+            return fp.read()
+
+    def _encode(self, s):
+        # converts a search string to whatever self.data contains
+        return s
+
+    def _slice(self, start, end):
+        return self.data[start:end]
+
+    def _align(self, pos):
+        # adjusts a position so that it doesn't point into the middle
+        # of a character
+        return pos
+
+    def _find(self, delimiter, startpos):
+        delimiter = self._encode(delimiter)
         idx = self.data.find(delimiter, startpos)
         if idx == -1:  # not found, read until eof
-            res = self.data[startpos:]
-            newpos = startpos + len(res)
+            res = self._slice(startpos, None)
+            newpos = max(startpos, len(self.data))
         else:
-            res = self.data[startpos:idx]
+            res = self._slice(startpos, idx)
             newpos = idx + len(delimiter)
         return (res, newpos)
 
-    def __rfind(self, delimiter, startpos):
+    def _rfind(self, delimiter, startpos):
+        delimiter = self._encode(delimiter)
         idx = self.data.rfind(delimiter, 0, startpos)
         if idx == -1:  # not found, read until bof
-            res = self.data[:startpos]
+            res = self._slice(None, startpos)
             newpos = 0
         else:
-            res = self.data[idx + len(delimiter):startpos]
+            res = self._slice(idx + len(delimiter), startpos)
             newpos = idx
         return (res, newpos)
 
-    def __process(self, s):
+    def _process(self, s):
         if self.autostrip:
-            s = self.__strip(s)
+            s = self._strip(s)
         if self.autodewrap:
-            s = self.__dewrap(s)
+            s = self._dewrap(s)
         if self.autodehyphenate:
-            s = self.__dehyphenate(s)
+            s = self._dehyphenate(s)
         if self.expandtabs:
-            s = self.__expandtabs(s)
+            s = self._expandtabs(s)
         return s
 
-    def __strip(self, s):
+    def _strip(self, s):
         return s.strip()
 
-    def __dewrap(self, s):
+    def _dewrap(self, s):
         return s.replace(self.linesep, " ")
 
-    def __dehyphenate(self, s):
+    def _dehyphenate(self, s):
         return s  # FIXME: implement
 
-    def __expandtabs(self, s):
+    def _expandtabs(self, s):
         return s.expandtabs(8)
 
     #----------------------------------------------------------------
@@ -137,7 +157,7 @@ class TextReader(object):
 
     def cue(self, string):
         """Set seek position at the beginning of *string*, starting at current seek position. Raises IOError if *string* not found."""
-        idx = self.data.find(string, self.currpos)
+        idx = self.data.find(self._encode(string), self.currpos)
         if idx == -1:
             raise IOError("Could not find %r in file" % string)
         self.currpos = idx
@@ -145,16 +165,16 @@ class TextReader(object):
     def cuepast(self, string):
         """Set seek position at the beginning of *string*, starting at current seek position. Raises IOError if *string* not found."""
         self.cue(string)
-        self.currpos += len(string)
+        self.currpos += len(self._encode(string))
 
     def readto(self, string):
         """Read and return all text between current seek potition and *string*. Sets new seek position at the start of *string*.  Raises IOError if *string* not found."""
-        idx = self.data.find(string, self.currpos)
+        idx = self.data.find(self._encode(string), self.currpos)
         if idx == -1:
             raise IOError("Could not find %r in file" % string)
-        res = self.data[self.currpos:idx]
+        res = self._slice(self.currpos, idx)
         self.currpos = idx
-        return self.__process(res)
+        return self._process(res)
 
     def readparagraph(self):
         """Reads and returns the next paragraph (all text up to
@@ -184,17 +204,17 @@ two or more consecutive line separators)."""
 
     def readchunk(self, delimiter):
         """Reads and returns the next chunk of text up to *delimiter*"""
-        (self.lastread, self.currpos) = self.__find(delimiter, self.currpos)
-        return self.__process(self.lastread)
+        (self.lastread, self.currpos) = self._find(delimiter, self.currpos)
+        return self._process(self.lastread)
 
     def lastread(self):
         """Returns the last chunk of data that was actually read (i.e. the ``peek*`` and ``prev*`` methods do not affect this)"""
-        return self.__process(self.lastread)
+        return self._process(self.lastread)
 
     def peek(self, size=0):
         """Works like :meth:`~ferenda.TextReader.read`, but does not affect current seek position."""
-        res = self.data[self.currpos:self.currpos + size]
-        return self.__process(res)
+        res = self._slice(self.currpos, self._align(self.currpos + size))
+        return self._process(res)
 
     def peekline(self, times=1):
         """Works like :meth:`~ferenda.TextReader.readline`, but does not affect current seek position. If *times* is specified, peeks that many lines ahead."""
@@ -218,18 +238,18 @@ two or more consecutive line separators)."""
         """Works like :meth:`~ferenda.TextReader.readchunk`, but does not affect current seek position. If *times* is specified, peeks that many chunks ahead."""
         oldpos = self.currpos
         for i in range(times):
-            (res, newpos) = self.__find(delimiter, oldpos)
+            (res, newpos) = self._find(delimiter, oldpos)
             # print "peekchunk: newpos: %s, oldpos: %s" % (newpos,oldpos)
             if newpos == oldpos:
                 raise IOError("Peek past end of file")
             else:
                 oldpos = newpos
-        return self.__process(res)
+        return self._process(res)
 
     def prev(self, size=0):
         """Works like :meth:`~ferenda.TextReader.read`, but reads backwards from current seek position, and does not affect it."""
-        res = self.data[self.currpos - size:self.currpos]
-        return self.__process(res)
+        res = self._slice(self._align(self.currpos - size), self.currpos)
+        return self._process(res)
 
     def prevline(self, times=1):
         """Works like :meth:`~ferenda.TextReader.readline`, but reads backwards from current seek position, and does not affect it. If *times* is specified, reads the line that many times back."""
@@ -243,12 +263,12 @@ two or more consecutive line separators)."""
         """Works like :meth:`~ferenda.TextReader.readchunk`, but reads backwards from current seek position, and does not affect it. If *times* is specified, reads the chunk that many times back."""
         oldpos = self.currpos
         for i in range(times):
-            (res, newpos) = self.__rfind(delimiter, oldpos)
+            (res, newpos) = self._rfind(delimiter, oldpos)
             if newpos == oldpos:
                 raise IOError("Prev (backwards peek) past end of file")
             else:
                 oldpos = newpos
-        return self.__process(res)
+        return self._process(res)
 
     def getreader(self, callableObj, *args, **kwargs):
         """Enables you to treat the result of any single ``read*``, ``peek*``
@@ -291,9 +311,10 @@ two or more consecutive line separators)."""
 
     def read(self, size=0):
         """See :py:meth:`io.TextIOBase.read`."""
-        self.lastread = self.data[self.currpos:self.currpos + size]
-        self.currpos += len(self.lastread)
-        return self.__process(self.lastread)
+        end = max(self.currpos, min(self._align(self.currpos + size), len(self.data)))
+        self.lastread = self._slice(self.currpos, end)
+        self.currpos = end
+        return self._process(self.lastread)
 
     def readline(self, size=None):
         """See :py:meth:`io.TextIOBase.readline`.
@@ -335,9 +356,9 @@ two or more consecutive line separators)."""
 
     def __next__(self):
         oldpos = self.currpos
-        # res = self.__process(self.readline())
+        # res = self._process(self.readline())
         # print "self.iterfunc is %r" % self.iterfunc
-        res = self.__process(self.iterfunc(*self.iterargs, **self.iterkwargs))
+        res = self._process(self.iterfunc(*self.iterargs, **self.iterkwargs))
         if self.currpos == oldpos:
             raise StopIteration
         else:
@@ -350,3 +371,96 @@ two or more consecutive line separators)."""
 than lines (eg paragraphs, pages, etc).
 
     """
+
+
+class MmapTextReader(TextReader):
+    """A :py:class:`~ferenda.TextReader` that memory-maps its file
+    instead of reading and decoding all of it up front. Searching
+    (``cue``, ``readto``, ``readparagraph`` etc) is done directly on
+    the bytes of the file, and only the text that is actually
+    returned gets decoded. This is useful for large files where only
+    some parts are of interest, or which are read one paragraph at a
+    time.
+
+    The API is the same as for :py:class:`~ferenda.TextReader`, except
+    that seek positions (``tell``, ``seek``) and the *size* parameter
+    for ``read``, ``peek`` and ``prev`` are counted in bytes, not
+    characters. For single-byte encodings, these are the same.
+
+    :param filename: The file to read
+    :type filename: str
+    :param encoding: The encoding used by the file (default
+                     ``ascii``). Must be either UTF-8 or a single-byte
+                     encoding that is a superset of ASCII.
+    :type encoding: str
+    :param linesep: The line separators used in the file
+    :type linesep: str
+    """
+
+    def __init__(self, filename, encoding=None, linesep=None):
+        codec = codecs.lookup(encoding or 'ascii')
+        self._utf8 = codec.name == 'utf-8'
+        if not self._utf8 and (
+                codec.encode("\r\n\f")[0] != b"\r\n\f" or
+                len(codec.decode(bytes(bytearray(range(256))), 'replace')[0]) != 256):
+            raise ValueError("%s: encoding %s is not supported by MmapTextReader" %
+                             (filename, encoding))
+        self._encoded = {}
+        super(MmapTextReader, self).__init__(filename, encoding=encoding,
+                                             linesep=linesep)
+
+    def _load(self, filename):
+        with open(filename, "rb") as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                # empty files can't be mapped
+                return b""
+            # the mapping stays valid after the file is closed
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _encode(self, s):
+        try:
+            return self._encoded[s]
+        except KeyError:
+            self._encoded[s] = s.encode(self.encoding)
+            return self._encoded[s]
+
+    def _slice(self, start, end):
+        # decode straight from the mapped memory, without creating an
+        # intermediate bytes object
+        view = memoryview(self.data)
+        try:
+            chunk = view[start:end]
+            try:
+                return codecs.decode(chunk, self.encoding)
+            finally:
+                chunk.release()
+        finally:
+            view.release()
+
+    def _align(self, pos):
+        if self._utf8:
+            # move past any UTF-8 continuation bytes (10xxxxxx)
+            while 0 < pos < len(self.data) and (self.data[pos] & 0xC0) == 0x80:
+                pos += 1
+        return pos
+
+    def close(self):
+        """Unmaps the file. The reader cannot be used after this."""
+        if not self.closed:
+            if isinstance(self.data, mmap.mmap):
+                self.data.close()
+            self.closed = True
+
+    def getreader(self, callableObj, *args, **kwargs):
+        # the returned reader only contains the (decoded) result of
+        # callableObj, so it doesn't need the memory map
+        res = callableObj(*args, **kwargs)
+        clone = TextReader(string=" ", encoding=self.encoding,
+                           linesep=self.linesep)
+        for attr in ("iterfunc", "iterargs", "iterkwargs", "autostrip",
+                     "autodewrap", "autodehyphenate", "expandtabs"):
+            setattr(clone, attr, getattr(self, attr))
+        clone.name = self.name
+        clone.data = res
+        clone.maxpos = len(clone.data)
+        return clone
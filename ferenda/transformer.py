@@ -69,7 +69,8 @@ class Transformer(object):
         self.config = config
 
     # valid parameters
-    # - annotationfile: intermediate/basefile.grit.xml
+    # - annotationfile: intermediate/basefile.grit.xml (or a lxml tree
+    #   with the same content, which is then served from memory)
     def transform(self, indata, depth, parameters=None, uritransform=None):
         """Perform the transformation. This method always operates on the
         "native" datastructure -- this might be different depending on
@@ -163,7 +164,7 @@ class Transformer(object):
                 if parameters:
                     p.update(parameters.copy())
                 for key, value in p.items():
-                    if key.endswith("file"):
+                    if key.endswith("file") and isinstance(value, str):
                         p[key] = os.path.relpath(value,
                                                  os.path.dirname(xslfile))
                 p['configurationfile'] = self.t.getconfig(self.config, depth)
@@ -193,6 +194,22 @@ class TransformerEngine(object):
         pass
 
 
+class _InMemoryResolver(etree.Resolver):
+    # Serves documents that are kept as lxml trees (eg annotation
+    # trees created by DocumentRepository.prep_annotation_file) to
+    # the document() function of a XSLT stylesheet, so that they
+    # need not be written to disk just to be read back again.
+    prefix = "ferenda-memory:"
+
+    def __init__(self):
+        self.documents = {}
+
+    def resolve(self, url, pubid, context):
+        if url in self.documents:
+            return self.resolve_string(etree.tostring(self.documents[url]),
+                                       context)
+
+
 class XSLTTransform(TransformerEngine):
 
     def __init__(self, template, templatedir, resourceloader, **kwargs):
@@ -207,6 +224,8 @@ class XSLTTransform(TransformerEngine):
         worktemplate = self.templdir + os.sep + os.path.basename(template)
         assert os.path.exists(worktemplate)
         parser = etree.XMLParser(remove_blank_text=self.format)
+        self.resolver = _InMemoryResolver()
+        parser.resolvers.add(self.resolver)
         xsltree = etree.parse(worktemplate, parser)
 
         # if the XSLT transform contained <xsl:value-of
@@ -270,8 +289,16 @@ class XSLTTransform(TransformerEngine):
             config_fullpath = os.path.abspath(config)
             strparams['configurationfile'] = XSLT.strparam(config_fullpath)
         removefiles = []
+        removedocuments = []
         for key, value in parameters.items():
-            if key.endswith("file") and value:
+            if key.endswith("file") and isinstance(value, (etree._Element,
+                                                           etree._ElementTree)):
+                # an already parsed document: make it available for
+                # document() through our resolver
+                value = "%s%s-%s" % (self.resolver.prefix, key, id(value))
+                self.resolver.documents[value] = parameters[key]
+                removedocuments.append(value)
+            elif key.endswith("file") and value:
                 if all(ord(c) < 128 and c != " " for c in value):
                     # IF the file name contains ONLY ascii chars and
                     # no spaces, we can use it directly. However, we
@@ -310,6 +337,8 @@ class XSLTTransform(TransformerEngine):
         finally:
             for f in removefiles:
                 util.robust_remove(f)
+            for d in removedocuments:
+                del self.resolver.documents[d]
         # FIXME: This can never be reached, if _transformer() does not
         # raise an error, the above returns immediately.
         if len(self._transformer.error_log) > 0:
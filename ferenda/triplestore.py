@@ -341,6 +341,11 @@ class RemoteStore(TripleStore):
                     "json": "application/sparql-results+json",
                     "binary": "application/x-binary-rdf-results-table"}
 
+    # queries that would result in a longer GET url than this are
+    # sent as a POST request instead (many servers and proxies do not
+    # accept urls longer than 8 KB)
+    max_url_length = 4096
+
     def __init__(self, location, repository, curl=False):
         super(RemoteStore, self).__init__(location, repository)
         self.curl = curl
@@ -441,7 +446,7 @@ class RemoteStore(TripleStore):
     def select(self, query, format="sparql"):
         url = self._endpoint_url()
         query = query.replace("\n", " ")
-        url += "?query=" + quote(query).replace("/", "%2F")
+        geturl = url + "?query=" + quote(query).replace("/", "%2F")
 
         headers = {}
         if format == "python":
@@ -449,10 +454,13 @@ class RemoteStore(TripleStore):
         else:
             headers['Accept'] = self._contenttype[format]
         try:
-            try:
-                results = requests.get(url, headers=headers, data=query)
-            except UnicodeEncodeError:
-                results = requests.get(url, headers=headers, data=query.encode("utf-8"))
+            if len(geturl) > self.max_url_length:
+                results = requests.post(url, headers=headers, data={'query': query})
+            else:
+                try:
+                    results = requests.get(geturl, headers=headers, data=query)
+                except UnicodeEncodeError:
+                    results = requests.get(geturl, headers=headers, data=query.encode("utf-8"))
             results.raise_for_status()
             if format == "python":
                 return self._sparql_results_to_list(results.content)
@@ -468,11 +476,14 @@ class RemoteStore(TripleStore):
 
     def construct(self, query):
         url = self._endpoint_url()
-        url += "?query=" + quote(query)
+        geturl = url + "?query=" + quote(query)
         try:
             format = "turtle"
             headers = {'Accept': self._contenttype[format]}
-            resp = requests.get(url, headers=headers)
+            if len(geturl) > self.max_url_length:
+                resp = requests.post(url, headers=headers, data={'query': query})
+            else:
+                resp = requests.get(geturl, headers=headers)
             resp.raise_for_status()
             result = Graph()
             result.parse(data=resp.content, format=format)
@@ -9,6 +9,7 @@ install_aliases()
 import codecs
 import datetime
 import filecmp
+import hashlib
 import locale
 import logging
 import os
@@ -332,7 +333,7 @@ def list_dirs(d, suffix=None, reverse=False):
 # util.File
 
 
-def replace_if_different(src, dst, archivefile=None):
+def replace_if_different(src, dst, archivefile=None, hashmanifest=None):
     """Like :py:func:`shutil.move`, except the *src* file isn't moved if the
     *dst* file already exists and is identical to *src*. Also doesn't
     require that the directory of *dst* exists beforehand.
@@ -343,29 +344,40 @@ def replace_if_different(src, dst, archivefile=None):
     :type  src: str
     :param dst: The destination file
     :type  dst: str
+    :param hashmanifest: Optional. If provided, the recorded hash of
+                         *dst* is used to determine if it's identical
+                         to *src*, instead of comparing the files.
+    :type  hashmanifest: ferenda.documentstore.HashManifest
     :returns: True if src was copied to dst, False otherwise
     :rtype: bool
     """
     assert os.path.exists(src)
+    digest = _file_md5(src) if hashmanifest else None
     if not os.path.exists(dst):
         # print "old file %s didn't exist" % dst
         robust_rename(src, dst)
-        return True
+        changed = True
+    elif digest and hashmanifest.unchanged(dst, digest):
+        os.unlink(src)
+        return False
     elif not filecmp.cmp(src, dst, shallow=False):
         # print "old file %s different from new file %s" % (dst,src)
         if archivefile:
             robust_rename(dst, archivefile)
         robust_rename(src, dst)
-        return True
+        changed = True
     else:
         # print "old file %s identical to new file %s" % (dst,src)
         os.unlink(src)
-        return False
+        changed = False
+    if digest:
+        hashmanifest.record(dst, digest)
+    return changed
 
 # util.File
 
 
-def copy_if_different(src, dest):
+def copy_if_different(src, dest, hashmanifest=None):
     """Like :py:func:`shutil.copyfile`, except the *src* file isn't copied
 if the *dst* file already exists and is identical to *src*. Also
 doesn't require that the directory of *dst* exists beforehand.
@@ -374,6 +386,12 @@ doesn't require that the directory of *dst* exists beforehand.
     :type  src: str
     :param dst: The destination file
     :type  dst: str
+    :param hashmanifest: Optional. If provided, and *src* and *dst*
+                         differ in size or modification time, the
+                         recorded hash of *dst* is used to determine
+                         if it's identical to *src*, instead of
+                         comparing the files.
+    :type  hashmanifest: ferenda.documentstore.HashManifest
     :returns: True if src was copied to dst, False otherwise
     :rtype: bool
 
@@ -382,12 +400,37 @@ doesn't require that the directory of *dst* exists beforehand.
         ensure_dir(dest)
         shutil.copy2(src, dest)
         return True
-    elif not filecmp.cmp(src, dest):
+    if _stat_signature(src) == _stat_signature(dest):
+        # copy2 preserves the modification time, so this is (like for
+        # a shallow filecmp.cmp) considered to be an earlier copy
+        return False
+    digest = _file_md5(src) if hashmanifest else None
+    if digest and hashmanifest.unchanged(dest, digest):
+        return False
+    # a recorded hash that differs from digest means that the
+    # content differs, no need to compare the files
+    elif (digest and hashmanifest.digest(dest)) or not filecmp.cmp(src, dest):
         os.unlink(dest)
         shutil.copy2(src, dest)
-        return True
+        changed = True
     else:
-        return False
+        changed = False
+    if digest:
+        hashmanifest.record(dest, digest)
+    return changed
+
+
+def _stat_signature(filename):
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime
+
+
+def _file_md5(filename):
+    c = hashlib.md5()
+    with open(filename, "rb") as fp:
+        for chunk in iter(lambda: fp.read(65536), b""):
+            c.update(chunk)
+    return c.hexdigest()
 
 # util.File
 
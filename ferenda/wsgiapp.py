@@ -5,6 +5,7 @@ from builtins import *
 from future import standard_library
 standard_library.install_aliases()
 
+from bisect import bisect_left
 from collections import defaultdict, OrderedDict, Counter, Iterable
 from datetime import date, datetime
 from io import BytesIO
@@ -19,6 +20,8 @@ import os
 import pkg_resources
 import re
 import sys
+import threading
+import time
 import traceback
 
 from rdflib import URIRef, Namespace, Literal, Graph
@@ -34,7 +37,7 @@ from werkzeug.wsgi import wrap_file
 
 from ferenda import (DocumentRepository, FulltextIndex, Transformer,
                      Facet, ResourceLoader)
-from ferenda import fulltextindex, util, elements
+from ferenda import fulltextindex, graphcache, util, elements
 from ferenda.elements import html
 
 
@@ -54,6 +57,230 @@ class WSGIOutputHandler(logging.Handler):
             # for that.
             pass
 
+
+class FacetStore(object):
+    """Keeps the observations used by :py:meth:`~ferenda.WSGIApp.stats`
+    in memory, so that the faceted data of each repo doesn't have to
+    be loaded, and every facet selector run for every row, on each
+    request.
+
+    For every dimension, the number of documents for each observation
+    is precomputed, as is the set of observations for each document
+    uri, which makes stats for a resultset a matter of intersecting
+    the resultset with the uris of each repo and facet.
+
+    The store is loaded from the cached faceted data of each repo
+    (see :py:meth:`~ferenda.DocumentRepository.cached_faceted_data`),
+    and reloaded by :py:meth:`refresh` whenever that cache changes. It
+    does not check whether the triple store has changed since the
+    cache was created, so new data shows up once the faceted data is
+    recreated (eg. by the ``toc`` action). Only repos without any
+    cached data have it created (querying the triple store) when
+    the store is loaded.
+
+    :param app: The app that provides repos, config and the methods
+                for computing observations
+    :type  app: ferenda.WSGIApp
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.signature = None
+        self.counts = OrderedDict()
+        self.parts = []
+        self.ttlfiles = set()
+
+    def current_signature(self):
+        # the data depends on which facets each repo has, but these
+        # are not expected to change while the app is running
+        files = list(self.ttlfiles)
+        for repo in self.app.repos:
+            files.append(repo.store.resourcepath("toc/faceted_data.json"))
+        return (self.app.config.legacyapi,
+                tuple((f, os.path.getmtime(f) if os.path.exists(f) else None)
+                      for f in files))
+
+    def refresh(self):
+        """Loads the store, if it's not loaded or the underlying data
+        has changed since it was loaded."""
+        if self.signature is None or self.signature != self.current_signature():
+            self.load()
+
+    def load(self):
+        """Loads the faceted data of all repos and computes all observations."""
+        with util.logtime(self.app.log.debug,
+                          "stats: Loaded facet store (%(elapsed).3f sec)"):
+            ttlfiles, namespaces = self.app.stats_resource_files()
+            resource_graph = self.app.stats_resource_graph(ttlfiles, namespaces)
+            counts = OrderedDict()
+            parts = []
+            for repo in self.app.repos:
+                data = repo.cached_faceted_data()
+                if data is None:
+                    data = repo.faceted_data()
+                for facet in repo.facets():
+                    if not facet.dimension_type:
+                        continue
+                    dimension, observed = self.app.stats_observations(
+                        data, facet, resource_graph)
+                    byuri = defaultdict(list)
+                    if dimension not in counts:
+                        counts[dimension] = Counter()
+                    for k, uris in observed.items():
+                        # since counts[dimension] is a Counter not a
+                        # regular dict, observations from different
+                        # repos with common keys will add up.
+                        counts[dimension][k] += len(uris)
+                        for uri in uris:
+                            byuri[uri].append(k)
+                    parts.append((dimension, frozenset(byuri), dict(byuri)))
+            self.ttlfiles = ttlfiles
+            self.counts, self.parts = counts, parts
+            self.signature = self.current_signature()
+
+    def slices(self, resultset=None):
+        """Returns the number of documents for each observation, by
+        dimension.
+
+        :param resultset: If provided, only count documents with these uris
+        :type  resultset: set
+        :returns: a Counter for each dimension, with
+                  ``(dimension_type, observation)`` tuples as keys
+        :rtype: OrderedDict
+        """
+        if resultset is None:
+            return self.counts
+        slices = OrderedDict((dimension, Counter()) for dimension in self.counts)
+        for dimension, uris, byuri in self.parts:
+            for uri in resultset & uris:
+                slices[dimension].update(byuri[uri])
+        return slices
+
+
+class SearchCache(object):
+    """Keeps the results of recent queries in memory, so that identical
+    queries don't have to be run again. Results expire after a
+    number of seconds, and all results are discarded as soon as the
+    fulltext index reports a new commit generation.
+
+    :param maxsize: The maximum number of cached results (0 disables
+                    the cache)
+    :type  maxsize: int
+    :param ttl: The number of seconds that a result is kept
+    :type  ttl: int
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = int(maxsize)
+        self.ttl = int(ttl)
+        self.entries = OrderedDict()
+        self.generation = None
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, generation=None):
+        """Returns the cached result for key, or None.
+
+        :param generation: The current commit generation of the index
+                           (None if the index can't tell)
+        """
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.generation = generation
+            entry = self.entries.get(key)
+            if entry and entry[0] + self.ttl < time.time():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        """Returns the size of the cache and its hit rate since the app
+        was started."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.entries),
+                    'maxsize': self.maxsize,
+                    'ttl': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hitrate': self.hits / lookups if lookups else None}
+
+
+class PrefixIndex(object):
+    """Answers prefix queries, like autocomplete queries for document
+    identifiers and titles, from memory by binary search in a sorted
+    list of normalized keys.
+
+    Each entry consists of a key, a rank and an item (a dict with at
+    least a ``url`` key). Items with matching keys are returned in
+    rank order (lowest first), then shortest key first. An item that
+    matches through several keys is only returned once.
+
+    :param entries: ``(key, rank, item)`` tuples
+    :type  entries: iterable
+    """
+
+    def __init__(self, entries=()):
+        self.signature = None
+        self.build(entries)
+
+    def build(self, entries):
+        """Replaces the contents of the index with entries."""
+        self.entries = sorted((self.normalize(key), rank, seq, item)
+                              for seq, (key, rank, item) in enumerate(entries)
+                              if key)
+        self.keys = [entry[0] for entry in self.entries]
+
+    def normalize(self, key):
+        return " ".join(key.lower().split())
+
+    def lookup(self, prefix, limit=10):
+        """Returns at most limit items with keys starting with prefix.
+
+        :param prefix: The (unnormalized) prefix
+        :type  prefix: str
+        :param limit: The maximum number of items to return
+        :type  limit: int
+        :returns: copies of the matching items
+        :rtype: list
+        """
+        prefix = self.normalize(prefix)
+        if not prefix:
+            return []
+        start = bisect_left(self.keys, prefix)
+        # the highest possible code point sorts after all keys that
+        # start with prefix
+        stop = bisect_left(self.keys, prefix + "\U0010ffff", start)
+        candidates = sorted(self.entries[start:stop],
+                            key=lambda entry: (entry[1], len(entry[0]), entry[2]))
+        res = []
+        seen = set()
+        for key, rank, seq, item in candidates:
+            if item['url'] in seen:
+                continue
+            seen.add(item['url'])
+            res.append(dict(item))
+            if len(res) == limit:
+                break
+        return res
+
+    def __len__(self):
+        return len(self.entries)
+
+
 class WSGIApp(object):
 
     #
@@ -63,11 +290,16 @@ class WSGIApp(object):
         self.repos = repos
         self.config = config
         self.log = logging.getLogger("wsgi")
+        self.facetstore = FacetStore(self)
+        self.searchcache = SearchCache(getattr(self.config, 'searchcache', 0),
+                                       getattr(self.config, 'searchcachettl', 300))
+        self._fulltextindex = None
         # at this point, we should build our routing map
         rules = [
             Rule("/", endpoint="frontpage"),
             Rule(self.config.apiendpoint, endpoint="api"),
             Rule(self.config.apiendpoint+";stats", endpoint="api"),
+            Rule(self.config.apiendpoint+";searchcache", endpoint="api"),
             Rule(self.config.searchendpoint, endpoint="search")
         ]
         if self.config.legacyapi:
@@ -230,23 +462,46 @@ class WSGIApp(object):
         return Response(data, mimetype="text/html")
 
     def stats(self, resultset=()):
-        slices = OrderedDict()
+        # The observations for all repos and facets are kept in
+        # memory by self.facetstore, which is loaded the first time
+        # stats are requested and reloaded whenever the underlying
+        # data changes.
+        self.facetstore.refresh()
 
-        datadict = defaultdict(list)
+        # if used in the resultset mode, only calculate stats for those
+        # resources/documents that are in the resultset.
+        if resultset:
+            slices = self.facetstore.slices(set(r['iri'] for r in resultset))
+        else:
+            slices = self.facetstore.slices()
 
-        # 1: Create a giant RDF graph consisting of all triples of all
-        #    repos' commondata. To avoid parsing the same RDF files
-        #    over and over, this section duplicates the logic of
-        #    DocumentRepository.commondata to make sure each RDF
-        #    file is loaded only once.
+        # Transform our easily-updated data structures to the list
+        # of dicts of lists that we're supposed to return.
+        res = {"type": "DataSet",
+               "slices": []
+               }
+        for k, v in sorted(slices.items()):
+            observations = []
+            for ok, ov in sorted(v.items()):
+                observations.append({ok[0]: ok[1],
+                                     "count": ov})
+            res['slices'].append({"dimension": k,
+                                  "observations": observations})
+        return res
+
+    def stats_resource_files(self):
+        """Returns the RDF files needed to create the common resource graph
+        used by :py:meth:`~ferenda.WSGIApp.stats`, along with the
+        prefixes of all namespaces used by all repos."""
+        # To avoid parsing the same RDF files over and over, this
+        # duplicates the logic of DocumentRepository.commondata to
+        # make sure each RDF file is loaded only once.
         ttlfiles = set()
-        resource_graph = Graph()
         namespaces = {}
         for repo in self.repos:
             for prefix, ns in repo.make_graph().namespaces():
                 assert ns not in namespaces or namespaces[ns] == prefix, "Conflicting prefixes for ns %s" % ns
                 namespaces[ns] = prefix
-                resource_graph.bind(prefix, ns)
                 for cls in inspect.getmro(repo.__class__):
                     if hasattr(cls, "alias"):
                         commonpath = "res/extra/%s.ttl" % cls.alias
@@ -254,62 +509,57 @@ class WSGIApp(object):
                             ttlfiles.add(commonpath)
                         elif pkg_resources.resource_exists('ferenda', commonpath):
                             ttlfiles.add(pkg_resources.resource_filename('ferenda', commonpath))
+        return ttlfiles, namespaces
 
+    def stats_resource_graph(self, ttlfiles, namespaces):
+        """Creates a giant RDF graph consisting of all triples of all
+        repos' commondata."""
+        resource_graph = Graph()
+        for ns, prefix in namespaces.items():
+            resource_graph.bind(prefix, ns)
         self.log.debug("stats: Loading resources %s into a common resource graph" %
                        list(ttlfiles))
         for filename in ttlfiles:
-            resource_graph.parse(data=util.readfile(filename), format="turtle")
+            graphcache.parse(filename, resource_graph, cachedir=self.graphcachedir)
         pkg_resources.cleanup_resources()
+        return resource_graph
 
+    @property
+    def graphcachedir(self):
+        """The directory where parsed RDF resource files are cached
+        (see :py:mod:`ferenda.graphcache`), or ``None`` if the
+        ``graphcache`` option isn't set."""
+        if getattr(self.config, 'graphcache', False):
+            return self.config.datadir + os.sep + "graphcache"
 
-        # 2: if used in the resultset mode, only calculate stats for those
-        # resources/documents that are in the resultset.
-        resultsetmembers = set()
-        if resultset:
-            for r in resultset:
-                resultsetmembers.add(r['iri'])
-
-        # 3: using each repo's faceted_data and its defined facet
-        # selectors, create a set of observations for that repo
-        # 
-        # FIXME: If in resultset mode, we might ask a repo for its
-        # faceted data and then use exactly none of it since it
-        # doesn't match anything in resultsetmembers. We COULD analyze
-        # common resultset iri prefixes and then only call
-        # faceted_data for some (or one) repo.
-        for repo in self.repos:
-            data = repo.faceted_data()
-            if resultsetmembers:
-                data = [r for r in data if r['uri'] in resultsetmembers]
-
-            for facet in repo.facets():
-                if not facet.dimension_type:
-                    continue
-                dimension, obs = self.stats_slice(data, facet, resource_graph)
-                if dimension in slices:
-                    # since observations is a Counter not a regular
-                    # dict, if slices[dimensions] and observations
-                    # have common keys this will add the counts not
-                    # replace them.
-                    slices[dimension].update(obs)
-                else:
-                    slices[dimension] = obs
-
-        # 4. Transform our easily-updated data structures to the list
-        # of dicts of lists that we're supposed to return.
-        res = {"type": "DataSet",
-               "slices": []
-               }
-        for k, v in sorted(slices.items()):
-            observations = []
-            for ok, ov in sorted(v.items()):
-                observations.append({ok[0]: ok[1],
-                                     "count": ov})
-            res['slices'].append({"dimension": k,
-                                  "observations": observations})
-        return res
+    def preload(self):
+        """Loads the ontologies and commondata of all repos, and the
+        RDF files used by :py:meth:`~ferenda.WSGIApp.stats`, up
+        front. Called by :py:func:`~ferenda.manager.make_wsgi_app` if
+        the ``preloadgraphs`` option is set, so that a server that
+        forks its worker processes after loading the app (like uWSGI
+        without ``lazy-apps``) parses these files only once, and all
+        workers share the parsed graphs."""
+        with util.logtime(self.log.debug,
+                          "Preloaded graphs in %(elapsed).3f sec"):
+            for repo in self.repos:
+                repo.ontologies
+                repo.commondata
+            ttlfiles, namespaces = self.stats_resource_files()
+            graphcache.preload(ttlfiles, cachedir=self.graphcachedir)
 
     def stats_slice(self, data, facet, resource_graph):
+        dimension_label, observed = self.stats_observations(data, facet, resource_graph)
+        observations = Counter()
+        for k, uris in observed.items():
+            observations[k] = len(uris)
+        return dimension_label, observations
+
+    def stats_observations(self, data, facet, resource_graph):
+        """Returns the label of the dimension that the facet provides, and
+        a dict mapping each ``(dimension_type, observation)`` key for
+        that dimension to the set of uris that were observed for that
+        key."""
         binding = resource_graph.qname(facet.rdftype).replace(":", "_")
         if facet.dimension_label:
             dimension_label = facet.dimension_label
@@ -337,10 +587,9 @@ class WSGIApp(object):
         else:
             transformer = lambda x: x
 
-        observations = Counter()
-        # one file per uri+observation seen -- avoid
+        # one set of uris per observation seen -- avoid
         # double-counting
-        observed = {}
+        observed = defaultdict(set)
         for row in data:
             observation = None
             try:
@@ -379,18 +628,25 @@ class WSGIApp(object):
 
                 pass
             if observation is not None:
-                k = (dimension_type, observation)
-                if (row['uri'], observation) not in observed:
-                    observed[(row['uri'], observation)] = True
-                    observations[k] += 1
-        return dimension_label, observations
+                observed[(dimension_type, observation)].add(row['uri'])
+        return dimension_label, observed
+
+    def fulltextindex(self):
+        """Returns the fulltext index client used by
+        :py:meth:`~ferenda.WSGIApp.query`. Only one client is created
+        per process, since connecting may require a HTTP call to
+        check that the index exists."""
+        # the app might be created before the server forks worker
+        # processes, which shouldn't share clients
+        if self._fulltextindex is None or self._fulltextindex[0] != os.getpid():
+            idx = FulltextIndex.connect(self.config.indextype,
+                                        self.config.indexlocation,
+                                        self.repos)
+            self._fulltextindex = (os.getpid(), idx)
+        return self._fulltextindex[1]
 
     def query(self, request, options=None):
-        # this is needed -- but the connect call shouldn't neccesarily
-        # have to call exists() (one HTTP call)
-        idx = FulltextIndex.connect(self.config.indextype,
-                                    self.config.indexlocation,
-                                    self.repos)
+        idx = self.fulltextindex()
         # parse_parameters -> {
         #  "q": "freetext",
         #  "fields": {"dcterms_publisher": ".../org/di",
@@ -405,15 +661,27 @@ class WSGIApp(object):
         if options is None:
             options = {}
         options.update(self.parse_parameters(request, idx))
-        res, pager = idx.query(q=options.get("q"),
-                               pagenum=options.get("pagenum"),
-                               pagelen=options.get("pagelen"),
-                               ac_query=options.get("autocomplete"),
-                               exclude_repos=options.get("exclude_repos"),
-                               boost_repos=options.get("boost_repos"),
-                               include_fragments=options.get("include_fragments"),
-                               **options.get("fields"))
-        mangled = self.mangle_results(res, options.get("autocomplete"))
+        cached = key = None
+        if self.searchcache.maxsize:
+            # identical queries (eg autocomplete queries for the same
+            # prefix) are answered from the cache until the index
+            # changes
+            key = self.searchcache_key(options)
+            cached = self.searchcache.get(key, idx.generation())
+        if cached:
+            pager, mangled = cached
+        else:
+            res, pager = idx.query(q=options.get("q"),
+                                   pagenum=options.get("pagenum"),
+                                   pagelen=options.get("pagelen"),
+                                   ac_query=options.get("autocomplete"),
+                                   exclude_repos=options.get("exclude_repos"),
+                                   boost_repos=options.get("boost_repos"),
+                                   include_fragments=options.get("include_fragments"),
+                                   **options.get("fields"))
+            mangled = self.mangle_results(res, options.get("autocomplete"))
+            if key:
+                self.searchcache.put(key, (pager, mangled))
         # 3.1 create container for results
         res = {"startIndex": pager['firstresult'] - 1,
                "itemsPerPage": options["pagelen"],
@@ -432,6 +700,21 @@ class WSGIApp(object):
         return res
 
 
+    def searchcache_key(self, options):
+        """Returns a string that identifies all options that affect the
+        result of a query."""
+        def default(o):
+            if isinstance(o, fulltextindex.SearchModifier):
+                return [o.__class__.__name__] + list(o.values)
+            elif isinstance(o, date):
+                return o.isoformat()
+            raise TypeError("%r is not JSON serializable" % o)
+        return json.dumps([options.get(k) for k in ("q", "fields", "pagenum",
+                                                    "pagelen", "autocomplete",
+                                                    "exclude_repos", "boost_repos",
+                                                    "include_fragments")],
+                          sort_keys=True, default=default)
+
     def mangle_results(self, res, ac_query):
         def _elements_to_html(elements):
             res = ""
@@ -686,6 +969,8 @@ class WSGIApp(object):
     def handle_api(self, request, **values):
         if request.path.endswith(";stats"):
             d = self.stats()
+        elif request.path.endswith(";searchcache"):
+            d = self.searchcache.stats()
         else:
             d = self.query(request)
         data = json.dumps(d, indent=4, default=util.json_default_date,
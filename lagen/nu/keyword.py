@@ -61,6 +61,13 @@ class LNKeyword(keyword.Keyword, SameAs):
         else:
             self.sfsrepo = SFS()
 
+    def annotation_index_queries(self):
+        dvdataset = self.config.url + "dataset/dv"
+        sfsdataset = self.config.url + "dataset/sfs"
+        return super(LNKeyword, self).annotation_index_queries() + [
+            ("sparql/keyword_sfs.rq", sfsdataset),
+            ("sparql/keyword_dv.rq", dvdataset)]
+
     def sanitize_term(self, term):
         sanitized = super(LNKeyword, self).sanitize_term(term)
         if sanitized is not None:
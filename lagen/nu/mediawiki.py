@@ -57,13 +57,11 @@ class LNMediaWiki(wiki.MediaWiki):
                      LegalRef.FORARBETEN, LegalRef.RATTSFALL)
         # self.commondata need to include extra/sfs.ttl
         # somehow. This is probably not the best way.
-        with self.resourceloader.open("extra/sfs.ttl") as fp:
-            self.commondata.parse(data=fp.read(), format="turtle")
+        self.parse_resource_graph("extra/sfs.ttl", self.commondata)
         # actually, to mint URIs for rattsfall we need the
         # skos:altLabel for the rpubl:Rattsfallspublikation -- so we
         # need everything
-        with self.resourceloader.open("extra/swedishlegalsource.ttl") as fp:
-            self.commondata.parse(data=fp.read(), format="turtle")
+        self.parse_resource_graph("extra/swedishlegalsource.ttl", self.commondata)
         return SwedishCitationParser(p,
                                      self.minter,
                                      self.commondata,
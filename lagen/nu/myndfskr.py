@@ -21,7 +21,7 @@ from werkzeug.routing import Rule, BaseConverter
 from ferenda.sources.legal.se import myndfskr
 from ferenda import (CompositeRepository, CompositeStore, Facet, TocPageset,
                      TocPage, RequestHandler)
-from ferenda import util, fulltextindex
+from ferenda import util, fulltextindex, packfile
 from ferenda.elements import Body, Link, html
 from ferenda.sources.legal.se import (SwedishLegalSource, SwedishLegalStore)
 from ferenda.sources.legal.se.fixedlayoutsource import FixedLayoutHandler
@@ -211,11 +211,11 @@ class MyndFskr(CompositeRepository, SwedishLegalSource):
                 finally:
                     inst.log.setLevel(subrepo_loglevel)
                     for b in basefiles:
-                        util.link_or_copy(inst.store.documententry_path(b),
-                                          self.store.documententry_path(b))
+                        packfile.copy(inst.store.documententry_path(b),
+                                      self.store.documententry_path(b))
                     # msbfs/entries/.root.json -> myndfs/entries/msbfs.json
-                    util.link_or_copy(inst.store.documententry_path(".root"),
-                                      self.store.documententry_path(inst.alias))
+                    packfile.copy(inst.store.documententry_path(".root"),
+                                  self.store.documententry_path(inst.alias))
         if not found:
             self.log.error("Couldn't find any subrepo with alias %s" % subrepoalias)
             
@@ -6,9 +6,10 @@ from builtins import *
 # sys
 import os
 import re
+from collections import defaultdict
 from urllib.parse import urlencode, quote_plus
 from wsgiref.util import request_uri
-from datetime import datetime
+from datetime import date, datetime
 
 # 3rdparty
 from rdflib import URIRef, Graph
@@ -18,6 +19,7 @@ from werkzeug.wrappers import Response
 # own
 from ferenda import WSGIApp as OrigWSGIApp
 from ferenda import elements, util
+from ferenda.wsgiapp import PrefixIndex
 from ferenda.elements import html
 from ferenda.fulltextindex import Between, RegexString
 from ferenda.sources.legal.se.legalref import LegalRef
@@ -31,8 +33,11 @@ class WSGIApp(OrigWSGIApp):
     """
 
     snippet_length = 160
+    prefixindex_exclude_repos = ('mediawiki',)
     def __init__(self, repos, config):
         super(WSGIApp, self).__init__(repos, config)
+        self.prefixindex = PrefixIndex()
+        self.lagnamn_for = defaultdict(list)
         sfsrepo = [repo for repo in repos if repo.alias == "sfs"]
         if sfsrepo:
             sfsrepo = sfsrepo[0]
@@ -52,9 +57,128 @@ class WSGIApp(OrigWSGIApp):
                 if os.path.exists(distilledpath) and needle in util.readfile(distilledpath):
                     self.paragraflag.append(str(o).lower())
             self.lagnamn = [str(o) for s, o in graph.subject_objects(RDFS.label)]
+            # both kinds of names are used as keys in the prefix index
+            for pred in RDFS.label, DCTERMS.alternate:
+                for s, o in graph.subject_objects(pred):
+                    self.lagnamn_for[str(s)].append(str(o))
             self.lagforkortningar_regex = "|".join(sorted(self.lagforkortningar, key=len, reverse=True))
             
 
+    def query(self, request, options=None):
+        # Autocomplete queries for (the start of) document
+        # identifiers, titles and law names are answered from the
+        # prefix index. Everything else, including references to
+        # parts of documents, is handled by the fulltext index.
+        param = request.args
+        if (param.get("_ac") == "true" and param.get("q") and
+                not [k for k in param if not (k.startswith("_") or k == "q")]):
+            hits = self.prefixindex_lookup(param.get("q"),
+                                           int(param.get("_pageSize", "10")))
+            if hits:
+                return hits
+        return super(WSGIApp, self).query(request, options)
+
+    def prefixindex_lookup(self, q, limit=10):
+        """Returns autocomplete hits for q from the prefix index, or an
+        empty list if q doesn't look like the start of a document
+        identifier or title."""
+        if "§" in q:
+            return []
+        if (hasattr(self, 'lagforkortningar_regex') and
+                re.match(r"(%s) *(\d*\:?\d*)$" % self.lagforkortningar_regex,
+                         q, re.IGNORECASE)):
+            # "TF", "TF 2:" etc are expanded to chapters or sections
+            # by parse_parameters
+            return []
+        # same normalization as parse_parameters, but stricter so
+        # that eg "SFS 2017" isn't changed
+        q = q.lower()
+        q = re.sub(r"\bs\.?\s*(\d)", "s. \\1", q)
+        q = re.sub(r"^prop\.?(\s+|$)", "prop. ", q)
+        if re.match(r"(prop|ds|sou|dir)\b.*:\S+\s+s\b", q):
+            # "prop. 1997/98:44 s" refers to pages of a document
+            return []
+        self.prefixindex_refresh()
+        return self.prefixindex.lookup(q, limit)
+
+    def prefixindex_refresh(self):
+        """Rebuilds the prefix index if the faceted data of any repo has
+        changed since it was built."""
+        signature = tuple(os.path.getmtime(f) if os.path.exists(f) else None
+                          for f in self.prefixindex_files())
+        if signature != self.prefixindex.signature:
+            with util.logtime(self.log.debug,
+                              "ac: Built prefix index (%(elapsed).3f sec)"):
+                # a new object is swapped in, since other threads
+                # might be using the old one
+                prefixindex = PrefixIndex(self.prefixindex_entries())
+                prefixindex.signature = signature
+                self.prefixindex = prefixindex
+
+    def prefixindex_files(self):
+        return [repo.store.resourcepath("toc/faceted_data.json")
+                for repo in self.repos
+                if repo.alias not in self.prefixindex_exclude_repos]
+
+    def prefixindex_entries(self):
+        for repo in self.repos:
+            if repo.alias in self.prefixindex_exclude_repos:
+                continue
+            # use the faceted data as cached by the last toc, instead
+            # of creating or updating it (which requires querying the
+            # triple store) in the middle of a request
+            rows = repo.cached_faceted_data()
+            if rows is None:
+                continue
+            seen = set()
+            for row in rows:
+                if row['uri'] in seen:
+                    continue
+                seen.add(row['uri'])
+                for entry in self.prefixindex_row_entries(repo, row):
+                    yield entry
+
+    def prefixindex_row_entries(self, repo, row):
+        """Returns ``(key, rank, item)`` tuples for a row of faceted data,
+        where item is formatted like the hits of a regular
+        autocomplete query."""
+        url = row['uri']
+        if url.startswith(self.config.url) and 'develurl' in self.config:
+            url = url.replace(self.config.url, self.config.develurl)
+        if repo.alias == "sfs":
+            title = row.get('titel')
+            if not title:
+                return []
+            names = self.lagnamn_for.get(row['uri'], [])
+            item = {'url': url,
+                    'label': title,
+                    'comment': title,
+                    'desc': title}
+            if names:
+                item['comment'] += " (%s)" % ", ".join(names)
+            expired = bool(row.get('upphavandedatum') and
+                           str(row['upphavandedatum'])[:10] <= str(date.today()))
+            if expired:
+                item['role'] = "expired"
+            sfsnr = row['uri'].rsplit("/", 1)[-1]
+            keys = [title, repo._forfattningskey(title), sfsnr,
+                    "SFS " + sfsnr] + names
+            # like boost_repos, prefer current laws over anything else
+            rank = (expired, 0)
+        else:
+            identifier = row.get('dcterms_identifier')
+            title = row.get('dcterms_title')
+            if not identifier:
+                return []
+            item = {'url': url,
+                    'label': identifier,
+                    'comment': "%s: %s" % (identifier, title) if title else identifier,
+                    'desc': (row.get('rpubl_referatrubrik') or title or
+                             identifier)[:self.snippet_length]}
+            keys = [identifier, title]
+            rank = (False, 1)
+        return [(key, rank, item) for key in keys if key]
+
     def parse_parameters(self, request, idx):
         options = super(WSGIApp, self).parse_parameters(request, idx)
         # if Autocomple call, transform q to suitable parameters (find
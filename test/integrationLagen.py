@@ -655,6 +655,15 @@ class TestACExpand(unittest.TestCase):
         self.assertEqual("https://lagen.nu/1998:204#P3",
                          self.wsgiapp.expand_partial_ref("PUL 3"))
 
+    def test_prefixindex(self):
+        hits = self.wsgiapp.prefixindex_lookup("tryckfrihetsf")
+        self.assertEqual("https://lagen.nu/1949:105", hits[0]['url'])
+        self.assertEqual("Tryckfrihetsförordning (1949:105)", hits[0]['label'])
+        self.assertEqual(hits[:1], self.wsgiapp.prefixindex_lookup("SFS 1949:105"))
+        # references to parts of documents are left to the fulltext index
+        self.assertEqual([], self.wsgiapp.prefixindex_lookup("TF 1:"))
+        self.assertEqual([], self.wsgiapp.prefixindex_lookup("3 § tryckfrihetsf"))
+
     def test_prop_start(self):
         self.assertEqual("https://lagen.nu/prop/",
                          self.wsgiapp.expand_partial_ref("prop"))
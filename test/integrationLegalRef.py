@@ -128,6 +128,34 @@ class Avg(TestLegalRef):
         # p.verbose = True
         return self._test_parser(datafile, p)
 
+class CachedLagrum(TestLegalRef):
+    def parametric_test(self,datafile):
+        # parse everything twice with the same parser, the second
+        # time every result should come from the cache and be
+        # identical to the uncached result.
+        p = LegalRef(LegalRef.LAGRUM, cachesize=1000)
+        self._test_parser(datafile, p)
+        first = p.cache_info()
+        p.reset()
+        self._test_parser(datafile, p)
+        second = p.cache_info()
+        self.assertEqual(first.misses, second.misses)
+        self.assertEqual(first.hits + first.misses, second.hits - first.hits)
+
+    def test_bounded(self):
+        p = LegalRef(LegalRef.LAGRUM, cachesize=2)
+        for s in ("3 kap. 2 § brottsbalken", "4 § lagen (1998:204)",
+                  "5 kap. 1 § brottsbalken", "3 kap. 2 § brottsbalken"):
+            p.parse(s, self.minter, self.metadata)
+        self.assertEqual((0, 4, 2, 2), tuple(p.cache_info()))
+        res = p.parse("3 kap. 2 § brottsbalken", self.minter, self.metadata)
+        again = p.parse("3 kap. 2 § brottsbalken", self.minter, self.metadata)
+        self.assertEqual(res, again)
+        self.assertEqual(res[0].uri, again[0].uri)
+        self.assertIsNot(res[0], again[0])
+        self.assertEqual(2, p.cache_info().hits)
+
+
 # Some tests are not simply working right now. Since having testdata
 # and wanted result in the same file makes it tricky to mark tests as
 # expectedFailure, we'll just list them here.
@@ -143,6 +171,13 @@ file_parametrize(Lagrum,"test/files/legalref/SFS",".txt",
                                'sfs-tricky-overgangsbestammelse.txt',
                                'sfs-tricky-uppdelat-lagnamn.txt',
                                'sfs-tricky-vvfs.txt']))
+file_parametrize(CachedLagrum,"test/files/legalref/SFS",".txt",
+                 make_closure(['sfs-tricky-bokstavslista.txt',
+                               'sfs-tricky-eller.txt',
+                               'sfs-tricky-eller-paragrafer-stycke.txt',
+                               'sfs-tricky-overgangsbestammelse.txt',
+                               'sfs-tricky-uppdelat-lagnamn.txt',
+                               'sfs-tricky-vvfs.txt']))
 file_parametrize(KortLagrum, "test/files/legalref/Short",".txt")
 file_parametrize(EnklaLagrum, "test/files/legalref/Simple",".txt")
 file_parametrize(Forarbeten, "test/files/legalref/Regpubl",".txt")
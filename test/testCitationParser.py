@@ -9,10 +9,10 @@ from copy import deepcopy
 # import pkg_resources
 # pkg_resources.resource_listdir('ferenda','res')
 
-from pyparsing import Word, nums
+from pyparsing import Word, nums, Optional, CaselessLiteral, Regex
 
-from ferenda.compat import unittest
-from ferenda.citationparser import CitationParser
+from ferenda.compat import unittest, patch
+from ferenda.citationparser import CitationParser, leading_pattern
 from ferenda.uriformatter import URIFormatter
 from ferenda.elements import (Body, Heading, Paragraph, Footnote,
                               LinkSubject, UnicodeElement, serialize)
@@ -90,6 +90,50 @@ class Main(unittest.TestCase):
         got = serialize(doccopy)
         self.assertEqual(want, got)
 
+    def test_leading_pattern(self):
+        rfc = Optional("[") + "RFC" + Word(nums) + Optional("]")
+        self.assertEqual(r"RFC|\[", leading_pattern(rfc))
+        section = CaselessLiteral("sec.") + Word(nums)
+        self.assertEqual(r"[sS][eE][cC]\.", leading_pattern(section))
+        self.assertEqual("(?:https|http|ftp)",
+                         leading_pattern(ferenda.citationpatterns.url))
+        # grammars that can match the empty string can't be prefiltered
+        self.assertEqual(None, leading_pattern(Optional("RFC")))
+
+    def test_prefilter(self):
+        rfc = ("RFC" + Word(nums).setResultsName("RFC")).setResultsName("RFCRef")
+        doc = ("Doc" + Word(nums).setResultsName("ordinal")).setResultsName("DocRef")
+        cp = CitationParser(rfc, doc)
+        with patch.object(rfc, 'scanString', wraps=rfc.scanString) as rfcscan:
+            with patch.object(doc, 'scanString', wraps=doc.scanString) as docscan:
+                self.assertEqual(["No citations here"],
+                                 cp.parse_string("No citations here"))
+                self.assertEqual(0, rfcscan.call_count)
+                self.assertEqual(0, docscan.call_count)
+                res = cp.parse_string("See RFC 2616 and RFC 7230")
+                self.assertEqual(["See ", "RFC 2616", " and ", "RFC 7230"],
+                                 [x[0] if isinstance(x, tuple) else x for x in res])
+                self.assertEqual(1, rfcscan.call_count)
+                # no remaining fragment contains "Doc"
+                self.assertEqual(0, docscan.call_count)
+        self.assertEqual([], cp.parse_string(""))
+
+    def test_prefilter_groups(self):
+        def texts(res):
+            return [x[0] if isinstance(x, tuple) else x for x in res]
+        # grammars may use the same group names
+        cp = CitationParser(Regex(r"(?P<num>\d+) kap"), Regex(r"(?P<num>\d+) §"))
+        self.assertEqual(["se ", "3 kap", " och ", "4 §"],
+                         texts(cp.parse_string("se 3 kap och 4 §")))
+        # backreferences must still refer to the right group, both
+        # within a grammar and between grammars
+        grammar = Regex(r"(\d)x") | Regex(r"(\w)\1")
+        self.assertIsNone(leading_pattern(grammar))
+        for cp in (CitationParser(grammar),
+                   CitationParser(Regex(r"(\d)x"), Regex(r"(\w)\1"))):
+            self.assertEqual(["f", "oo", " ", "aa", " bar"],
+                             texts(cp.parse_string("foo aa bar")))
+
         
 import doctest
 from ferenda import citationparser
@@ -11,6 +11,7 @@ import copy
 import doctest
 import os
 import shutil
+import tempfile
 import time
 import unicodedata
 
@@ -213,14 +214,122 @@ class Repo(RepoTester):
         d.document_url_template = None
         with self.assertRaises(ValueError):
             d.download("123/a")
-        
-        
+
+    def test_download_concurrent(self):
+        d = DocumentRepository(loglevel='CRITICAL', datadir=self.datadir,
+                               downloadworkers=3)
+        d.start_url = "http://localhost/fake/url"
+        mockresponse = Mock()
+        with open("%s/files/base/downloaded/index.htm" %
+                  os.path.dirname(__file__)) as fp:
+            mockresponse.text = fp.read()
+
+        import threading
+        threads = set()
+        def download_single(basefile, url):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.05)
+            return basefile != "123/b"
+        d.download_single = Mock(side_effect=download_single)
+        reporter = Mock()
+        with patch.object(d.session, 'get', return_value=mockresponse):
+            self.assertTrue(d.download(reporter=reporter))
+        self.assertEqual(d.download_single.call_count, 3)
+        self.assertNotIn(threading.current_thread().name, threads)
+        # the reporter is still called in document order
+        self.assertEqual([call("123/a"), call("123/b"), call("124/a")],
+                         reporter.call_args_list)
+
+        # errors are re-raised in the calling thread
+        d.download_single = Mock(side_effect=requests.exceptions.HTTPError(
+            response=Mock(status_code=500)))
+        with patch.object(d.session, 'get', return_value=mockresponse):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                d.download()
+
+    def test_download_hostlimit(self):
+        d = DocumentRepository(loglevel='CRITICAL', datadir=self.datadir,
+                               downloadhostlimit=1, downloaddelay=0.1)
+        mockresponse = Mock(headers={}, status_code=200,
+                            **{'iter_content.return_value': [b"hello"]})
+        starts = []
+        def get(url, **kwargs):
+            starts.append(time.time())
+            return mockresponse
+        with patch.object(d.session, 'get', side_effect=get):
+            d.download_if_needed("http://example.org/1", "1")
+            d.download_if_needed("http://example.org/2", "2")
+        self.assertGreaterEqual(starts[1] - starts[0], 0.09)
+
+    def test_download_checksum(self):
+        d = DocumentRepository(loglevel='CRITICAL', datadir=self.datadir,
+                               conditionalget=False)
+        chunks = [b"hello ", b"world"]
+        def get(url, **kwargs):
+            self.assertTrue(kwargs['stream'])
+            return Mock(headers={}, status_code=200,
+                        **{'iter_content.return_value': chunks})
+        entrypath = d.store.documententry_path("1")
+        with patch.object(d.session, 'get', side_effect=get):
+            self.assertTrue(d.download_if_needed("http://example.org/1", "1"))
+            self.assertEqual("hello world",
+                             util.readfile(d.store.downloaded_path("1")))
+            self.assertEqual({'1.html': 'md5:5eb63bbbe01eeed093cb22bb8f5acdc3'},
+                             DocumentEntry(entrypath).orig_checksums)
+            # an identical file is never considered different, and
+            # the existing file isn't even read
+            with patch.object(d, 'download_is_different', return_value=True) as diff, \
+                    patch('ferenda.util._file_md5') as file_md5:
+                self.assertFalse(d.download_if_needed("http://example.org/1", "1"))
+            self.assertFalse(diff.called)
+            self.assertFalse(file_md5.called)
+            chunks = [b"hello ", b"there"]
+            self.assertTrue(d.download_if_needed("http://example.org/1", "1"))
+            self.assertEqual({'1.html': 'md5:161bc25962da8fed6d2f59922fb642aa'},
+                             DocumentEntry(entrypath).orig_checksums)
+
+    def test_download_interrupted(self):
+        d = DocumentRepository(loglevel='CRITICAL', datadir=self.datadir,
+                               conditionalget=False)
+        failures = [requests.exceptions.ChunkedEncodingError("connection broken"),
+                    requests.exceptions.ConnectionError("read timed out")]
+        def iter_content(chunk_size):
+            yield b"hello "
+            if failures:
+                raise failures.pop(0)
+            yield b"world"
+        def get(url, **kwargs):
+            return Mock(headers={}, status_code=200,
+                        **{'iter_content.side_effect': iter_content})
+        tmpfiles = []
+        def mkstemp():
+            fileno, tmpfile = tempfile.mkstemp()
+            tmpfiles.append(tmpfile)
+            return fileno, tmpfile
+        with patch.object(d.session, 'get', side_effect=get) as mock_get, \
+                patch('ferenda.documentrepository.mkstemp', side_effect=mkstemp):
+            # the whole request is retried if reading the body fails
+            self.assertTrue(d.download_if_needed("http://example.org/1", "1", sleep=0))
+            self.assertEqual(3, mock_get.call_count)
+            self.assertEqual("hello world",
+                             util.readfile(d.store.downloaded_path("1")))
+            # if it keeps failing, the error is raised, and the
+            # temporary file is removed
+            failures.extend([requests.exceptions.ChunkedEncodingError()] * 5)
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                d.download_if_needed("http://example.org/2", "2", sleep=0)
+            self.assertEqual(8, mock_get.call_count)
+        self.assertFalse(os.path.exists(d.store.downloaded_path("2")))
+        self.assertFalse(any(os.path.exists(f) for f in tmpfiles))
+
+
     def test_download_single(self):
         url_location = None # The local location of the URL. 
         def my_get(url,**kwargs):
             res = Mock()
             with open(url_location,"rb") as fp:
                 res.content = fp.read()
+            res.iter_content.return_value = [res.content]
             res.headers = collections.defaultdict(lambda:None)
             res.headers['X-These-Headers-Are'] = 'Faked'
             res.status_code = 200
@@ -295,7 +404,7 @@ class Repo(RepoTester):
 
     # @patch('requests.get')
     def test_download_if_needed(self):
-        def my_get(url,headers, timeout=None):
+        def my_get(url,headers, timeout=None, stream=False):
             # observes the scoped variables "last_modified" (should
             # contain a formatted date string according to HTTP rules)
             # and "etag" (opaque string).
@@ -339,6 +448,7 @@ class Repo(RepoTester):
                     resp.raise_for_status.side_effect = requests.exceptions.HTTPError
                     resp.content = b'<h1>404 not found</h1>'
             resp.content = content
+            resp.iter_content.return_value = [content] if content else []
             resp.headers = headers
             return resp
 
@@ -963,6 +1073,43 @@ class Repo(RepoTester):
         self.assertEqual(2,
                          len(list(util.list_dirs(self.datadir, '.txt'))))
 
+    def test_distilled_graph(self):
+        with self.repo.store.open_distilled('root', 'wb') as fp:
+            fp.write(self.test_rdf_xml)
+        want = rdflib.Graph().parse(data=self.test_rdf_xml)
+        # 1. with no cache, the distilled RDF/XML is parsed
+        self.assertEqualGraphs(want, self.repo.distilled_graph('root'))
+        self.repo.config.parsedcache = True
+        try:
+            # 2. a fresh cache is used instead of parsing RDF/XML
+            self.repo.cache_distilled_graph('root', want)
+            cachepath = self.repo.store.parsedcache_path('root')
+            self.assertTrue(os.path.exists(cachepath))
+            with patch('ferenda.documentrepository.Graph.parse') as mock:
+                got = self.repo.distilled_graph('root')
+            self.assertFalse(mock.called)
+            self.assertEqualGraphs(want, got)
+            self.assertEqual("http://purl.org/ontology/bibo/",
+                             str(dict(got.namespaces())['bibo']))
+
+            # 3. a cache that is older than the RDF/XML file is ignored
+            with self.repo.store.open_distilled('root', 'wb') as fp:
+                fp.write(self.test_rdf_xml.replace(b"res-a", b"res-c"))
+            mtime = os.stat(cachepath).st_mtime
+            os.utime(self.repo.store.distilled_path('root'), (mtime + 1, mtime + 1))
+            got = self.repo.distilled_graph('root')
+            self.assertIn("res-c", got.serialize(format="nt").decode("utf-8"))
+
+            # 4. an unreadable cache is ignored
+            util.writefile(cachepath, "this is not a pickle")
+            os.utime(cachepath, (mtime + 2, mtime + 2))
+            with patch.object(self.repo.log, 'warning') as warning:
+                got = self.repo.distilled_graph('root')
+            self.assertTrue(warning.called)
+            self.assertIn("res-c", got.serialize(format="nt").decode("utf-8"))
+        finally:
+            self.repo.config.parsedcache = False
+
     def test_tabs(self):
         # base test - if using rdftype of foaf:Document, in that case
         # we'll use .alias
@@ -1259,6 +1406,85 @@ class Generate(RepoTester):
         self.assertEqual('A2(part2)',
                          annotations[0].text)
 
+    def test_generated_nocache(self):
+        # the annotations should be passed to the transform in-memory
+        # and end up in the generated file, without being written to
+        # disk.
+        self.repo.config.annotationcache = False
+        self.test_generated()
+        self.assertFalse(os.path.exists(self.repo.store.annotation_path("1")))
+
+    def test_prefetch_annotations(self):
+        g = rdflib.Graph()
+        g.parse("test/files/datasets/repo_a.ttl", format="turtle")
+        g.parse("test/files/datasets/repo_b.ttl", format="turtle")
+        for basefile in ("1", "2"):
+            util.writefile(self.repo.store.parsed_path(basefile), "<html/>")
+        store = Mock(**{'select.side_effect':
+                        lambda q, format: g.query(q).serialize(format="xml")})
+        self.repo.config.annotationbatch = 10
+        with patch('ferenda.documentrepository.TripleStore.connect',
+                   return_value=store):
+            self.assertEqual(2, self.repo.prefetch_annotations())
+        # all annotations should have been fetched with a single query
+        self.assertEqual(1, store.select.call_count)
+        for basefile in ("1", "2"):
+            uri = self.repo.canonical_uri(basefile)
+            want = g.query(self.repo.construct_sparql_query(uri)).graph
+            got = self.repo.annotation_file_to_graph(
+                self.repo.store.annotation_path(basefile))
+            self.assertEqualGraphs(want, got)
+        # now that the annotation files are up to date, nothing
+        # needs to be fetched
+        self.assertEqual(0, self.repo.prefetch_annotations())
+
+    def test_prefetch_annotations_unbatchable(self):
+        # this query uses the document URI within a string literal,
+        # which can't be replaced with a variable
+        queryfile = self.datadir + os.sep + "myquery.rq"
+        util.writefile(queryfile, """PREFIX dcterms: <http://purl.org/dc/terms/>
+CONSTRUCT { ?s ?p ?o } WHERE {
+  ?s ?p ?o .
+  FILTER(STRSTARTS(STR(?s), "%(uri)s#"))
+}""")
+        self.repo.sparql_annotations = queryfile
+        self.assertIsNone(self.repo.construct_annotations_batch(
+            [self.repo.canonical_uri("1")]))
+
+    def test_construct_annotations_batch_remote(self):
+        # a large batch of URIs must not result in a GET url that is
+        # too long for the triple store server
+        g = rdflib.Graph()
+        g.parse("test/files/datasets/repo_a.ttl", format="turtle")
+        g.parse("test/files/datasets/repo_b.ttl", format="turtle")
+
+        def respond(url, headers, data):
+            query = data['query'] if isinstance(data, dict) else data
+            return Mock(status_code=200,
+                        content=g.query(query).serialize(format="xml"))
+        self.repo.config.storetype = "SESAME"
+        self.repo.config.storelocation = "http://localhost:8080/openrdf-sesame"
+        self.repo.config.storerepository = "ferenda"
+        uris = [self.repo.canonical_uri(str(i)) for i in range(1, 500)]
+        with patch('requests.get', side_effect=respond) as mock_get:
+            with patch('requests.post', side_effect=respond) as mock_post:
+                graphs = self.repo.construct_annotations_batch(uris[:2])
+                self.assertEqual(1, mock_get.call_count)
+                self.assertEqual(0, mock_post.call_count)
+                self.assertTrue(len(graphs[uris[0]]))
+
+                graphs = self.repo.construct_annotations_batch(uris)
+                self.assertEqual(1, mock_get.call_count)
+                self.assertEqual(1, mock_post.call_count)
+                url = mock_post.call_args[0][0]
+                self.assertNotIn("?query=", url)
+                self.assertIn("<%s>" % uris[-1],
+                              mock_post.call_args[1]['data']['query'])
+                self.assertEqual(len(uris), len(graphs))
+                self.assertTrue(len(graphs[uris[0]]))
+        store = self.repo._get_triplestore()
+        self.assertLessEqual(len(mock_get.call_args[0][0]), store.max_url_length)
+
     def _generate_complex(self, xsl=None, sparql=None, staticsite=False):
         # Helper func for other tests -- this uses a single
         # semi-complex source doc, runs it through the generic.xsl
@@ -1821,6 +2047,7 @@ class Archive(RepoTester):
             res = Mock()
             with open(self.url_location,"rb") as fp:
                 res.content = fp.read()
+            res.iter_content.return_value = [res.content]
             res.headers = collections.defaultdict(lambda:None)
             res.headers['X-These-Headers-Are'] = 'Faked'
             res.status_code = 200
@@ -11,10 +11,11 @@ import time
 from datetime import datetime, timedelta
 from zipfile import ZipFile
 
-from ferenda.compat import unittest
+from ferenda.compat import unittest, patch
 
 #SUT
 from ferenda import DocumentStore, DocumentEntry
+from ferenda.documentstore import HashManifest
 from ferenda import util
 from ferenda.errors import *
 
@@ -399,6 +400,180 @@ class XzCompression(Compression):
     
 
 
+class Manifest(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.store = DocumentStore(self.datadir)
+        self.manifestfile = self.datadir + os.sep + "hashmanifest.txt"
+        self.store.hashmanifest = HashManifest(self.manifestfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def _write(self, data):
+        with self.store.open_parsed("123/a", "wb") as fp:
+            fp.write(data)
+
+    def test_unchanged(self):
+        self._write(b"This is the data")
+        self.assertTrue(os.path.exists(self.manifestfile))
+        self.assertEqual(0, self.store.hashmanifest.files_skipped)
+        with patch('ferenda.documentstore.filecmp.cmp') as mock_cmp:
+            self._write(b"This is the data")
+        self.assertFalse(mock_cmp.called)
+        self.assertEqual(1, self.store.hashmanifest.files_skipped)
+        self.assertEqual(16, self.store.hashmanifest.bytes_avoided)
+
+        # the manifest is persistent
+        self.store.hashmanifest = HashManifest(self.manifestfile)
+        with patch('ferenda.documentstore.filecmp.cmp') as mock_cmp:
+            self._write(b"This is the data")
+        self.assertFalse(mock_cmp.called)
+        self.assertEqual(1, self.store.hashmanifest.files_skipped)
+
+    def test_changed(self):
+        self._write(b"This is the data")
+        self._write(b"This is the new data")
+        self.assertEqual(0, self.store.hashmanifest.files_skipped)
+        self.assertEqual(b"This is the new data",
+                         util.readfile(self.store.parsed_path("123/a"), "rb"))
+
+    def test_modified_outside(self):
+        # if the file has been modified by other means, the recorded
+        # hash can't be trusted
+        self._write(b"This is the data")
+        path = self.store.parsed_path("123/a")
+        util.writefile(path, "Something else entirely")
+        os.utime(path, (time.time() + 2, time.time() + 2))
+        self._write(b"This is the data")
+        self.assertEqual(0, self.store.hashmanifest.files_skipped)
+        self.assertEqual("This is the data", util.readfile(path))
+        self._write(b"This is the data")
+        self.assertEqual(1, self.store.hashmanifest.files_skipped)
+
+    def test_textmode(self):
+        # files opened in text mode aren't hashed
+        with self.store.open_parsed("123/a", "w") as fp:
+            fp.write("This is the data")
+        self.assertFalse(os.path.exists(self.manifestfile))
+
+    def test_copy_if_different(self):
+        src = self.datadir + os.sep + "src.txt"
+        dst = self.datadir + os.sep + "dst.txt"
+        util.writefile(src, "This is the data")
+        manifest = self.store.hashmanifest
+        # a new or previously copied file is never read to be hashed
+        with patch('ferenda.util._file_md5') as mock_md5:
+            self.assertTrue(util.copy_if_different(src, dst, hashmanifest=manifest))
+            self.assertFalse(util.copy_if_different(src, dst, hashmanifest=manifest))
+        self.assertFalse(mock_md5.called)
+        # same content but a different mtime: compared once, then by hash
+        os.utime(src, (os.path.getmtime(dst) + 10,) * 2)
+        self.assertFalse(util.copy_if_different(src, dst, hashmanifest=manifest))
+        with patch('ferenda.util.filecmp.cmp') as mock_cmp:
+            self.assertFalse(util.copy_if_different(src, dst, hashmanifest=manifest))
+        self.assertFalse(mock_cmp.called)
+        util.writefile(src, "This is the new data")
+        self.assertTrue(util.copy_if_different(src, dst, hashmanifest=manifest))
+        self.assertEqual("This is the new data", util.readfile(dst))
+        self.assertEqual(1, manifest.files_skipped)
+
+
+class BlobArchive(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.store = DocumentStore(self.datadir, archiving_policy="blob")
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def _archive(self, basefile, version, data, parsed=None):
+        util.writefile(self.store.downloaded_path(basefile), data)
+        if parsed:
+            util.writefile(self.store.parsed_path(basefile), parsed)
+        self.store.archive(basefile, version)
+
+    def test_archive(self):
+        self._archive("123/a", "1", "This is the data", "Parsed")
+        self._archive("123/a", "2", "This is the data", "Parsed again")
+        self._archive("123/a", "10", "This is new data")
+        self._archive("123/b", "1", "This is the data")
+        # archived files are at the usual place
+        path1 = self.store.downloaded_path("123/a", version="1")
+        path2 = self.store.downloaded_path("123/a", version="2")
+        self.assertEqual(self.datadir + "/archive/downloaded/123/a/.versions/1.html",
+                         path1.replace(os.sep, "/"))
+        self.assertEqual("This is the data", util.readfile(path2))
+        # but identical files share storage
+        self.assertTrue(os.path.samefile(path1, path2))
+        self.assertTrue(os.path.samefile(
+            path1, self.store.downloaded_path("123/b", version="1")))
+        self.assertFalse(os.path.samefile(
+            path1, self.store.downloaded_path("123/a", version="10")))
+        self.assertFalse(os.path.samefile(
+            self.store.parsed_path("123/a", version="1"),
+            self.store.parsed_path("123/a", version="2")))
+        # versions are listed without walking the archive
+        with patch('ferenda.documentstore.util.list_dirs') as mock_list_dirs:
+            self.assertEqual(["1", "2", "10"],
+                             list(self.store.list_versions("123/a")))
+            self.assertEqual(["1", "2"],
+                             list(self.store.list_versions("123/a", "parsed")))
+            self.assertEqual([], list(self.store.list_versions("123")))
+        self.assertFalse(mock_list_dirs.called)
+
+    def test_rewrite_version(self):
+        for version in "1", "2":
+            util.writefile(self.store.downloaded_path("123/a"), "This is the data")
+            util.writefile(self.store.generated_path("123/a"), "Generated")
+            self.store.archive("123/a", version)
+        gen1 = self.store.generated_path("123/a", version="1")
+        gen2 = self.store.generated_path("123/a", version="2")
+        mtime = os.path.getmtime(gen2)
+        # like Transformer.native_to_file does when generating an
+        # archived version
+        with open(gen1, "wb") as fp:
+            fp.write(b"Generated again")
+        os.utime(gen1, (mtime + 10, mtime + 10))
+        self.assertEqual("Generated", util.readfile(gen2))
+        self.assertEqual(mtime, os.path.getmtime(gen2))
+        # files linked by earlier versions are unlinked
+        os.unlink(gen1)
+        os.link(gen2, gen1)
+        self.store.deduplicate_archive()
+        self.assertFalse(os.path.samefile(gen1, gen2))
+        self.assertEqual("Generated", util.readfile(gen1))
+        self.assertTrue(os.path.samefile(
+            self.store.downloaded_path("123/a", version="1"),
+            self.store.downloaded_path("123/a", version="2")))
+
+    def test_existing_archive(self):
+        # an archive created with the file archiving policy is indexed
+        # the first time it's needed, and can be deduplicated later
+        store = DocumentStore(self.datadir)
+        for version in "1", "2":
+            util.writefile(store.downloaded_path("123/a"), "This is the data")
+            store.archive("123/a", version)
+        self.assertEqual(["1", "2"], list(self.store.list_versions("123/a")))
+        self._archive("123/a", "3", "This is the data")
+        self.assertEqual(["1", "2", "3"], list(self.store.list_versions("123/a")))
+        path1 = self.store.downloaded_path("123/a", version="1")
+        path2 = self.store.downloaded_path("123/a", version="2")
+        self.assertFalse(os.path.samefile(path1, path2))
+        self.assertEqual(32, self.store.deduplicate_archive())
+        self.assertTrue(os.path.samefile(path1, path2))
+        self.assertTrue(os.path.samefile(
+            path1, self.store.downloaded_path("123/a", version="3")))
+        self.assertEqual(["1", "2", "3"], list(self.store.list_versions("123/a")))
+
+        # unused blobs are removed
+        util.robust_remove(self.datadir + "/archive/downloaded/123/a/.versions")
+        self.store.deduplicate_archive()
+        self.assertEqual([], os.listdir(self.datadir + "/archive/.blobs/" +
+                                        os.listdir(self.datadir + "/archive/.blobs")[0]))
+        self.assertEqual([], list(self.store.list_versions("123/a")))
+
+
 class Needed(unittest.TestCase):
     def setUp(self):
         self.datadir = tempfile.mkdtemp()
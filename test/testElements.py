@@ -531,6 +531,37 @@ class AsXHTML(unittest.TestCase, FerendaTestCase):
 </body>"""
         self._test_asxhtml(want, body)
 
+    def test_attributes(self):
+        # xhtml attributes can come from instance attributes, plain
+        # class attributes or properties, and must be rendered the
+        # same way regardless
+        class Note(el.CompoundElement):
+            tagname = "aside"
+            role = "note"
+            style = None
+
+            @property
+            def dir(self):
+                return "rtl" if self.lang == "ar" else None
+
+        class Remark(el.CompoundElement):
+            pass
+
+        body = el.Body([Note(['First'], lang="ar"),
+                        Note(['Second'], lang="sv", style="color: red",
+                             role="doc-note"),
+                        Remark([el.UnicodeElement('Third\x07\x1b', id="r1")],
+                               title="Not an xhtml attribute")])
+        want = """
+<body xmlns="http://www.w3.org/1999/xhtml"
+      about="http://localhost:8000/res/base/basefile">
+  <aside dir="rtl" lang="ar" role="note">First</aside>
+  <aside lang="sv" role="doc-note" style="color: red">Second</aside>
+  <remark><unicodeelement id="r1">Third</unicodeelement></remark>
+</body>
+"""
+        self._test_asxhtml(want, body)
+
     def test_malformed(self):
         # Test 5: Illegal indata (raw ESC character in string)
         body = el.Body(['Toplevel\x1b heading'])
@@ -358,4 +358,32 @@ class Parse(unittest.TestCase):
             self.run_test_file("test/files/fsmparser/basic.txt", debug=True)
             self.assertTrue(printmock.called)
 
+    def test_profile(self):
+        with patch.dict(os.environ, {'FERENDA_FSMPROFILE': '1'}):
+            p, b = self.run_test_file("test/files/fsmparser/basic.txt")
+        self.assertTrue(p.profile)
+        stats = dict((k.__name__, v) for k, v in p.profiledata.items())
+        # is_paragraph is the last recognizer tried in the body state,
+        # and it matches every paragraph in basic.txt
+        calls, hits, elapsed = stats['is_paragraph']
+        self.assertEqual(calls, hits)
+        self.assertEqual(len(b), hits)
+        # is_header has no transitions, so it should never be tried
+        self.assertNotIn('is_header', stats)
+        self.assertIn('is_paragraph', p.profile_report())
+
+    def test_applicable_recognizers(self):
+        def is_a(parser): return True
+        def is_b(parser): return True
+        def is_c(parser): return True
+        p = FSMParser()
+        p.set_recognizers(is_a, is_b, is_c)
+        p.set_transitions({("body", is_c): (False, None),
+                           ("body", is_a): (False, None),
+                           ("other", is_b): (False, None)})
+        self.assertEqual((is_a, is_c), p.applicable_recognizers("body"))
+        self.assertEqual((is_b,), p.applicable_recognizers("other"))
+        p.remove_recognizer(is_a)
+        self.assertEqual((is_c,), p.applicable_recognizers("body"))
+
 file_parametrize(Parse,"test/files/fsmparser",".txt")
@@ -3,6 +3,7 @@ from __future__ import (absolute_import, division,
                         print_function, unicode_literals)
 from builtins import *
 
+from datetime import datetime
 import os
 
 import doctest
@@ -10,6 +11,7 @@ import rdflib
 
 from ferenda.compat import patch
 from ferenda.testutil import RepoTester
+from ferenda import util, DocumentEntry
 
 # SUT
 from ferenda import Facet
@@ -65,6 +67,101 @@ WHERE {
             faceted_data = self.repo.faceted_data()
         self.assertEqual(faceted_data, canned)
 
+    def test_cached_faceted_data(self):
+        util.robust_remove(self.datadir + "/base/toc/faceted_data.json")
+        self.assertIsNone(self.repo.cached_faceted_data())
+        canned = [{"uri": "http://example.org/books/A_Tale_of_Two_Cities",
+                   "dcterms_title": "A Tale of Two Cities"}]
+        with patch('ferenda.DocumentRepository.facet_select', return_value=canned):
+            self.repo.faceted_data()
+        # the cache is used as is, even if the triple store dump is newer
+        util.writefile(self.repo.store.resourcepath("distilled/dump.nt"), "")
+        cachetime = os.path.getmtime(self.datadir + "/base/toc/faceted_data.json")
+        os.utime(self.repo.store.resourcepath("distilled/dump.nt"),
+                 (cachetime + 10, cachetime + 10))
+        with patch('ferenda.DocumentRepository.facet_select') as mock:
+            self.assertEqual(canned, self.repo.cached_faceted_data())
+        self.assertFalse(mock.called)
+        util.robust_remove(self.repo.store.resourcepath("distilled/dump.nt"))
+        util.robust_remove(self.datadir + "/base/toc/faceted_data.json")
+
+    def test_faceted_data_incremental(self):
+        util.robust_remove(self.datadir + "/base/toc/faceted_data.json")
+        titles = {}
+        for basefile in "1", "2", "3", "4", "5":
+            titles[self.repo.canonical_uri(basefile)] = "Document %s" % basefile
+            g = rdflib.Graph()
+            g.add((rdflib.URIRef(self.repo.canonical_uri(basefile)),
+                   rdflib.URIRef("http://purl.org/dc/terms/title"), rdflib.Literal("Document %s" % basefile)))
+            util.writefile(self.repo.store.distilled_path(basefile),
+                           g.serialize(format="xml").decode("utf-8"))
+        util.writefile(self.repo.store.resourcepath("distilled/dump.nt"), "")
+
+        def select(query):
+            return [{'uri': uri, 'dcterms_title': title}
+                    for uri, title in sorted(titles.items())
+                    if "VALUES" not in query or "<%s>" % uri in query]
+
+        with patch('ferenda.DocumentRepository.facet_select', side_effect=select) as mock:
+            self.assertEqual(5, len(self.repo.faceted_data()))
+        self.assertEqual(1, mock.call_count)
+        self.assertNotIn("VALUES", mock.call_args[0][0])
+
+        # change document 2 and remove document 3 after the cache
+        # was created
+        cachetime = os.path.getmtime(self.datadir + "/base/toc/faceted_data.json")
+        for path in (self.repo.store.distilled_path("2"),
+                     self.repo.store.resourcepath("distilled/dump.nt")):
+            os.utime(path, (cachetime + 10, cachetime + 10))
+        util.robust_remove(self.repo.store.distilled_path("3"))
+        titles[self.repo.canonical_uri("2")] = "Document 2 (changed)"
+        del titles[self.repo.canonical_uri("3")]
+        with patch('ferenda.DocumentRepository.facet_select', side_effect=select) as mock:
+            faceted_data = self.repo.faceted_data()
+        self.assertEqual(1, mock.call_count)
+        self.assertIn("VALUES ?uri { <%s> }" % self.repo.canonical_uri("2"),
+                      mock.call_args[0][0])
+        self.assertEqual(select(""), sorted(faceted_data, key=lambda r: r['uri']))
+        util.robust_remove(self.datadir + "/base/toc/faceted_data.json")
+
+    def test_faceted_data_related_later(self):
+        # a document that was distilled before the cache was created,
+        # but related after it, must be selected anew
+        util.robust_remove(self.datadir + "/base/toc/faceted_data.json")
+        titles = {}
+        for basefile in "1", "2", "3":
+            g = rdflib.Graph()
+            g.add((rdflib.URIRef(self.repo.canonical_uri(basefile)),
+                   rdflib.URIRef("http://purl.org/dc/terms/title"), rdflib.Literal("Document %s" % basefile)))
+            util.writefile(self.repo.store.distilled_path(basefile),
+                           g.serialize(format="xml").decode("utf-8"))
+        util.writefile(self.repo.store.resourcepath("distilled/dump.nt"), "")
+        for basefile in "1", "2":
+            titles[self.repo.canonical_uri(basefile)] = "Document %s" % basefile
+
+        def select(query):
+            return [{'uri': uri, 'dcterms_title': title}
+                    for uri, title in sorted(titles.items())
+                    if "VALUES" not in query or "<%s>" % uri in query]
+
+        with patch('ferenda.DocumentRepository.facet_select', side_effect=select):
+            self.assertEqual(2, len(self.repo.faceted_data()))
+
+        cachetime = os.path.getmtime(self.datadir + "/base/toc/faceted_data.json")
+        entry = DocumentEntry(self.repo.store.documententry_path("3"))
+        entry.indexed_ts = datetime.fromtimestamp(cachetime + 10)
+        entry.save()
+        os.utime(self.repo.store.resourcepath("distilled/dump.nt"),
+                 (cachetime + 10, cachetime + 10))
+        titles[self.repo.canonical_uri("3")] = "Document 3"
+        with patch('ferenda.DocumentRepository.facet_select', side_effect=select) as mock:
+            faceted_data = self.repo.faceted_data()
+        self.assertEqual(1, mock.call_count)
+        self.assertIn("VALUES ?uri { <%s> }" % self.repo.canonical_uri("3"),
+                      mock.call_args[0][0])
+        self.assertEqual(select(""), sorted(faceted_data, key=lambda r: r['uri']))
+        util.robust_remove(self.datadir + "/base/toc/faceted_data.json")
+
     def test_year(self):
         self.assertEqual('2014',
                          Facet.year({'dcterms_issued': '2014-06-05T12:00:00'}))
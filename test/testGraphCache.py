@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+
+import os
+import shutil
+import tempfile
+
+from rdflib import Graph, URIRef, Literal
+from rdflib.namespace import FOAF
+
+from ferenda.compat import unittest, patch
+from ferenda import DocumentRepository, util
+# SUT
+from ferenda import graphcache
+
+
+class GraphCache(unittest.TestCase):
+    turtle = """@prefix foaf: <http://xmlns.com/foaf/0.1/> .
+<http://example.org/a> foaf:name "A" .
+<http://example.org/b> foaf:name "B" .
+"""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = self.tempdir + "/res/extra/base.ttl"
+        util.writefile(self.filename, self.turtle)
+        graphcache.clear()
+
+    def tearDown(self):
+        graphcache.clear()
+        shutil.rmtree(self.tempdir)
+
+    def test_parse(self):
+        with patch("ferenda.graphcache.Graph.parse", side_effect=Graph.parse,
+                   autospec=True) as mockparse:
+            g1 = graphcache.parse(self.filename)
+            g2 = graphcache.parse(self.filename)
+        self.assertEqual(1, mockparse.call_count)
+        self.assertEqual(2, len(g1))
+        self.assertEqual(Literal("A"), g2.value(URIRef("http://example.org/a"), FOAF.name))
+        # graphs are independent copies
+        g1.add((URIRef("http://example.org/c"), FOAF.name, Literal("C")))
+        self.assertEqual(2, len(g2))
+        self.assertEqual(2, len(graphcache.parse(self.filename)))
+        # a modified file is re-parsed
+        util.writefile(self.filename, self.turtle + '<http://example.org/c> foaf:name "C" .\n')
+        os.utime(self.filename, (0, 0))
+        self.assertEqual(3, len(graphcache.parse(self.filename)))
+
+    def test_cachedir(self):
+        cachedir = self.tempdir + "/graphcache"
+        self.assertEqual(2, graphcache.preload([self.filename], cachedir=cachedir))
+        self.assertEqual(1, len(os.listdir(cachedir)))
+        # simulate a new process
+        graphcache.clear()
+        with patch("ferenda.graphcache.Graph.parse") as mockparse:
+            g = graphcache.parse(self.filename, cachedir=cachedir)
+        self.assertFalse(mockparse.called)
+        self.assertEqual(2, len(g))
+        self.assertEqual("http://xmlns.com/foaf/0.1/",
+                         str(dict(g.namespaces())["foaf"]))
+
+    def test_commondata(self):
+        repo = DocumentRepository(datadir=self.tempdir + "/data",
+                                  loadpath=[self.tempdir + "/res"],
+                                  graphcache=True)
+        self.assertEqual(2, len(repo.commondata))
+        self.assertTrue(os.path.exists(self.tempdir + "/data/graphcache"))
+        other = DocumentRepository(datadir=self.tempdir + "/data",
+                                   loadpath=[self.tempdir + "/res"])
+        with patch("ferenda.graphcache.Graph.parse") as mockparse:
+            self.assertEqual(2, len(other.commondata))
+        self.assertFalse(mockparse.called)
+        self.assertIsNot(repo.commondata, other.commondata)
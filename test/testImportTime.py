@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+
+import os
+import subprocess
+import sys
+
+from ferenda.compat import unittest
+
+import ferenda
+
+
+def importtime(modulename):
+    """Imports *modulename* in a new interpreter, and returns the
+    output of ``-X importtime`` as a list of ``(self, cumulative,
+    name)`` tuples (times in microseconds), in import order."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(ferenda.__file__))] +
+        [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+    output = subprocess.check_output(
+        [sys.executable, "-W", "ignore", "-X", "importtime", "-c",
+         "import %s" % modulename],
+        stderr=subprocess.STDOUT, env=env).decode("utf-8")
+    res = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        selftime, cumulative, name = line[len("import time:"):].split("|")
+        if selftime.strip().isdigit():
+            res.append((int(selftime), int(cumulative), name.rstrip()))
+    return res
+
+
+def report(times, count=20):
+    """Formats the *count* slowest imports in *times*."""
+    return "\n".join("%8.1f ms %s" % (cumulative / 1000, name)
+                     for (selftime, cumulative, name)
+                     in sorted(times, key=lambda t: t[1], reverse=True)[:count])
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "-X importtime requires python 3.7")
+class ImportTime(unittest.TestCase):
+    # modules that are only needed by some commands, and that are
+    # therefore imported only when needed.
+    lazy = ("whoosh", "jinja2", "rdflib.plugins.sparql", "matplotlib", "grako")
+
+    def assertNotImported(self, modulename, times):
+        imported = set(name.strip() for (selftime, cumulative, name) in times)
+        for lazy in self.lazy:
+            self.assertFalse(lazy in imported,
+                             "%s imports %s. Slowest imports:\n%s" %
+                             (modulename, lazy, report(times)))
+
+    def test_manager(self):
+        # this is what every ferenda-build.py invocation imports
+        self.assertNotImported("ferenda.manager", importtime("ferenda.manager"))
+
+    def test_fulltextindex(self):
+        self.assertNotImported("ferenda.fulltextindex",
+                               importtime("ferenda.fulltextindex"))
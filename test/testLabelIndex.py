@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+
+import difflib
+import shutil
+import tempfile
+
+from rdflib import Graph, URIRef, Literal
+from rdflib.namespace import FOAF, SKOS
+
+from ferenda.compat import unittest, patch
+from ferenda import DocumentRepository
+# SUT
+from ferenda.labelindex import LabelIndex
+
+
+class Index(unittest.TestCase):
+    labels = ["Naturvårdsverket", "Socialstyrelsen", "Skatteverket",
+              "Skolverket", "Riksdagen", "Regeringskansliet", "JK"]
+
+    def setUp(self):
+        self.graph = Graph()
+        for idx, label in enumerate(self.labels):
+            self.graph.add((URIRef("http://example.org/%s" % idx),
+                            FOAF.name, Literal(label, lang="sv")))
+        self.graph.add((URIRef("http://example.org/jk"),
+                        SKOS.altLabel, Literal("JK")))
+        self.index = LabelIndex(self.graph, FOAF.name)
+
+    def test_exact(self):
+        self.assertEqual((URIRef("http://example.org/1"), "Socialstyrelsen"),
+                         self.index.lookup("Socialstyrelsen"))
+        self.assertEqual((URIRef("http://example.org/jk"), "JK"),
+                         LabelIndex(self.graph, SKOS.altLabel).lookup("JK"))
+
+    def test_fuzzy(self):
+        self.assertEqual((URIRef("http://example.org/0"), "Naturvårdsverket"),
+                         self.index.lookup("Naturvårdsverkt"))
+        with self.assertRaises(KeyError):
+            self.index.lookup("Försäkringskassan")
+        with self.assertRaises(ValueError):
+            self.index.lookup("Skolverk", cutoff=2)
+
+    def test_same_as_difflib(self):
+        for label in ("Skatteverk", "skolverket", "Riksdag", "JO", "", "k",
+                      "Regeringskansli", "Socialstyrelse n", "Naturvårdsverket"):
+            for cutoff in (0, 0.3, 0.6, 0.8, 0.95, 1):
+                want = difflib.get_close_matches(label, self.labels, 1, cutoff)
+                self.assertEqual(want[0] if want else None,
+                                 self.index.closest(label, cutoff),
+                                 "%r (cutoff %s)" % (label, cutoff))
+
+    def test_memoize(self):
+        self.index.lookup("Skolverk")
+        with patch("ferenda.labelindex.SequenceMatcher") as mock:
+            self.assertEqual("Skolverket", self.index.lookup("Skolverk")[1])
+        self.assertFalse(mock.called)
+
+
+class LookupResource(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.repo = DocumentRepository(datadir=self.datadir)
+        self.repo.commondata.add((URIRef("http://example.org/1"), FOAF.name,
+                                  Literal("Skolverket")))
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def test_lookup(self):
+        self.assertEqual(URIRef("http://example.org/1"),
+                         self.repo.lookup_resource("Skolverket"))
+        with patch.object(self.repo.log, "warning") as mockwarning:
+            self.assertEqual(URIRef("http://example.org/1"),
+                             self.repo.lookup_resource("Skolverke"))
+        self.assertTrue(mockwarning.called)
+        with self.assertRaises(KeyError):
+            self.repo.lookup_resource("Skatteverket")
+        # changes to commondata are picked up
+        self.repo.commondata.add((URIRef("http://example.org/2"), FOAF.name,
+                                  Literal("Skatteverket")))
+        self.assertEqual(URIRef("http://example.org/2"),
+                         self.repo.lookup_resource("Skatteverket"))
@@ -178,6 +178,28 @@ class=testManager.staticmockclass2
                          OrderedDict((("test", "Example class for testing"),
                                       ("test2", "Another class for testing"))))
 
+    def test_lazyrepo(self):
+        factory = Mock(return_value=staticmockclass())
+        repo = manager._LazyRepo(staticmockclass, factory)
+        self.assertEqual("staticmock", repo.alias)
+        self.assertIsInstance(repo, staticmockclass)
+        self.assertFalse(factory.called)
+        self.assertEqual("ok!", repo.mymethod("myarg"))
+        repo.minter = "mymint"
+        self.assertEqual("mymint", factory.return_value.minter)
+        self.assertEqual(1, factory.call_count)
+
+    def test_load_class(self):
+        cls = manager._load_class("ferenda.DocumentRepository")
+        self.assertIs(DocumentRepository, cls)
+        with patch("ferenda.manager.getlog") as mock_getlog:
+            self.assertIs(cls, manager._load_class("ferenda.DocumentRepository"))
+        self.assertFalse(mock_getlog.called)
+        with self.assertRaises(ImportError):
+            manager._load_class("ferenda.NoSuchRepository")
+        with self.assertRaises(ImportError):
+            manager._load_class("ferenda.util")  # a module, not a class
+
     def test_list_class_usage(self):
         self.assertEqual(manager._list_class_usage(staticmockclass),
                          {'mymethod':'Frobnicate the bizbaz'})
@@ -726,6 +748,23 @@ class Run(RunBase, unittest.TestCase):
         # Test 2: but if not, do the work
         self.assertEqual(manager.run(list(argv)), [None, "ok!", None])
 
+    def test_run_single_otherrepos(self):
+        self._enable_repos()
+        argv = ["test", "relate", "--all"]
+        with patch("ferenda.manager._log_startup_times") as mocklog:
+            self.assertEqual(manager.run(list(argv)),
+                             ["test relate arg1", "test relate myarg", "test relate arg2"])
+        otherrepos = mocklog.call_args[0][3]
+        # the other repo is provided, but never instantiated since
+        # Testrepo.relate doesn't use it
+        self.assertEqual(1, len(otherrepos))
+        self.assertEqual("test2", otherrepos[0].alias)
+        self.assertIsInstance(otherrepos[0], DocumentRepository)
+        self.assertIsNone(otherrepos[0].elapsed)
+        # but it is as soon as it's needed
+        self.assertEqual("test2", otherrepos[0].store.datadir.split(os.sep)[-1])
+        self.assertIsNotNone(otherrepos[0].elapsed)
+
     def test_run_all(self):
         self._enable_repos()
         argv = ["all", "mymethod", "myarg"]
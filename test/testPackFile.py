@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+
+import os
+import shutil
+import tempfile
+
+from ferenda.compat import unittest, patch
+
+from ferenda import DocumentEntry, DocumentRepository, util
+# SUT
+from ferenda import packfile
+
+
+class Pack(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.repo = DocumentRepository(datadir=self.datadir, packentries=True)
+        self.store = self.repo.store
+        self.pack = packfile.get(self.store.resourcepath("entries"))
+
+    def tearDown(self):
+        packfile.unregister(self.pack)
+        shutil.rmtree(self.datadir)
+
+    def test_entry(self):
+        path = self.store.documententry_path("123/a")
+        entry = DocumentEntry(path)
+        entry.orig_url = "http://example.org/123/a"
+        entry.save()
+        # the entry is in the pack, not on disk
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(["123/a.json"], self.pack.keys())
+        self.assertTrue(packfile.exists(path))
+        self.assertEqual("http://example.org/123/a", DocumentEntry(path).orig_url)
+        # and can be read through the ordinary store API
+        with self.store.open("123/a", "entries", ".json") as fp:
+            self.assertIn('"orig_url": "http://example.org/123/a"', fp.read())
+        self.assertEqual(["123/a"], list(self.store.list_basefiles_for("news")))
+        # files starting with a period are never packed
+        entry = DocumentEntry(self.store.documententry_path(".root"))
+        entry.save()
+        self.assertTrue(os.path.exists(self.store.documententry_path(".root")))
+        self.assertEqual(1, len(self.pack))
+
+    def test_open(self):
+        with self.store.open("123/a", "entries", ".json", "w") as fp:
+            fp.write("{}")
+        self.assertEqual(b"{}", self.pack.read("123/a.json"))
+        with self.assertRaises(IOError):
+            self.store.open("123/b", "entries", ".json")
+        # other directories aren't affected
+        with self.store.open_parsed("123/a", "w") as fp:
+            fp.write("<html/>")
+        self.assertTrue(os.path.exists(self.store.parsed_path("123/a")))
+
+    def test_archive_remove(self):
+        path = self.store.documententry_path("123/a")
+        DocumentEntry(path).save()
+        util.writefile(self.store.downloaded_path("123/a"), "data")
+        self.store.archive("123/a", "1")
+        self.assertFalse(packfile.exists(path))
+        self.assertTrue(os.path.exists(self.store.documententry_path("123/a", version="1")))
+        DocumentEntry(path).save()
+        self.assertEqual(1, self.store.remove("123/a"))
+        self.assertEqual(0, len(self.pack))
+
+    def test_migrate(self):
+        packfile.unregister(self.pack)
+        for basefile in "1", "2", "3":
+            DocumentEntry(self.store.documententry_path(basefile)).save()
+        pack = self.store.use_pack("entries")
+        self.assertEqual(3, pack.import_files())
+        self.assertEqual(["1.json", "2.json", "3.json"], pack.keys())
+        self.assertEqual([], list(util.list_dirs(self.store.resourcepath("entries"))))
+        self.assertTrue(DocumentEntry(self.store.documententry_path("2")).status == {})
+        self.assertEqual(3, pack.export_files())
+        self.assertEqual(0, len(pack))
+        self.assertTrue(os.path.exists(self.store.documententry_path("2")))
+        self.pack = pack
+
+    def test_fork(self):
+        # a forked process must not use the connection of its parent
+        self.pack.write("1.json", "{}")
+        conn = self.pack.conn
+        self.assertIs(conn, self.pack.conn)
+        with patch("ferenda.packfile.os.getpid", return_value=os.getpid() + 1):
+            self.assertIsNot(conn, self.pack.conn)
+            self.assertEqual(b"{}", self.pack.read("1.json"))
+            self.pack.write("2.json", "{}")
+            self.pack.close()
+        # the inherited connection is left open for the parent
+        self.assertEqual(["1.json", "2.json"],
+                         [row[0] for row in conn.execute("SELECT key FROM files ORDER BY key")])
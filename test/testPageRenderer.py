@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from ferenda.compat import unittest, patch, Mock
+
+from ferenda import DocumentRepository, util
+from ferenda.errors import PageRendererBusy
+
+# SUT
+from ferenda import PageRenderer
+
+
+def fake_runcmd(cmdline, require_success=False, pages=12):
+    """Mimics pdftoppm, pdfinfo and convert for a PDF file with the
+    given number of pages, without needing poppler or ImageMagick."""
+    args = re.findall(r'"([^"]*)"|(\S+)', cmdline)
+    args = [a or b for a, b in args]
+    if args[0] == "pdfinfo":
+        return 0, "Title: Test\nPages:          %s\n" % pages, ""
+    elif args[0] == "pdftoppm":
+        first, last = int(args[2]), min(int(args[4]), pages)
+        for page in range(first, last + 1):
+            # pdftoppm pads page numbers to the number of digits in
+            # the number of pages
+            util.writefile("%s-%0*d.png" % (args[-1], len(str(pages)), page),
+                           "image %s" % page)
+    elif args[0] == "convert":
+        util.writefile(args[-1], util.readfile(args[1]) + " (trimmed)")
+    return 0, "", ""
+
+
+class Render(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.renderer = PageRenderer(self.datadir + os.sep + "locks",
+                                     workers=2, batchsize=5, wait=0.3)
+        self.sourcefile = self.datadir + os.sep + "source.pdf"
+        util.writefile(self.sourcefile, "%PDF-1.4")
+        patcher = patch('ferenda.pagerenderer.util.runcmd', side_effect=fake_runcmd)
+        self.runcmd = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def outfile(self, page):
+        return self.datadir + os.sep + "pages" + os.sep + "page_%s.png" % page
+
+    def pdftoppm_calls(self):
+        return [c for c in self.runcmd.call_args_list
+                if c[0][0].startswith("pdftoppm")]
+
+    def test_render(self):
+        prepare = Mock()
+        self.renderer.render(self.sourcefile, 3, self.outfile, prepare)
+        self.assertEqual(1, prepare.call_count)
+        # pages 3-7 were rendered with a single pdftoppm call
+        self.assertEqual(1, len(self.pdftoppm_calls()))
+        self.assertEqual("image 4 (trimmed)", util.readfile(self.outfile(3)))
+        for page in range(3, 8):
+            self.assertTrue(os.path.exists(self.outfile(page)))
+        self.assertFalse(os.path.exists(self.outfile(2)))
+        self.assertFalse(os.path.exists(self.outfile(8)))
+        # no temporary files or locks are left behind
+        self.assertEqual(5, len(os.listdir(self.datadir + os.sep + "pages")))
+        self.assertEqual([], os.listdir(self.datadir + os.sep + "locks"))
+        # already rendered pages are not rendered again
+        self.renderer.render(self.sourcefile, 4, self.outfile, prepare)
+        self.assertEqual(1, len(self.pdftoppm_calls()))
+        self.assertEqual(1, prepare.call_count)
+
+    def test_render_batch(self):
+        self.renderer.render(self.sourcefile, 0, self.outfile)
+        # a batch that goes past the last page
+        self.assertEqual(2, self.renderer.render_batch(
+            self.sourcefile, list(range(10, 15)), self.outfile))
+        self.assertTrue(os.path.exists(self.outfile(11)))
+        # pages that already are rendered are skipped
+        self.assertEqual(0, self.renderer.render_batch(
+            self.sourcefile, list(range(0, 5)), self.outfile))
+        self.assertEqual(2, len(self.pdftoppm_calls()))
+        self.assertEqual(12, self.renderer.page_count(self.sourcefile))
+
+    def test_busy(self):
+        for i in range(2):
+            util.writefile(self.renderer._lockfile("slot-%s" % i), "1")
+        with self.assertRaises(PageRendererBusy):
+            self.renderer.render(self.sourcefile, 0, self.outfile)
+        self.assertFalse(os.path.exists(self.outfile(0)))
+        # locks left behind by a crashed render are eventually removed
+        stale = time.time() - self.renderer.staletimeout - 1
+        os.utime(self.renderer._lockfile("slot-1"), (stale, stale))
+        self.renderer.render(self.sourcefile, 0, self.outfile)
+        self.assertTrue(os.path.exists(self.outfile(0)))
+        # the lock for the other slot is untouched
+        self.assertTrue(os.path.exists(self.renderer._lockfile("slot-0")))
+
+    def test_inflight(self):
+        # another process is rendering the same file
+        renderer = self.renderer
+        doclock = renderer._doclockfile(self.sourcefile)
+        util.writefile(doclock, "1")
+
+        def sleep(seconds):
+            util.writefile(self.outfile(0), "rendered by someone else")
+        with patch('ferenda.pagerenderer.time.sleep', side_effect=sleep):
+            renderer.render(self.sourcefile, 0, self.outfile)
+        self.assertEqual("rendered by someone else", util.readfile(self.outfile(0)))
+        self.assertEqual([], self.pdftoppm_calls())
+        # if it doesn't finish in time, we give up
+        with self.assertRaises(PageRendererBusy):
+            renderer.render(self.sourcefile, 1, self.outfile)
+
+
+class PDFRepo(DocumentRepository):
+    alias = "pdfrepo"
+    downloaded_suffix = ".pdf"
+    storage_policy = "dir"
+
+
+class Prerender(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.repo = PDFRepo(datadir=self.datadir, pagerenderbatch=5)
+        util.writefile(self.repo.store.downloaded_path("123"), "%PDF-1.4")
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def test_prerender(self):
+        with patch('ferenda.pagerenderer.util.runcmd', side_effect=fake_runcmd) as runcmd:
+            self.assertEqual(12, self.repo.requesthandler.prerender_pages("123"))
+            # three batches of (at most) five pages, plus pdfinfo
+            self.assertEqual(4, len([c for c in runcmd.call_args_list
+                                     if not c[0][0].startswith("convert")]))
+            for page in range(12):
+                self.assertTrue(os.path.exists(self.repo.store.intermediate_path(
+                    "123", attachment="page_%s.png" % page)))
+            self.assertEqual(0, self.repo.requesthandler.prerender_pages("123"))
+
+    def test_generate(self):
+        self.repo.config.prerenderpages = True
+        self.repo.config.force = True
+        with patch('ferenda.documentrepository.Transformer'), \
+                patch.object(self.repo, '_annotations_needed', return_value=False), \
+                patch.object(self.repo.requesthandler, 'prerender_pages') as prerender:
+            util.writefile(self.repo.store.parsed_path("123"), "<html/>")
+            # normally created by the (mocked) transformer
+            util.writefile(self.repo.store.generated_path("123"), "<html/>")
+            self.repo.generate("123")
+            prerender.assert_called_once_with("123")
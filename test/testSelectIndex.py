@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+
+import os
+import shutil
+import tempfile
+
+import rdflib
+
+from ferenda.compat import unittest, Mock, patch
+from ferenda import DocumentRepository, util
+
+# SUT
+from ferenda import SelectIndex, AnnotationIndexMixin
+
+DATA = """
+@prefix dcterms: <http://purl.org/dc/terms/> .
+@prefix ex: <http://example.org/> .
+
+ex:case1 dcterms:references ex:law1 ; dcterms:title "Case 1" .
+ex:case2 dcterms:references <http://example.org/law1#P1> ; dcterms:title "Case 2" .
+ex:case3 dcterms:references ex:law10 ; dcterms:title "Case 3" .
+ex:case4 dcterms:references ex:law2 ; dcterms:title "Case 4" .
+ex:law1 dcterms:description "The first law" .
+ex:law2 dcterms:description "The second law" .
+"""
+
+PREFIXQUERY = """PREFIX dcterms: <http://purl.org/dc/terms/>
+SELECT ?case ?lagrum ?title
+WHERE {
+    ?case dcterms:references ?lagrum ;
+          dcterms:title ?title .
+    FILTER(STRSTARTS(STR(?lagrum), "%(uri)s"))
+}"""
+
+EXACTQUERY = """PREFIX dcterms: <http://purl.org/dc/terms/>
+SELECT ?desc
+WHERE { <%(uri)s> dcterms:description ?desc . }"""
+
+
+class Index(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.graph = rdflib.Graph().parse(data=DATA, format="turtle")
+        self.store = Mock(**{'select.side_effect': self._select})
+        self.index = SelectIndex(self.datadir + os.sep + "index.sqlite")
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.datadir)
+
+    def _select(self, query, format):
+        # mimics what TripleStore.select(..., "python") returns
+        return [dict((str(k), str(v)) for k, v in row.items())
+                for row in self.graph.query(query).bindings]
+
+    def _want(self, template, uri):
+        return self._select(template % {'uri': uri}, "python")
+
+    def test_prefix(self):
+        self.assertEqual(4, self.index.build(self.store, "prefix.rq", PREFIXQUERY))
+        for uri in ("http://example.org/law1",
+                    "http://example.org/law2",
+                    "http://example.org/law3"):
+            self.assertEqual(
+                sorted(self._want(PREFIXQUERY, uri), key=lambda r: r['case']),
+                sorted(self.index.select("prefix.rq", {'uri': uri}),
+                       key=lambda r: r['case']))
+        # just like STRSTARTS, this includes references to law10
+        self.assertEqual(3, len(self.index.select(
+            "prefix.rq", {'uri': "http://example.org/law1"})))
+        # the store was only queried when building the index
+        self.assertEqual(1, self.store.select.call_count)
+
+    def test_exact(self):
+        self.assertEqual(2, self.index.build(self.store, "exact.rq", EXACTQUERY))
+        for uri in ("http://example.org/law1",
+                    "http://example.org/law10"):
+            self.assertEqual(self._want(EXACTQUERY, uri),
+                             self.index.select("exact.rq", {'uri': uri}))
+
+    def test_constant_params(self):
+        self.index.build(self.store, "prefix.rq", PREFIXQUERY,
+                         {'context': 'http://example.org/ctx'})
+        # a different context can't be served from the index
+        self.assertIsNone(self.index.select(
+            "prefix.rq", {'uri': "http://example.org/law1",
+                          'context': 'http://example.org/other'}))
+        self.assertEqual(3, len(self.index.select(
+            "prefix.rq", {'uri': "http://example.org/law1",
+                          'context': 'http://example.org/ctx'})))
+
+    def test_not_indexable(self):
+        # the document URI is used in a way that can't be rewritten
+        query = PREFIXQUERY.replace("?lagrum ;", "<%(uri)s> ;")
+        self.assertIsNone(self.index.build(self.store, "bad.rq", query))
+        # the variable used in the filter isn't projected
+        query = PREFIXQUERY.replace("SELECT ?case ?lagrum", "SELECT ?case")
+        self.assertIsNone(self.index.build(self.store, "bad.rq", query))
+        self.assertEqual(0, self.store.select.call_count)
+        self.assertIsNone(self.index.select("bad.rq", {'uri': "http://example.org/law1"}))
+
+    def test_clear(self):
+        self.index.build(self.store, "exact.rq", EXACTQUERY)
+        self.index.clear()
+        self.assertFalse(os.path.exists(self.index.filename))
+        self.assertIsNone(self.index.select("exact.rq",
+                                            {'uri': "http://example.org/law1"}))
+
+
+class AnnotatedRepo(AnnotationIndexMixin, DocumentRepository):
+    alias = "annotated"
+
+    def annotation_index_queries(self):
+        return [("sparql/prefix.rq", None)]
+
+
+class Mixin(unittest.TestCase):
+    _select = Index._select
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        util.writefile(self.datadir + "/res/sparql/prefix.rq", PREFIXQUERY)
+        self.graph = rdflib.Graph().parse(data=DATA, format="turtle")
+        self.store = Mock(**{'select.side_effect': self._select})
+        self.repo = AnnotatedRepo(datadir=self.datadir + "/data",
+                                  loadpath=[self.datadir + "/res"],
+                                  annotationindex=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def test_store_select(self):
+        law1 = "http://example.org/law1"
+        self.assertEqual(3, len(self.repo.store_select(self.store, "sparql/prefix.rq", law1)))
+        self.assertEqual(1, self.store.select.call_count)
+        with patch("ferenda.selectindex.TripleStore.connect", return_value=self.store):
+            AnnotatedRepo.generate_all_setup(self.repo.config, currentrepo=self.repo)
+        self.assertEqual(2, self.store.select.call_count)
+        self.assertEqual(3, len(self.repo.store_select(self.store, "sparql/prefix.rq", law1)))
+        # answered by the index
+        self.assertEqual(2, self.store.select.call_count)
+
+    def test_stale_index(self):
+        law1 = "http://example.org/law1"
+        with patch("ferenda.selectindex.TripleStore.connect", return_value=self.store):
+            AnnotatedRepo.generate_all_setup(self.repo.config, currentrepo=self.repo)
+        self.assertEqual(1, self.store.select.call_count)
+        indextime = os.stat(self.repo.store.resourcepath("annotationindex.sqlite")).st_mtime
+        # another repo is related after the index was built, which
+        # might change the results of the queries
+        dumppath = self.datadir + "/data/other/distilled/dump.nt"
+        util.writefile(dumppath, "")
+        os.utime(dumppath, (indextime + 10, indextime + 10))
+        repo = AnnotatedRepo(datadir=self.datadir + "/data",
+                             loadpath=[self.datadir + "/res"],
+                             annotationindex=True)
+        self.assertIsNone(repo.annotation_index)
+        self.assertEqual(3, len(repo.store_select(self.store, "sparql/prefix.rq", law1)))
+        self.assertEqual(2, self.store.select.call_count)
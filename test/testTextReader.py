@@ -10,7 +10,7 @@ import codecs
 from ferenda.compat import unittest
 
 # SUT
-from ferenda.textreader import TextReader
+from ferenda.textreader import TextReader, MmapTextReader
 
 PREFIX = os.path.dirname(__file__)+"/files/textreader"
 
@@ -108,6 +108,15 @@ class Ustring(Basic):
         self.f = TextReader(string=data,linesep=TextReader.UNIX)
 
 
+# and once more, reading from a memory-mapped file
+class Mmap(Basic):
+    def setUp(self):
+        self.f = MmapTextReader(PREFIX + "/LICENSE.txt", linesep=TextReader.UNIX)
+
+    def tearDown(self):
+        self.f.close()
+
+
 class Codecs:
     def testUTF(self):
         f = TextReader(PREFIX + "/test/test_doctest4.txt", "utf-8")
@@ -238,6 +247,69 @@ class Edgecases(unittest.TestCase):
                           self.f.cue, 'I am a little teapot')
         self.f.seek(0)
 
+class MmapEdgecases(Edgecases):
+    def setUp(self):
+        self.f = MmapTextReader(PREFIX + "/LICENSE.txt", linesep=TextReader.UNIX)
+
+
+class MmapSubreaders(Subreaders):
+    def setUp(self):
+        self.f = MmapTextReader(PREFIX + "/test_base64.py", linesep=TextReader.UNIX)
+
+    def testSubreaderType(self):
+        p = self.f.getreader(self.f.readpage)
+        # subreaders contain decoded text, not a memory map
+        self.assertIs(type(p), TextReader)
+
+
+class MmapEncodings(unittest.TestCase):
+    text = "r\u00e4ksm\u00f6rg\u00e5s\n\n\u00e5tta \u00e4lgar\n"
+
+    def setUp(self):
+        self.filename = "textreader.tmp"
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def _reader(self, encoding):
+        with codecs.open(self.filename, "w", encoding=encoding) as fp:
+            fp.write(self.text)
+        return MmapTextReader(self.filename, encoding=encoding,
+                              linesep=TextReader.UNIX)
+
+    def test_utf8(self):
+        f = self._reader("utf-8")
+        self.assertEqual("r\u00e4ksm\u00f6rg\u00e5s", f.readparagraph())
+        f.cue("\u00e4lgar")
+        self.assertEqual("\u00e4lgar", f.readline())
+        f.seek(0)
+        # positions are byte offsets, but reads never split a character
+        self.assertEqual("r\u00e4", f.read(2))
+        self.assertEqual(3, f.tell())
+        self.assertEqual("r\u00e4", f.prev(3))
+        f.close()
+        self.assertTrue(f.closed)
+
+    def test_latin1(self):
+        f = self._reader("iso-8859-1")
+        f.cuepast("\u00e5tta ")
+        self.assertEqual("\u00e4lgar", f.readline())
+        f.close()
+
+    def test_unsupported(self):
+        with codecs.open(self.filename, "w", encoding="utf-16") as fp:
+            fp.write(self.text)
+        with self.assertRaises(ValueError):
+            MmapTextReader(self.filename, encoding="utf-16")
+
+    def test_empty(self):
+        with open(self.filename, "w"):
+            pass
+        f = MmapTextReader(self.filename)
+        self.assertTrue(f.eof())
+        self.assertEqual("", f.readline())
+
+
 class Fileops(unittest.TestCase):
 
     def testClose(self):
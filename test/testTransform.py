@@ -5,6 +5,8 @@ from builtins import *
 
 import os
 
+from lxml import etree
+
 from ferenda.testutil import RepoTester
 from ferenda import util
 
@@ -104,6 +106,23 @@ class Transform(RepoTester):
             <infile>Document title</infile>
         </output>""", util.readfile(base+"outfile.xml"))
 
+    def test_transform_tree_fileparam(self):
+        base = self.datadir+os.sep
+        t = self._setup_files(paramfile="paramfile.xml")
+        tree = etree.parse(base+"paramfile.xml")
+        util.robust_remove(base+"paramfile.xml")
+        t.transform_file(base+"infile.xml", base+"outfile.xml",
+                         {'value':'blahonga',
+                          'file':tree})
+        self.assertEqualXML("""
+        <output>
+            <paramvalue>blahonga</paramvalue>
+            <paramfile><node key='value'><subnode>textnode</subnode></node></paramfile>
+            <infile>Document title</infile>
+        </output>""", util.readfile(base+"outfile.xml"))
+        # the tree should not be kept around after the transform
+        self.assertEqual({}, t.t.resolver.documents)
+
 
     # FIXME: We should isolate parts of the tests in
     # testDocRepo.Generate, testDocRepo.TOC and testWSGI.Search that
@@ -257,6 +257,29 @@ class Main(unittest.TestCase, FerendaTestCase):
             mock_get.side_effect = requests.exceptions.HTTPError("Server error", response=mockresponse)
             got = store.select("the-query", format="python")
     
+    @patch('requests.post', side_effect=canned((200, "select-results.xml"),
+                                               (200, "construct-results.ttl")))
+    @patch('requests.get')
+    def test_sesame_long_query(self, mock_get, mock_post):
+        # queries that would make the GET url too long are POSTed
+        store = TripleStore.connect("SESAME", "http://localhost/", "repo")
+        query = "SELECT ?s WHERE { ?s ?p ?o } VALUES ?s { %s }" % " ".join(
+            "<http://example.org/doc/%s>" % i for i in range(200))
+        self.assertGreater(len(query), store.max_url_length)
+        want = util.readfile("test/files/triplestore/select-results.xml", "rb")
+        self.assertEqual(want, store.select(query))
+        self.assertEqual(0, mock_get.call_count)
+        self.assertEqual(1, mock_post.call_count)
+        args, kwargs = mock_post.call_args
+        self.assertEqual("http://localhost/repositories/repo", args[0])
+        self.assertEqual({'query': query}, kwargs['data'])
+
+        query = query.replace("SELECT ?s", "CONSTRUCT { ?s ?p ?o }")
+        self.assertEqual(4, len(store.construct(query)))
+        self.assertEqual(0, mock_get.call_count)
+        self.assertEqual(2, mock_post.call_count)
+        self.assertEqual({'query': query}, mock_post.call_args[1]['data'])
+
     @patch('requests.get', side_effect=canned((200, "construct-results.ttl")))
     def test_sesame_construct(self, mock_get):
         store = TripleStore.connect("SESAME", "", "")
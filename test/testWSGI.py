@@ -9,6 +9,7 @@ import datetime
 import json
 import os
 import shutil
+import time
 
 from lxml import etree
 from rdflib import Graph
@@ -20,6 +21,7 @@ from ferenda import manager, util, fulltextindex
 from ferenda.documentstore import _open
 from ferenda.elements import html
 from ferenda.testutil import RepoTester
+from ferenda.wsgiapp import PrefixIndex, SearchCache
 
 # tests the wsgi app in-process, ie not with actual HTTP requests, but
 # simulates what make_server().serve_forever() would send and
@@ -273,6 +275,71 @@ class API(WSGI):
             status, headers, content = self.call_wsgi()
             config['connect.return_value'].query.assert_called_once_with(**want)
 
+    def test_searchcache(self):
+        self.app.searchcache = SearchCache(2, 300)
+        res = ([{'uri': 'http://example.org/base/123/a'}],
+               {'firstresult': 1,
+                'totalresults': 1})
+        idx = Mock(**{'query.return_value': res,
+                      'generation.return_value': 1,
+                      'schema.return_value': {'dcterms_issued': fulltextindex.Datetime()}})
+        with patch('ferenda.wsgiapp.FulltextIndex', **{'connect.return_value': idx}) as mock:
+            for query_string in ("q=a&dcterms_issued=2014-06-30",
+                                 "dcterms_issued=2014-06-30&q=a",
+                                 "q=a&dcterms_issued=2014-06-30&_page=1",
+                                 "q=a&dcterms_issued=2014-06-30"):
+                self.builder.query_string = query_string
+                status, headers, content = self.call_wsgi()
+                self.assertEqual([{'iri': 'http://example.org/base/123/a'}],
+                                 json.loads(content.decode())['items'])
+            # the index is only connected to once, and the second and
+            # fourth queries are served from the cache
+            self.assertEqual(1, mock.connect.call_count)
+            self.assertEqual(2, idx.query.call_count)
+            # a new commit generation invalidates the cache
+            idx.generation.return_value = 2
+            status, headers, content = self.call_wsgi()
+            self.assertEqual(3, idx.query.call_count)
+        self.builder.query_string = ""
+        self.builder.path = "/myapi/;searchcache"
+        status, headers, content = self.call_wsgi()
+        got = json.loads(content.decode())
+        self.assertEqual({'size': 1, 'maxsize': 2, 'ttl': 300,
+                          'hits': 2, 'misses': 3, 'hitrate': 0.4}, got)
+
+    def test_searchcache_expiry(self):
+        cache = SearchCache(2, 300)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(1, cache.get("a"))
+        cache.put("c", 3)
+        # b was the least recently used entry
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(1, cache.get("a"))
+        with patch('ferenda.wsgiapp.time.time', return_value=time.time() + 301):
+            self.assertIsNone(cache.get("c"))
+
+    def test_prefixindex(self):
+        old = {'url': 'http://example.org/1986:223'}
+        new = {'url': 'http://example.org/2017:900'}
+        case = {'url': 'http://example.org/nja/2015s166'}
+        index = PrefixIndex([("Förvaltningslag (1986:223)", (1, 0), old),
+                             ("Förvaltningslag (2017:900)", (0, 0), new),
+                             ("FL", (0, 0), new),
+                             ("NJA 2015 s.  166", (0, 1), case)])
+        self.assertEqual(4, len(index))
+        # lower ranks first, and every item only once
+        self.assertEqual([new, old], index.lookup("förvaltningsl"))
+        self.assertEqual([new, old], index.lookup("F"))
+        self.assertEqual([new], index.lookup("F", limit=1))
+        # whitespace and case are normalized
+        self.assertEqual([case], index.lookup("nja 2015  S. 16"))
+        self.assertEqual([], index.lookup("nja 2015 s. 17"))
+        self.assertEqual([], index.lookup(" "))
+        # returned items are copies
+        index.lookup("FL")[0]['url'] = None
+        self.assertEqual([new], index.lookup("FL"))
+
     def test_parameters_legacy(self):
         # legacy api
         res = ([], {'firstresult': 1,
@@ -343,6 +410,46 @@ class API(WSGI):
             want = json.load(fp)
         self.assertEqual(want, got)
 
+    def test_stats_resultset(self):
+        self.app.repos[0].faceted_data = Mock(return_value=self.fakedata)
+        got = self.app.stats([{'iri': 'http://example.org/base/123/b'},
+                              {'iri': 'http://example.org/base/123/c'},
+                              {'iri': 'http://example.org/other/1'}])
+        want = {"type": "DataSet",
+                "slices": [{"dimension": "dcterms_issued",
+                            "observations": [{"count": 1, "year": "2013"},
+                                             {"count": 1, "year": "2014"}]},
+                           {"dimension": "dcterms_publisher",
+                            "observations": [{"count": 2,
+                                              "ref": "http://example.org/publisher/B"}]},
+                           {"dimension": "rdf_type",
+                            "observations": [{"count": 2,
+                                              "term": "bibo:Standard"}]}]}
+        self.assertEqual(want, got)
+        # the faceted data is only loaded once, regardless of resultset
+        self.app.stats()
+        self.assertEqual(1, self.app.repos[0].faceted_data.call_count)
+
+    def test_stats_refresh(self):
+        self.app.repos[0].faceted_data = Mock(return_value=self.fakedata)
+        self.app.stats()
+        self.app.stats()
+        self.assertEqual(1, self.app.repos[0].faceted_data.call_count)
+        # a changed faceted data cache makes the store reload, using
+        # the cached data as is
+        util.writefile(self.repo.store.resourcepath("toc/faceted_data.json"),
+                       json.dumps(self.fakedata[:1]))
+        got = self.app.stats()
+        self.assertEqual([{"count": 1, "term": "bibo:Standard"}],
+                         got['slices'][2]['observations'])
+        # a newer triple store dump doesn't make it update the cache
+        util.writefile(self.repo.store.resourcepath("distilled/dump.nt"), "")
+        self.app.stats()
+        self.assertEqual(1, self.app.repos[0].faceted_data.call_count)
+        util.robust_remove(self.repo.store.resourcepath("toc/faceted_data.json"))
+        util.robust_remove(self.repo.store.resourcepath("distilled/dump.nt"))
+
+
 class Runserver(WSGI):
 
     def test_make_wsgi_app(self):
@@ -455,6 +562,125 @@ class ConNeg(WSGI):
         self.assertResponse(want[0], want[1], want[2], status, headers, content)
 
 
+    def test_conditional(self):
+        status, headers, content = self.call_wsgi()
+        headers = dict(headers)
+        self.assertIn('ETag', headers)
+        self.assertIn('Last-Modified', headers)
+        self.builder.headers['If-None-Match'] = headers['ETag']
+        status, headers, content = self.call_wsgi()
+        self.assertEqual("304 NOT MODIFIED", status)
+        self.assertEqual(b"", content)
+        # a changed file gets a new ETag
+        path = self.repo.store.generated_path("123/a")
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 1))
+        status, headers, content = self.call_wsgi()
+        self.assertEqual("200 OK", status)
+        del self.builder.headers['If-None-Match']
+        self.builder.headers['If-Modified-Since'] = dict(headers)['Last-Modified']
+        status, headers, content = self.call_wsgi()
+        self.assertEqual("304 NOT MODIFIED", status)
+
+    def test_sendfile(self):
+        try:
+            self.repo.config.sendfile = "X-Sendfile"
+            status, headers, content = self.call_wsgi()
+            self.assertEqual(os.path.abspath(self.repo.store.generated_path("123/a")),
+                             dict(headers)['X-Sendfile'])
+            self.assertEqual(b"", content)
+            self.repo.config.sendfile = "X-Accel-Redirect"
+            self.repo.config.sendfileprefix = "/_data/"
+            status, headers, content = self.call_wsgi()
+            self.assertEqual("/_data/base/generated/123/a.html",
+                             dict(headers)['X-Accel-Redirect'])
+        finally:
+            self.repo.config.sendfile = ""
+
+    def test_rdfcache(self):
+        g = Graph()
+        g.parse(source=self.repo.store.distilled_path("123/a"))
+        self.builder.headers['Accept'] = 'text/turtle'
+        cachepath = self.repo.store.path("123/a", "rdfcache", ".ttl")
+        try:
+            self.repo.config.rdfcache = 10
+            status, headers, content = self.call_wsgi()
+            self.assertTrue(os.path.exists(cachepath))
+            self.assertIn('ETag', dict(headers))
+            got = Graph()
+            got.parse(data=content, format="turtle")
+            self.assertEqualGraphs(g, got)
+            # the cached serialization is used as long as it's newer
+            # than the distilled file
+            with patch.object(self.repo, 'distilled_graph') as mock:
+                status, headers, content = self.call_wsgi()
+                self.assertFalse(mock.called)
+            self.assertEqual(util.readfile(cachepath, "rb"), content)
+            # the cache is pruned to 90% of its max size
+            handler = self.repo.requesthandler
+            for i in range(10):
+                handler.write_rdfcache(handler.rdfcache_path("123/%s" % i, "turtle"), b"")
+            self.assertEqual(9, len(handler._rdfcache_files()))
+        finally:
+            self.repo.config.rdfcache = 0
+            shutil.rmtree(os.path.join(self.repo.store.datadir, "rdfcache"))
+
+    def test_rdfcache_conditional(self):
+        # cache hits must not change the validators of the cached file
+        self.builder.headers['Accept'] = 'text/turtle'
+        try:
+            self.repo.config.rdfcache = 10
+            status, headers, content = self.call_wsgi()
+            etag = dict(headers)['ETag']
+            self.builder.headers['If-None-Match'] = etag
+            status, headers, content = self.call_wsgi()
+            self.assertEqual("304 NOT MODIFIED", status)
+            self.assertEqual(etag, dict(headers)['ETag'])
+            self.assertEqual(b"", content)
+        finally:
+            self.repo.config.rdfcache = 0
+            shutil.rmtree(os.path.join(self.repo.store.datadir, "rdfcache"))
+
+    def test_diff(self):
+        page = """<html><body><div class="docversions">Versions</div><article>
+<div about="#S1"><p>The first section</p></div>
+<div about="#S2"><p>%s</p></div>
+%s</article></body></html>"""
+        util.writefile(self.repo.store.generated_path("123/a", version="1"),
+                       page % ("The second section", ""))
+        util.writefile(self.repo.store.generated_path("123/a"),
+                       page % ("The changed second section",
+                               '<div about="#S3"><p>A new section</p></div>'))
+        self.builder.query_string = "diff=true&from=1"
+        from ferenda.requesthandler import htmldiff
+        with patch('ferenda.requesthandler.htmldiff', side_effect=htmldiff) as mock:
+            status, headers, content = self.call_wsgi()
+        # only the changed and added sections were diffed
+        self.assertEqual(2, mock.call_count)
+        self.assertEqual("200 OK", status)
+        tree = etree.HTML(content)
+        self.assertIn("changed", tree.xpath("//div[@about='#S2']/p/ins/text()")[0])
+        self.assertEqual("A new section", tree.xpath("//div[@about='#S3']/p/ins/text()")[0])
+        self.assertEqual("The first section", tree.xpath("//div[@about='#S1']/p/text()")[0])
+        handler = self.repo.requesthandler
+        cachepath = handler.diffcache_path("123/a", "1", None)
+        self.assertFalse(os.path.exists(cachepath))
+        try:
+            self.repo.config.diffcache = True
+            status, headers, content = self.call_wsgi()
+            self.assertEqual(util.readfile(cachepath, "rb"), content)
+            self.assertIn('ETag', dict(headers))
+            with patch.object(handler, 'diff_versions') as mock:
+                status, headers, content = self.call_wsgi()
+                self.assertFalse(mock.called)
+                self.assertEqual(0, handler.precompute_diffs("123/a"))
+            # regenerating a version invalidates the cached diff
+            os.utime(self.repo.store.generated_path("123/a"),
+                     (time.time() + 2, time.time() + 2))
+            self.assertEqual(1, handler.precompute_diffs("123/a"))
+        finally:
+            self.repo.config.diffcache = False
+
     def test_ntriples(self):
         # Serialization may upset order of triples -- it's not
         # guaranteed that two isomorphic graphs serialize to the exact
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compares the time needed to write, list and read the entry files
+of a docrepo when stored as separate files against when they're stored
+in a single pack file (the ``packentries`` option). Try a large number
+of entries (eg. 1000000) to see the effect on file system overhead.
+
+Usage: packfile-bench.py [--entries=N]
+
+"""
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+# 1 stdlib
+import sys
+import os
+import shutil
+import tempfile
+
+# 3 own code
+sys.path.append(os.path.normpath(os.getcwd() + os.sep + os.pardir))
+from ferenda import DocumentRepository, DocumentEntry, util, packfile
+
+
+def run(repo, basefiles):
+    with util.logtime(print, "%(what)s: wrote %(count)s entries in %(elapsed).3f s",
+                      {'what': repo.store.datadir, 'count': len(basefiles)}):
+        for basefile in basefiles:
+            entry = DocumentEntry(repo.store.documententry_path(basefile))
+            entry.orig_url = "http://example.org/%s" % basefile
+            entry.save()
+    with util.logtime(print, "%(what)s: listed %(count)s entries in %(elapsed).3f s",
+                      {'what': repo.store.datadir, 'count': len(basefiles)}):
+        listed = list(repo.store.list_basefiles_for("news"))
+    assert len(listed) == len(basefiles), "%s != %s" % (len(listed), len(basefiles))
+    with util.logtime(print, "%(what)s: read %(count)s entries in %(elapsed).3f s",
+                      {'what': repo.store.datadir, 'count': len(basefiles)}):
+        for basefile in listed:
+            DocumentEntry(repo.store.documententry_path(basefile))
+
+
+def bench(entries):
+    datadir = tempfile.mkdtemp()
+    try:
+        basefiles = ["%s/%s" % (i // 1000, i) for i in range(entries)]
+        run(DocumentRepository(datadir=datadir + os.sep + "files"), basefiles)
+        repo = DocumentRepository(datadir=datadir + os.sep + "pack",
+                                  packentries=True)
+        run(repo, basefiles)
+        packfile.unregister(packfile.get(repo.store.resourcepath("entries")))
+    finally:
+        shutil.rmtree(datadir)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    entries = 10000
+    if args and args[0].startswith("--entries="):
+        entries = int(args.pop(0).split("=", 1)[1])
+    if args:
+        print(__doc__)
+        sys.exit(1)
+    bench(entries)
@@ -23,7 +23,7 @@ COIN = Namespace("http://purl.org/court/def/2009/coin#")
 sys.path.append(os.path.normpath(os.getcwd() + os.sep + os.pardir))
 # FIXME: As we seem to need these functions (both here and partially
 # in devel.py, maybe they shouldn't be marked private?
-from ferenda.manager import _load_class, _load_config, _find_config_file, DEFAULT_CONFIG
+from ferenda.manager import _load_class, load_config, find_config_file, DEFAULT_CONFIG
 from ferenda.elements import deserialize, Link
 from ferenda import util
 from ferenda.thirdparty.coin import URIMinter
@@ -31,7 +31,7 @@ from ferenda.sources.legal.se.legalref import LegalRef
 from ferenda.sources.legal.se import RPUBL
 
 class LegalRefTest(object):
-    def __init__(self, alias):
+    def __init__(self, alias, cachesize=0):
         # setup
         self.alias = alias
         parsetype = alias.split("/")[1]
@@ -40,7 +40,8 @@ class LegalRefTest(object):
                                 'DV': LegalRef.RATTSFALL,
                                 'Regpubl': LegalRef.FORARBETEN,
                                 'EGLag': LegalRef.EULAGSTIFTNING,
-                                'ECJ': LegalRef.EURATTSFALL}[parsetype])
+                                'ECJ': LegalRef.EURATTSFALL}[parsetype],
+                               cachesize=cachesize)
 
         # this particular test method is set up to use lagen.nu style
         # URIs because the canonical URIs are significantly different.
@@ -77,6 +78,9 @@ class LegalRefTest(object):
         body = self.run_with_timeit(test_paras)
         return elapsed, extractrefs(body)
 
+    def cache_info(self):
+        return self.parser.cache_info()
+
     def run_with_timeit(self, test_paras):
         body = []
         for para in test_paras:
@@ -95,12 +99,13 @@ class LegalRefTest(object):
 
 class RepoTest(object):
 
-    def __init__(self, config, alias):
+    def __init__(self, config, alias, cachesize=0):
         repoconfig = getattr(config, alias)
         classname = getattr(repoconfig, 'class')
         repocls = _load_class(classname)
         self.repo = repocls()
         self.repo.config = repoconfig
+        self.repo.config.refcachesize = cachesize
         self.alias = alias
 
     def timetest(self, basefile, basedir):
@@ -127,6 +132,9 @@ class RepoTest(object):
         elapsed = time.time() - start
         return elapsed, extractrefs(doc)
 
+    def cache_info(self):
+        return self.repo.refparser._legalrefparser.cache_info()
+
     def createtest(self, basefile, basedir):
         self.repo.config.force = True # make this dependent on whether 
         self.repo.parse(basefile)
@@ -151,13 +159,17 @@ def extractrefs(node):
 def getconfig(basedir):
     defaults = dict(DEFAULT_CONFIG)
     os.environ['FERENDA_SERIALIZEUNPARSED'] = basedir
-    return _load_config(_find_config_file())
+    return load_config(find_config_file())
 
 def createtestsuite(testsuitefile):
     with open(testsuitefile) as fp:
         testsuite = json.load(fp)
     basedir = os.path.dirname(testsuitefile)
-    config = getconfig(basedir)
+    # a ferenda.ini is only needed for repo-based tests
+    if all(alias.startswith("legalref/") for alias in testsuite):
+        config = None
+    else:
+        config = getconfig(basedir)
     baseline = {}
     for alias, basefiles in testsuite.items():
         if alias.startswith("legalref/"):
@@ -193,23 +205,28 @@ def createtestsuite(testsuitefile):
     with open(baselinefile, "w") as fp:
         json.dump(baseline, fp, indent=2)
 
-def evaltestsuite(testsuitefile):
+def evaltestsuite(testsuitefile, cachesize=0):
     baselinefile = testsuitefile.replace(".json", ".baseline.json")
     with open(baselinefile) as fp:
         baseline = json.load(fp)
     with open(testsuitefile) as fp:
         testsuite = json.load(fp)
     basedir = os.path.dirname(testsuitefile)
-    config = getconfig(basedir)
+    # a ferenda.ini is only needed for repo-based tests
+    if all(alias.startswith("legalref/") for alias in testsuite):
+        config = None
+    else:
+        config = getconfig(basedir)
     results = {}
+    cacheinfo = {}
     for alias, basefiles in testsuite.items():
         if alias.startswith("legalref/"):
-            tester = LegalRefTest(alias)
+            tester = LegalRefTest(alias, cachesize)
             if not basefiles:
                 testfiledir = os.path.dirname(__file__)+ "/../test/files/"
                 basefiles = [x[:-4] for x in os.listdir(testfiledir + alias) if x.endswith(".txt")]
         else:
-            tester = RepoTest(config, alias)
+            tester = RepoTest(config, alias, cachesize)
         results[alias] = []
         for basefile in basefiles:
             print("Running test %s/%s" % (alias, basefile))
@@ -217,7 +234,14 @@ def evaltestsuite(testsuitefile):
             results[alias].append({'basefile': basefile,
                                    'elapsed': elapsed,
                                    'refgraph': refgraph})
+        if cachesize:
+            cacheinfo[alias] = tester.cache_info()
     compare(baseline, results)
+    for alias, info in cacheinfo.items():
+        calls = info.hits + info.misses
+        print("%s: parse cache %s hits of %s calls (%.2f percent), %s entries" %
+              (alias, info.hits, calls, (info.hits / calls * 100) if calls else 0,
+               info.currsize))
 
 
 def compare(baseline, results):
@@ -256,11 +280,13 @@ def compare(baseline, results):
     
 if __name__ == '__main__':
     if len(sys.argv) < 2:
-        print("USAGE: %s testsuite.json [--createtest]" % sys.argv[0])
+        print("USAGE: %s testsuite.json [--createtest|--cachesize=N]" % sys.argv[0])
         sys.exit(1)
     testsuite = sys.argv[1]
     assert testsuite.endswith(".json")
     if len(sys.argv) > 2 and sys.argv[2] == "--createtest":
         createtestsuite(testsuite)
+    elif len(sys.argv) > 2 and sys.argv[2].startswith("--cachesize="):
+        evaltestsuite(testsuite, int(sys.argv[2].split("=", 1)[1]))
     else:
         evaltestsuite(testsuite)
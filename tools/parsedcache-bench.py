@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compares the time needed to load distilled RDF/XML files by parsing
+them against loading them from the binary cache created when the
+``parsedcache`` option is set.
+
+Usage: parsedcache-bench.py [--repeat=N] file.rdf [file.rdf ...]
+
+"""
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+# 1 stdlib
+import sys
+import os
+import shutil
+import tempfile
+from timeit import repeat
+
+# 2 third party
+from rdflib import Graph
+
+# 3 own code
+sys.path.append(os.path.normpath(os.getcwd() + os.sep + os.pardir))
+from ferenda import DocumentRepository, util
+
+
+def bench(files, repetitions=5):
+    datadir = tempfile.mkdtemp()
+    try:
+        repo = DocumentRepository(datadir=datadir, parsedcache=True)
+        total_xml = total_cache = 0
+        for idx, f in enumerate(files):
+            basefile = str(idx)
+            distilled = repo.store.distilled_path(basefile)
+            util.ensure_dir(distilled)
+            shutil.copy2(f, distilled)
+            g = Graph().parse(distilled, format="xml")
+            repo.cache_distilled_graph(basefile, g)
+            assert len(repo.distilled_graph(basefile)) == len(g)
+            repo.config.parsedcache = False
+            xml = min(repeat(lambda: repo.distilled_graph(basefile),
+                             number=1, repeat=repetitions))
+            repo.config.parsedcache = True
+            cache = min(repeat(lambda: repo.distilled_graph(basefile),
+                               number=1, repeat=repetitions))
+            print("%s: %s triples, RDF/XML %.4f s, cache %.4f s" %
+                  (f, len(g), xml, cache))
+            total_xml += xml
+            total_cache += cache
+        if total_cache:
+            print("Total: RDF/XML %.3f s, cache %.3f s (%.1fx)" %
+                  (total_xml, total_cache, total_xml / total_cache))
+    finally:
+        shutil.rmtree(datadir)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    repetitions = 5
+    if args and args[0].startswith("--repeat="):
+        repetitions = int(args.pop(0).split("=", 1)[1])
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+    bench(args, repetitions)
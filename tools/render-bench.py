@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measures the time needed by render_xhtml_tree to convert parsed
+documents to XHTML.
+
+Usage: render-bench.py [--repeat=N] [--output=file] repoclass datadir [basefile ...]
+
+Each basefile (or all parseable basefiles in datadir, if none are
+given) is parsed, and the resulting document objects are then
+rendered repeatedly. With --output, the serialized XHTML trees are
+written to the given file, so that the output of different versions
+of the code can be compared.
+
+"""
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+from builtins import *
+# 1 stdlib
+import sys
+import os
+from timeit import repeat
+
+# 2 third party
+from lxml import etree
+
+# 3 own code
+sys.path.append(os.path.normpath(os.getcwd() + os.sep + os.pardir))
+from ferenda.manager import _load_class
+
+
+def bench(repoclass, datadir, basefiles, repetitions=5, output=None):
+    repo = _load_class(repoclass)(datadir=datadir, force=True)
+    docs = []
+    render_xhtml = repo.render_xhtml
+
+    def capture(doc, outfile=None):
+        docs.append(doc)
+        return render_xhtml(doc, outfile)
+    repo.render_xhtml = capture
+    if not basefiles:
+        basefiles = sorted(repo.store.list_basefiles_for("parse"))
+    for basefile in basefiles:
+        repo.parse(basefile)
+    total = 0
+    trees = []
+    for doc in docs:
+        elapsed = min(repeat(lambda: repo.render_xhtml_tree(doc), number=1,
+                             repeat=repetitions))
+        print("%s: %.4f s" % (doc.basefile, elapsed))
+        total += elapsed
+        if output:
+            trees.append(etree.tostring(repo.render_xhtml_tree(doc)))
+    print("Total: %.3f s for %s documents" % (total, len(docs)))
+    if output:
+        with open(output, "wb") as fp:
+            fp.write(b"\n".join(trees))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    kwargs = {}
+    while args and args[0].startswith("--"):
+        key, value = args.pop(0)[2:].split("=", 1)
+        kwargs[{'repeat': 'repetitions'}.get(key, key)] = value
+    if 'repetitions' in kwargs:
+        kwargs['repetitions'] = int(kwargs['repetitions'])
+    if len(args) < 2:
+        print(__doc__)
+        sys.exit(1)
+    bench(args[0], args[1], args[2:], **kwargs)